@@ -0,0 +1,666 @@
+import functools
+import ipaddress
+import json
+import logging
+import socket
+import typing
+import urllib.parse
+from pathlib import Path
+
+import numpy as np
+
+LOG = logging.getLogger(__name__)
+
+# protocol numbers implied by tcp/udp/icmp matches
+PROTOCOL_ICMP = 1
+PROTOCOL_TCP = 6
+PROTOCOL_UDP = 17
+
+# lookup slots that a rule can require a hit in
+_DESTINATION = 0
+_SOURCE = 1
+
+
+class Flow(typing.NamedTuple):
+    """A network flow of a device, to check against the device's behaviour.
+
+    Fields that are None are unknown, so rules that match on them don't match the flow.
+    """
+
+    protocol: typing.Optional[int] = None
+    destination_ip: typing.Optional[str] = None
+    destination_port: typing.Optional[int] = None
+    destination_name: typing.Optional[str] = None
+    source_ip: typing.Optional[str] = None
+    source_port: typing.Optional[int] = None
+    source_name: typing.Optional[str] = None
+    destination_mac: typing.Optional[str] = None
+    source_mac: typing.Optional[str] = None
+    ether_type: typing.Optional[int] = None
+    icmp_type: typing.Optional[int] = None
+    icmp_code: typing.Optional[int] = None
+
+
+class BatchDecision(typing.NamedTuple):
+    """Whether each flow of a batch is allowed, see `BehaviourMatcher.check_batch`"""
+
+    allowed: np.ndarray
+    """Whether each flow is allowed"""
+    rule: np.ndarray
+    """The index in `BehaviourMatcher.rules` of the rule that decided each flow, or -1 if no rule matched it"""
+
+
+class Decision(typing.NamedTuple):
+    """Whether a flow is allowed, and the name of the rule that decided it"""
+
+    allowed: bool
+    rule_name: typing.Optional[str]
+    """None if no rule matched the flow, in which case it isn't allowed"""
+
+
+def _parse_mac(mac: str) -> int:
+    return int(mac.replace(":", "").replace("-", ""), 16)
+
+
+def _parse_ip(ip: str) -> typing.Tuple[int, int]:
+    """Parses an IP address to its version and integer value"""
+    try:
+        # much faster than `ipaddress` for the common case
+        return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, ip), "big")
+    except OSError:
+        address = ipaddress.ip_address(ip)
+        return address.version, int(address)
+
+
+def _dns_labels(name: str) -> typing.List[str]:
+    """Splits a DNS name into its labels, from the top-level domain down"""
+    return name.lower().rstrip(".").split(".")[::-1]
+
+
+def _dns_host(addr: str) -> str:
+    """Returns the host of a DNS `addr`, which may be a URL, e.g. in malicious behaviours"""
+    if "://" in addr:
+        return urllib.parse.urlsplit(addr).hostname or ""
+    return addr
+
+
+def _as_ip_network(addr: str) -> typing.Optional[typing.Union[ipaddress.IPv4Network, ipaddress.IPv6Network]]:
+    try:
+        return ipaddress.ip_network(addr, strict=False)
+    except ValueError:
+        return None
+
+
+def _expand(rows: np.ndarray, starts: np.ndarray, counts: np.ndarray) -> typing.Tuple[np.ndarray, np.ndarray]:
+    """Expands each row into `count` pairs of the row and consecutive indexes from `start`"""
+    pair_rows = np.repeat(rows, counts)
+    group_starts = np.repeat(np.cumsum(counts) - counts, counts)
+    return pair_rows, np.repeat(starts, counts) + np.arange(len(pair_rows)) - group_starts
+
+
+def _group_pairs(rows: np.ndarray, rules: np.ndarray, *keys: np.ndarray) -> typing.Tuple[np.ndarray, np.ndarray]:
+    """Sorts (row, rule) pairs, then by `keys`
+
+    Returns:
+        The order of the pairs, and where each group of equal (row, rule) pairs starts in that order
+    """
+    order = np.lexsort((*keys[::-1], rules, rows))
+    rows, rules = rows[order], rules[order]
+    is_start = np.ones(len(rows), dtype=bool)
+    is_start[1:] = (rows[1:] != rows[:-1]) | (rules[1:] != rules[:-1])
+    return order, np.flatnonzero(is_start)
+
+
+def _and_pairs(
+    rows: np.ndarray, rules: np.ndarray, allowed: np.ndarray
+) -> typing.Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Merges equal (row, rule) pairs, which allow a flow only if all of them do
+
+    Returns:
+        The unique (row, rule) pairs, whether they allow the flow, and how many pairs were merged into each
+    """
+    if len(rows) == 0:
+        return rows, rules, allowed, np.zeros(0, dtype=np.int64)
+    order, starts = _group_pairs(rows, rules)
+    return (
+        rows[order][starts],
+        rules[order][starts],
+        np.logical_and.reduceat(allowed[order], starts),
+        np.diff(np.append(starts, len(rows))),
+    )
+
+
+def _no_pairs() -> typing.Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=bool)
+
+
+class _PrefixTable:
+    """Longest-prefix match of IP addresses against the CIDRs of many rules.
+
+    Prefixes are kept in a hash table per prefix length, so a lookup is one
+    hash lookup per distinct prefix length, longest first.
+    """
+
+    def __init__(self):
+        self._tables: typing.Dict[int, typing.Dict[int, typing.Dict[int, typing.Dict[int, bool]]]] = {4: {}, 6: {}}
+        self._lengths: typing.Dict[int, typing.List[typing.Tuple[int, int, dict]]] = {4: [], 6: []}
+
+    def add(self, network, rule: int, allowed: bool) -> None:
+        table = self._tables[network.version].setdefault(network.prefixlen, {})
+        prefix = int(network.network_address) >> (network.max_prefixlen - network.prefixlen)
+        # later (i.e. deeper in the tree) nodes take precedence for the same prefix
+        table.setdefault(prefix, {})[rule] = allowed
+
+    def freeze(self) -> None:
+        for version, tables in self._tables.items():
+            max_prefixlen = 32 if version == 4 else 128
+            self._lengths[version] = [
+                (prefixlen, max_prefixlen - prefixlen, table)
+                for prefixlen, table in sorted(tables.items(), reverse=True)
+            ]
+
+    def __bool__(self) -> bool:
+        return any(self._lengths.values())
+
+    @functools.cached_property
+    def _ip4_arrays(self) -> typing.List[typing.Tuple[int, int, np.ndarray, np.ndarray, np.ndarray, np.ndarray]]:
+        """The IPv4 prefixes of each length as sorted arrays, with the (rule, allowed) entries of each prefix"""
+        arrays = []
+        for prefixlen, host_bits, table in self._lengths[4]:
+            prefixes = sorted(table)
+            entries = [(rule, allowed) for prefix in prefixes for rule, allowed in table[prefix].items()]
+            arrays.append((
+                prefixlen,
+                host_bits,
+                np.array(prefixes, dtype=np.int64),
+                np.cumsum([0] + [len(table[prefix]) for prefix in prefixes], dtype=np.int64),
+                np.array([rule for rule, _allowed in entries], dtype=np.int64),
+                np.array([allowed for _rule, allowed in entries], dtype=bool),
+            ))
+        return arrays
+
+    def lookup_batch(self, values: np.ndarray) -> typing.Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Vectorized `lookup` of IPv4 addresses
+
+        Args:
+            values: IPv4 addresses as integers, or -1 for unknown addresses
+
+        Returns:
+            Pairs of row and rule with a prefix containing the address,
+            and whether the longest such prefix of the rule allows it
+        """
+        valid_rows = np.flatnonzero(values >= 0)
+        valid_values = values[valid_rows]
+        pairs = []
+        for prefixlen, host_bits, prefixes, offsets, entry_rules, entry_allowed in self._ip4_arrays:
+            keys = valid_values >> host_bits
+            positions = np.minimum(np.searchsorted(prefixes, keys), len(prefixes) - 1)
+            hit = prefixes[positions] == keys
+            positions = positions[hit]
+            rows, entries = _expand(valid_rows[hit], offsets[positions], offsets[positions + 1] - offsets[positions])
+            pairs.append((rows, entry_rules[entries], entry_allowed[entries], np.full(len(rows), prefixlen)))
+        if not pairs:
+            return _no_pairs()
+        rows, rules, allowed, prefixlens = (np.concatenate(arrays) for arrays in zip(*pairs))
+        if len(rows) == 0:
+            return _no_pairs()
+        order, starts = _group_pairs(rows, rules, prefixlens)
+        # the longest prefix of each rule decides, which is the last of each group
+        ends = order[np.append(starts[1:], len(rows)) - 1]
+        return rows[ends], rules[ends], allowed[ends]
+
+    def lookup(self, version: int, value: int) -> typing.Dict[int, bool]:
+        """Returns map of each rule with a prefix containing an IP address
+        (see `_parse_ip`) to the allowed value of its longest prefix"""
+        hits: typing.Dict[int, bool] = {}
+        for _prefixlen, host_bits, table in self._lengths[version]:
+            rules = table.get(value >> host_bits)
+            if rules:
+                for rule, allowed in rules.items():
+                    hits.setdefault(rule, allowed)
+        return hits
+
+
+class _DnsTrieNode:
+    __slots__ = ("children", "rules", "subdomain_rules")
+
+    def __init__(self):
+        self.children: typing.Dict[str, "_DnsTrieNode"] = {}
+        # rules matching this name and its subdomains
+        self.rules: typing.Dict[int, bool] = {}
+        # rules only matching the subdomains of this name, i.e. `*.example.com`
+        self.subdomain_rules: typing.Dict[int, bool] = {}
+
+
+class _DnsTrie:
+    """Suffix match of DNS names against the domains of many rules,
+    as a trie of the domains' labels in reverse order (e.g. `com` -> `example` -> `www`)"""
+
+    def __init__(self):
+        self.root = _DnsTrieNode()
+
+    def add(self, domain: str, rule: int, allowed: bool) -> None:
+        labels = _dns_labels(domain)
+        subdomains_only = labels[-1] == "*"
+        if subdomains_only:
+            labels.pop()
+        node = self.root
+        for label in labels:
+            node = node.children.setdefault(label, _DnsTrieNode())
+        (node.subdomain_rules if subdomains_only else node.rules)[rule] = allowed
+
+    def lookup(self, name: str) -> typing.Dict[int, bool]:
+        """Returns map of each rule with a domain matching `name` to the allowed value of its most specific domain"""
+        hits: typing.Dict[int, bool] = {}
+        node = self.root
+        for label in _dns_labels(name):
+            if node.subdomain_rules:
+                hits.update(node.subdomain_rules)
+            node = node.children.get(label)
+            if node is None:
+                return hits
+            if node.rules:
+                hits.update(node.rules)
+        return hits
+
+    def lookup_batch(self, names: np.ndarray) -> typing.Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Vectorized `lookup` of DNS names, looking up each distinct name once
+
+        Args:
+            names: DNS names, or empty strings for unknown names
+
+        Returns:
+            Pairs of row and rule with a domain matching the name,
+            and whether the most specific such domain of the rule allows it
+        """
+        unique_names, inverse = np.unique(names, return_inverse=True)
+        unique_hits = [self.lookup(name) if name else {} for name in unique_names.tolist()]
+        counts = np.array([len(hits) for hits in unique_hits], dtype=np.int64)
+        offsets = np.cumsum(counts) - counts
+        entry_rules = np.array([rule for hits in unique_hits for rule in hits], dtype=np.int64)
+        entry_allowed = np.array([allowed for hits in unique_hits for allowed in hits.values()], dtype=bool)
+        inverse = inverse.reshape(-1)
+        rows = np.flatnonzero(counts[inverse])
+        rows, entries = _expand(rows, offsets[inverse[rows]], counts[inverse[rows]])
+        return rows, entry_rules[entries], entry_allowed[entries]
+
+
+def _is_within(parent_addr: str, child_addr: str, is_dns: bool) -> bool:
+    """Checks whether a child node of an allow/disallow tree is within its parent node"""
+    if is_dns:
+        parent_labels = [label for label in _dns_labels(_dns_host(parent_addr)) if label != "*"]
+        return _dns_labels(_dns_host(child_addr))[:len(parent_labels)] == parent_labels
+    parent_network, child_network = _as_ip_network(parent_addr), _as_ip_network(child_addr)
+    return (
+        parent_network is not None and child_network is not None
+        and child_network.version == parent_network.version and child_network.subnet_of(parent_network)
+    )
+
+
+class _Rule:
+    __slots__ = ("name", "malicious", "slots", "equals", "macs")
+
+    def __init__(self, name: str, malicious: bool):
+        self.name = name
+        self.malicious = malicious
+        # the lookups (destination/source) that must have a hit for the rule to match
+        self.slots: typing.Set[int] = set()
+        # pairs of Flow field index and the value it must be equal to
+        self.equals: typing.List[typing.Tuple[int, typing.Any]] = []
+        # triples of Flow field index, MAC address, and mask
+        self.macs: typing.List[typing.Tuple[int, int, int]] = []
+
+
+class BehaviourMatcher:
+    """Checks whether network flows are allowed by the rules of a D3 behaviour claim.
+
+    The rules are compiled once, so that checking a flow only looks at the rules that could match it:
+    destination/source IPs are matched with prefix tables, DNS names with reversed-label tries,
+    and rules without addresses are found by protocol and destination port in port tables.
+
+    Destination address trees (`addr`/`allowed`/`children`) are matched like they are rendered by
+    `d3_to_markdown._getRules`: the most specific node containing the address decides, so children
+    are exceptions to their parents. A flow is allowed if a rule matches it, and none of the
+    matching rules disallow it, or are malicious.
+    """
+
+    def __init__(self, rules: typing.Iterable[dict], malicious: bool = False):
+        """
+        Args:
+            rules: The `rules` of a built D3 behaviour claim, including its inherited rules
+            malicious: Whether every rule is malicious, e.g. for the behaviours of URLhaus URLs
+        """
+        self.rules: typing.List[_Rule] = []
+        self._ip_tables = (_PrefixTable(), _PrefixTable())
+        self._dns_tries = (_DnsTrie(), _DnsTrie())
+        # rules that don't match on addresses, by protocol and destination port (None for any)
+        self._port_tables: typing.Dict[typing.Tuple[typing.Optional[int], typing.Optional[int]], typing.List[int]] = {}
+        for rule in rules:
+            self._add_rule(rule, malicious)
+        for ip_table in self._ip_tables:
+            ip_table.freeze()
+
+    @classmethod
+    def from_claim(cls, behaviour_json: dict) -> "BehaviourMatcher":
+        """Compiles the rules of a built D3 behaviour claim"""
+        subject = behaviour_json["credentialSubject"]
+        return cls(subject.get("rules", []), malicious=subject.get("malicious", False))
+
+    def _add_tree(self, tree: dict, rule: int, slot: int, is_dns: bool) -> None:
+        def add_node(node: dict):
+            # like `d3_to_markdown._format_rule`, nodes are allowed unless they say otherwise
+            allowed = node.get("allowed", True)
+            addr = node["addr"]
+            host = _dns_host(addr) if is_dns else addr
+            network = _as_ip_network(host)
+            if network is not None:
+                self._ip_tables[slot].add(network, rule, allowed)
+            elif is_dns:
+                self._dns_tries[slot].add(host, rule, allowed)
+            else:
+                LOG.warning(f"Ignoring invalid IP address {addr!r} in rule {self.rules[rule].name!r}")
+            for child in node.get("children", []):
+                if _is_within(addr, child["addr"], is_dns):
+                    add_node(child)
+                else:
+                    LOG.warning(
+                        f"Ignoring {child['addr']!r} in rule {self.rules[rule].name!r}, as it isn't within {addr!r}"
+                    )
+
+        self.rules[rule].slots.add(slot)
+        add_node(tree)
+
+    def _add_rule(self, rule_json: dict, malicious: bool) -> None:
+        index = len(self.rules)
+        rule = _Rule(rule_json.get("ruleName", rule_json.get("name")), malicious or rule_json.get("malicious", False))
+        self.rules.append(rule)
+        matches = rule_json.get("matches", {})
+
+        protocol = None
+        for ip_version in ("ip4", "ip6"):
+            ip = matches.get(ip_version, {})
+            protocol = ip.get("protocol", protocol)
+            for key, slot in (
+                (f"destination{ip_version.capitalize()}", _DESTINATION),
+                (f"source{ip_version.capitalize()}", _SOURCE),
+            ):
+                if key in ip:
+                    addr = ip[key]
+                    self._add_tree(addr if isinstance(addr, dict) else {"addr": addr}, index, slot, is_dns=False)
+            # both spellings are in use
+            for key, slot in (
+                ("destinationDnsName", _DESTINATION),
+                ("destinationDnsname", _DESTINATION),
+                ("sourceDnsName", _SOURCE),
+                ("sourceDnsname", _SOURCE),
+            ):
+                if key in ip:
+                    addr = ip[key]
+                    self._add_tree(addr if isinstance(addr, dict) else {"addr": addr}, index, slot, is_dns=True)
+
+        destination_port = None
+        for transport, transport_protocol in (("tcp", PROTOCOL_TCP), ("udp", PROTOCOL_UDP)):
+            if transport in matches:
+                rule.equals.append((Flow._fields.index("protocol"), transport_protocol))
+                destination_port = matches[transport].get("destinationPort", destination_port)
+                if "sourcePort" in matches[transport]:
+                    rule.equals.append((Flow._fields.index("source_port"), matches[transport]["sourcePort"]))
+        if "icmp" in matches:
+            rule.equals.append((Flow._fields.index("protocol"), PROTOCOL_ICMP))
+            for key, field in (("type", "icmp_type"), ("code", "icmp_code")):
+                if key in matches["icmp"]:
+                    rule.equals.append((Flow._fields.index(field), matches["icmp"][key]))
+
+        eth = matches.get("eth", {})
+        for key, field in (("destinationMac", "destination_mac"), ("sourceMac", "source_mac")):
+            if key in eth:
+                mask = _parse_mac(eth.get(f"{key}Mask", "ff:ff:ff:ff:ff:ff"))
+                rule.macs.append((Flow._fields.index(field), _parse_mac(eth[key]) & mask, mask))
+        ether_type = eth.get("etherType", eth.get("ethertype"))
+        if ether_type is not None:
+            rule.equals.append((Flow._fields.index("ether_type"), ether_type))
+
+        if rule.slots:
+            # found by address, so check the protocol and port after
+            if protocol is not None:
+                rule.equals.append((Flow._fields.index("protocol"), protocol))
+            if destination_port is not None:
+                rule.equals.append((Flow._fields.index("destination_port"), destination_port))
+        else:
+            self._port_tables.setdefault((protocol, destination_port), []).append(index)
+
+    def _matches(self, rule: _Rule, flow: Flow) -> bool:
+        for field, value in rule.equals:
+            if flow[field] != value:
+                return False
+        for field, mac, mask in rule.macs:
+            if flow[field] is None or _parse_mac(flow[field]) & mask != mac:
+                return False
+        return True
+
+    def _slot_hits(self, slot: int, ip: typing.Optional[str], name: typing.Optional[str]) -> typing.Dict[int, bool]:
+        """Finds the rules with an address matching the destination or source of a flow
+
+        Returns:
+            Map of each rule to whether its matching address allows the flow
+        """
+        hits = self._ip_tables[slot].lookup(*_parse_ip(ip)) if ip is not None and self._ip_tables[slot] else {}
+        if name is not None:
+            for rule, allowed in self._dns_tries[slot].lookup(name).items():
+                hits[rule] = hits.get(rule, True) and allowed
+        return hits
+
+    def check(self, flow: Flow) -> Decision:
+        """Checks whether a flow is allowed
+
+        Args:
+            flow: The flow to check
+
+        Returns:
+            Whether the flow is allowed, and which rule decided it.
+            Disallowing and malicious rules take precedence over allowing rules.
+        """
+        destination_hits = self._slot_hits(_DESTINATION, flow.destination_ip, flow.destination_name)
+        source_hits = self._slot_hits(_SOURCE, flow.source_ip, flow.source_name)
+        candidates = []
+        for rule, allowed in destination_hits.items():
+            if _SOURCE in self.rules[rule].slots:
+                if rule not in source_hits:
+                    continue
+                allowed = allowed and source_hits[rule]
+            candidates.append((rule, allowed))
+        for rule, allowed in source_hits.items():
+            if _DESTINATION not in self.rules[rule].slots:
+                candidates.append((rule, allowed))
+        if self._port_tables:
+            port_keys = dict.fromkeys((
+                (flow.protocol, flow.destination_port),
+                (flow.protocol, None),
+                (None, flow.destination_port),
+                (None, None),
+            ))
+            for port_key in port_keys:
+                candidates.extend((rule, True) for rule in self._port_tables.get(port_key, ()))
+
+        decision = Decision(allowed=False, rule_name=None)
+        for index, allowed in sorted(candidates):
+            rule = self.rules[index]
+            if not self._matches(rule, flow):
+                continue
+            if rule.malicious or not allowed:
+                return Decision(allowed=False, rule_name=rule.name)
+            if decision.rule_name is None:
+                decision = Decision(allowed=True, rule_name=rule.name)
+        return decision
+
+    def is_allowed(self, flow: Flow) -> bool:
+        """Checks whether a flow is allowed, see `check`"""
+        return self.check(flow).allowed
+
+    @functools.cached_property
+    def _rule_arrays(self) -> typing.Tuple[np.ndarray, np.ndarray]:
+        """The number of slots, and whether it's malicious, of each rule"""
+        return (
+            np.array([len(rule.slots) for rule in self.rules], dtype=np.int64),
+            np.array([rule.malicious for rule in self.rules], dtype=bool),
+        )
+
+    def check_batch(self, columns: typing.Mapping[str, np.ndarray]) -> BatchDecision:
+        """Checks whether many flows are allowed, vectorized, with the same result as `check` for each flow
+
+        Args:
+            columns: Map of `Flow` field name to an array of the field for each flow, all of the same length.
+                     IPs (IPv4 only) and MACs are integers, DNS names are strings, and other fields are integers.
+                     Unknown values are -1, or empty strings for DNS names. Missing fields are unknown.
+
+        Returns:
+            Whether each flow is allowed, and the rule that decided it
+        """
+        n_flows = len(next(iter(columns.values()))) if columns else 0
+        # find the (flow, rule) pairs with a hit in every slot of the rule
+        slot_pairs = []
+        for slot, ip_field, name_field in (
+            (_DESTINATION, "destination_ip", "destination_name"),
+            (_SOURCE, "source_ip", "source_name"),
+        ):
+            hits = []
+            if columns.get(ip_field) is not None and self._ip_tables[slot]:
+                hits.append(self._ip_tables[slot].lookup_batch(columns.get(ip_field)))
+            if columns.get(name_field) is not None:
+                hits.append(self._dns_tries[slot].lookup_batch(columns.get(name_field)))
+            if hits:
+                slot_pairs.append(_and_pairs(*(np.concatenate(arrays) for arrays in zip(*hits)))[:3])
+        pairs = []
+        if slot_pairs:
+            rows, rules, allowed, n_slots = _and_pairs(*(np.concatenate(arrays) for arrays in zip(*slot_pairs)))
+            has_all_slots = n_slots == self._rule_arrays[0][rules]
+            pairs.append((rows[has_all_slots], rules[has_all_slots], allowed[has_all_slots]))
+
+        for (protocol, destination_port), port_rules in self._port_tables.items():
+            selected = np.ones(n_flows, dtype=bool)
+            for field, value in (("protocol", protocol), ("destination_port", destination_port)):
+                if value is not None:
+                    selected &= columns.get(field) == value if columns.get(field) is not None else False
+            rows = np.flatnonzero(selected)
+            for rule in port_rules:
+                pairs.append((rows, np.full(len(rows), rule, dtype=np.int64), np.ones(len(rows), dtype=bool)))
+
+        rows, rules, allowed = (np.concatenate(arrays) for arrays in zip(*pairs)) if pairs else _no_pairs()
+
+        # then check the other fields of each rule, for all its pairs at once
+        order = np.argsort(rules, kind="stable")
+        rows, rules, allowed = rows[order], rules[order], allowed[order]
+        matched = np.ones(len(rows), dtype=bool)
+        rule_starts = np.flatnonzero(np.diff(rules, prepend=-1))
+        for start, end in zip(rule_starts.tolist(), np.append(rule_starts[1:], len(rules)).tolist()):
+            rule = self.rules[rules[start]]
+            rule_rows = rows[start:end]
+            for field, value in rule.equals:
+                values = columns.get(Flow._fields[field])
+                matched[start:end] &= values[rule_rows] == value if values is not None else False
+            for field, mac, mask in rule.macs:
+                values = columns.get(Flow._fields[field])
+                if values is None:
+                    matched[start:end] = False
+                else:
+                    macs = values[rule_rows]
+                    matched[start:end] &= (macs >= 0) & (macs & mask == mac)
+        rows, rules, allowed = rows[matched], rules[matched], allowed[matched]
+
+        # like `check`, the first disallowing rule decides, otherwise the first allowing rule
+        no_rule = len(self.rules)
+        denies = ~allowed | self._rule_arrays[1][rules]
+        first_deny = np.full(n_flows, no_rule, dtype=np.int64)
+        np.minimum.at(first_deny, rows[denies], rules[denies])
+        first_allow = np.full(n_flows, no_rule, dtype=np.int64)
+        np.minimum.at(first_allow, rows[~denies], rules[~denies])
+        is_denied = first_deny < no_rule
+        is_allowed = ~is_denied & (first_allow < no_rule)
+        return BatchDecision(
+            allowed=is_allowed,
+            rule=np.where(is_denied, first_deny, np.where(is_allowed, first_allow, -1)),
+        )
+
+
+class TypeBehaviourMatchers:
+    """The compiled behaviours of the D3 types in a build output directory, for checking the flows of devices"""
+
+    def __init__(
+        self,
+        type_behaviours: typing.Mapping[str, str],
+        behaviour_matchers: typing.Mapping[str, BehaviourMatcher],
+        malicious_matcher: typing.Optional[BehaviourMatcher] = None,
+        malicious_rule_behaviours: typing.Sequence[str] = (),
+    ):
+        """
+        Args:
+            type_behaviours: Map of type ID to the ID of its behaviour
+            behaviour_matchers: Map of behaviour ID to its compiled rules
+            malicious_matcher: The compiled rules of all malicious behaviours, which apply to every type
+            malicious_rule_behaviours: The ID of the malicious behaviour of each rule of `malicious_matcher`
+        """
+        self.type_behaviours = dict(type_behaviours)
+        self.behaviour_matchers = dict(behaviour_matchers)
+        self.malicious_matcher = malicious_matcher
+        self.malicious_rule_behaviours = list(malicious_rule_behaviours)
+
+    @classmethod
+    def from_build_dir(cls, build_dir: Path, include_malicious: bool = True) -> "TypeBehaviourMatchers":
+        """Compiles the behaviours of the types built by `d3_build`
+
+        Args:
+            build_dir: The build output directory
+            include_malicious: Whether to disallow the flows matched by malicious behaviours
+
+        Returns:
+            The compiled behaviours
+        """
+        type_behaviours = {}
+        behaviour_jsons = {}
+        malicious_rules = []
+        malicious_rule_behaviours = []
+        for json_file in sorted(Path(build_dir).glob("**/*.d3.json")):
+            with open(json_file) as f:
+                claim = json.load(f)
+            subject = claim["credentialSubject"]
+            if json_file.name.endswith(".type.d3.json") and isinstance(subject.get("behaviour"), dict):
+                type_behaviours[subject["id"]] = subject["behaviour"]["id"]
+            elif json_file.name.endswith(".behaviour.d3.json"):
+                if subject.get("malicious", False):
+                    if include_malicious:
+                        malicious_rules.extend(subject.get("rules", []))
+                        malicious_rule_behaviours.extend([subject["id"]] * len(subject.get("rules", [])))
+                else:
+                    behaviour_jsons[subject["id"]] = claim
+        return cls(
+            type_behaviours,
+            {
+                behaviour_id: BehaviourMatcher.from_claim(behaviour_jsons[behaviour_id])
+                for behaviour_id in set(type_behaviours.values()) if behaviour_id in behaviour_jsons
+            },
+            BehaviourMatcher(malicious_rules, malicious=True) if malicious_rules else None,
+            malicious_rule_behaviours,
+        )
+
+    def check(self, type_id: str, flow: Flow) -> Decision:
+        """Checks whether a flow is allowed for a device of a D3 type
+
+        Args:
+            type_id: The ID of the device's D3 type
+            flow: The flow to check
+
+        Returns:
+            Whether the flow is allowed, and which rule decided it
+
+        Raises:
+            KeyError: If the type doesn't exist or has no behaviour
+        """
+        if self.malicious_matcher is not None:
+            decision = self.malicious_matcher.check(flow)
+            if decision.rule_name is not None:
+                return decision
+        return self.behaviour_matchers[self.type_behaviours[type_id]].check(flow)
+
+    def is_allowed(self, type_id: str, flow: Flow) -> bool:
+        """Checks whether a flow is allowed for a device of a D3 type, see `check`"""
+        return self.check(type_id, flow).allowed
@@ -0,0 +1,187 @@
+import hashlib
+import json
+import logging
+from pathlib import Path
+from typing import Dict, Mapping, Optional
+
+from .guid_tools import get_parent_claims
+from .check_behaviours_resolve import BehaviourMap, BehaviourIndex
+
+try:
+    from importlib.metadata import version
+    _d3_cli_version = version("d3-cli")
+except Exception:
+    _d3_cli_version = "local dev version"
+
+BUILD_CACHE_FILENAME = ".d3-build-cache.json"
+# bump this whenever the build output changes for the same input claims
+BUILD_CACHE_FORMAT = 1
+LOG = logging.getLogger(__name__)
+
+
+def hash_bytes(data: bytes) -> str:
+    """Returns the hex sha256 digest of the given bytes"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(file_name: str) -> str:
+    """Returns the hex sha256 digest of the contents of a file
+
+    Args:
+        file_name: The filepath of the file to hash
+
+    Returns:
+        The sha256 digest of the file contents
+    """
+    with open(file_name, "rb") as f:
+        return hash_bytes(f.read())
+
+
+def _hash_parts(*parts) -> str:
+    return hash_bytes(json.dumps(parts, separators=(",", ":")).encode("utf-8"))
+
+
+class LineageHasher:
+    """Computes a digest for each claim covering its own content and
+    the content of every claim that its built JSON depends on.
+
+    A claim's build output depends on:
+    - its parents (and recursively their ancestors), whose rules/properties it inherits
+    - for types, its direct children, whose names are written into the claim
+    - for types, its own and inherited vulnerabilities, which may have been
+      found in CVE data instead of being part of any claim file
+    - the behaviour it references, whose id and ruleName are written into the claim
+    - for firmware, the type it belongs to, from which it may inherit a behaviour
+
+    Must only be used once the claim graphs have been checked for cycles.
+    """
+
+    def __init__(
+        self,
+        file_hashes: Mapping[str, str],
+        file_ids: Mapping[str, str],
+        behaviour_map: BehaviourMap,
+        type_map: BehaviourMap,
+    ):
+        """
+        Args:
+            file_hashes: Map of claim filepath to the hash of its contents
+            file_ids: Map of claim filepath to its claim GUID
+            behaviour_map: Map of behaviour GUID to behaviour claim
+            type_map: Map of type GUID to type claim (as returned by `build_type_map`)
+        """
+        self.file_hashes = file_hashes
+        self.id_hashes = {
+            claim_id: file_hashes[file_name] for file_name, claim_id in file_ids.items()
+        }
+        self.behaviour_map = behaviour_map
+        self.type_map = type_map
+        self.behaviour_index = BehaviourIndex(behaviour_map.values())
+        self._digests: Dict[str, str] = {}
+
+    def _behaviour_digest(self, behaviour: Optional[str]) -> Optional[str]:
+        if behaviour is None:
+            return None
+        behaviour_claim = self.behaviour_index.get(behaviour)
+        if behaviour_claim is None:
+            return "missing"
+        return self.id_digest(behaviour_claim["credentialSubject"]["id"])
+
+    def id_digest(self, claim_id: str) -> str:
+        """Returns the lineage digest of a type/behaviour claim by GUID"""
+        if claim_id in self._digests:
+            return self._digests[claim_id]
+        claim = self.type_map.get(claim_id) or self.behaviour_map.get(claim_id)
+        if claim is None:
+            return "missing"
+        subject = claim["credentialSubject"]
+        parts = [
+            self.id_hashes.get(claim_id),
+            [self.id_digest(parent_id) for parent_id in get_parent_claims(claim)],
+        ]
+        if claim_id in self.type_map:
+            parts.append([self.id_hashes.get(child["id"]) for child in subject.get("children", [])])
+            # the type map holds the vulnerabilities of the type and its ancestors, including found CVEs
+            parts.append(sorted(subject.get("vulnerabilities", [])))
+            behaviour = subject.get("behaviour")
+            # behaviours may already have been resolved to {id, name}
+            if isinstance(behaviour, dict):
+                behaviour = behaviour["id"]
+            parts.append(self._behaviour_digest(behaviour))
+        digest = _hash_parts(*parts)
+        self._digests[claim_id] = digest
+        return digest
+
+    def file_digest(self, file_name: str, claim: dict) -> str:
+        """Returns the lineage digest of the claim loaded from `file_name`"""
+        subject = claim.get("credentialSubject", {})
+        claim_id = subject.get("id")
+        if claim_id in self.type_map or claim_id in self.behaviour_map:
+            return _hash_parts(self.file_hashes[file_name], self.id_digest(claim_id))
+        # firmware and vulnerability claims aren't part of the claim graphs
+        firmware_type = subject.get("type")
+        return _hash_parts(
+            self.file_hashes[file_name],
+            self.id_digest(firmware_type) if firmware_type else None,
+            self._behaviour_digest(subject.get("behaviour")),
+        )
+
+
+class BuildCache:
+    """On-disk manifest of the lineage digest of every claim written to an output directory.
+
+    Lets `d3_build` skip claims whose content and lineage are unchanged since the last build.
+    """
+
+    def __init__(self, output_dir: Path, settings: Optional[dict] = None):
+        """
+        Args:
+            output_dir: The build output directory the manifest lives in
+            settings: Build settings that affect the output. If these differ
+                      from the previous build, the whole cache is invalidated.
+        """
+        self.output_dir = Path(output_dir)
+        self.manifest_path = self.output_dir / BUILD_CACHE_FILENAME
+        self.settings = {
+            "format": BUILD_CACHE_FORMAT,
+            "version": _d3_cli_version,
+            **(settings or {}),
+        }
+        self.entries = self._load()
+        self.new_entries: Dict[str, str] = {}
+
+    def _load(self) -> Dict[str, str]:
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+        if manifest.get("settings") != self.settings:
+            LOG.info("Build settings changed, ignoring build cache")
+            return {}
+        return manifest.get("claims", {})
+
+    def _key(self, json_file_name) -> str:
+        return Path(json_file_name).relative_to(self.output_dir).as_posix()
+
+    def is_fresh(self, json_file_name, digest: str) -> bool:
+        """Checks whether a built claim is up to date
+
+        Args:
+            json_file_name: The filepath of the built claim JSON
+            digest: The current lineage digest of the claim
+
+        Returns:
+            Boolean indicating the built JSON exists and was built from the same lineage
+        """
+        return self.entries.get(self._key(json_file_name)) == digest and Path(json_file_name).exists()
+
+    def record(self, json_file_name, digest: str) -> None:
+        """Records that a built claim is up to date with the given lineage digest"""
+        self.new_entries[self._key(json_file_name)] = digest
+
+    def save(self) -> None:
+        """Writes the manifest, dropping any claims not recorded in this build"""
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        with open(self.manifest_path, "w") as f:
+            json.dump({"settings": self.settings, "claims": self.new_entries}, f, indent=2, sort_keys=True)
@@ -1,18 +1,70 @@
-from typing import Sequence, Callable, TypeVar, Mapping, Dict, Any
+from types import MappingProxyType
+from typing import Iterable, Optional, Sequence, Mapping, Dict, Any, Union
 
 BehaviourJson = Mapping[str, Any]
 BehaviourJsons = Sequence[BehaviourJson]
 BehaviourMap = Dict[str, BehaviourJson]
 
 
+class BehaviourIndex:
+    """Immutable lookup of behaviour claims by GUID and by ruleName.
+
+    Build it once per build and share it, e.g. in the build context of each worker,
+    so that resolving a claim's behaviour takes constant time.
+    """
+
+    __slots__ = ("by_id", "by_name")
+
+    def __init__(self, behaviour_jsons: Iterable[BehaviourJson]):
+        """
+        Args:
+            behaviour_jsons: The behaviour claims to index
+        """
+        by_id = {}
+        by_name = {}
+        for json in behaviour_jsons:
+            subject = json["credentialSubject"]
+            by_id[subject["id"]] = json
+            if "ruleName" in subject:
+                by_name[subject["ruleName"]] = json
+        self._set_maps(by_id, by_name)
+
+    def _set_maps(self, by_id: BehaviourMap, by_name: BehaviourMap) -> None:
+        object.__setattr__(self, "by_id", MappingProxyType(by_id))
+        object.__setattr__(self, "by_name", MappingProxyType(by_name))
+
+    @classmethod
+    def _from_maps(cls, by_id: BehaviourMap, by_name: BehaviourMap) -> "BehaviourIndex":
+        index = cls.__new__(cls)
+        index._set_maps(by_id, by_name)
+        return index
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __reduce__(self):
+        # mapping proxies can't be pickled, so send the underlying maps to worker processes
+        return (type(self)._from_maps, (dict(self.by_id), dict(self.by_name)))
+
+    def __len__(self) -> int:
+        return len(self.by_id)
+
+    def get(self, name: str) -> Optional[BehaviourJson]:
+        """Finds the behaviour with GUID `name`, or else with ruleName `name`"""
+        behaviour = self.by_id.get(name)
+        if behaviour is None:
+            behaviour = self.by_name.get(name)
+        return behaviour
+
+
 def check_behaviours_resolve(
-    json_data: dict, schema: dict, behaviour_jsons: BehaviourJsons,
+    json_data: dict, schema: dict, behaviour_jsons: Union[BehaviourIndex, BehaviourJsons],
 ) -> dict:
     """Checks whether behaviours resolve, throws if not.
     Args:
         json_data: The JSON object to check
         schema: The JSON schema to use
-        behaviour_jsons: The list of behaviour JSONs to check
+        behaviour_jsons: The index of behaviours, or the list of behaviour JSONs to check
     Returns:
         Behaviour JSON object
     """
@@ -31,58 +83,17 @@ def check_behaviours_resolve(
     return json_data
 
 
-def retrieve_behaviour(name: str, behaviour_jsons: BehaviourJsons) -> bool:
-    """Checks whether a behaviour exists with name or id = value.
+def retrieve_behaviour(
+    name: str, behaviour_jsons: Union[BehaviourIndex, BehaviourJsons]
+) -> Optional[BehaviourJson]:
+    """Finds the behaviour with name or id = value.
     Args:
         name: The value to check
-        behaviour_jsons: The list of behaviours to check
+        behaviour_jsons: The index of behaviours, or the list of behaviours to check.
+                         Pass a `BehaviourIndex` when looking up many behaviours.
     Returns:
-        Boolean indicating if the behaviour exists
+        The behaviour JSON, or None if no behaviour matches
     """
-    id_map = _behaviour_id_map(behaviour_jsons)
-    if name in id_map:
-        return id_map[name]
-    name_map = _behaviour_name_map(behaviour_jsons)
-    if name in name_map:
-        return name_map[name]
-    return None
-
-
-T = TypeVar("T")
-
-
-def _cache_map_based_on_behaviour_jsons(
-    f: Callable[[BehaviourJsons], T]
-) -> Callable[[BehaviourJsons], T]:
-    """Decorator that caches the result of a function based on the ID of behaviour_jsons.
-
-    We can't use @functools.lru_cache because it doesn't work with lists/dicts, since
-    lists and dicts are mutable.
-
-    Instead, we rely on the user not to change the behaviour_jsons list contents after the
-    first call.
-    """
-    behaviour_jsons_id = None
-    behaviour_jsons_map = None
-
-    def wrapper(behaviour_jsons: BehaviourJsons):
-        nonlocal behaviour_jsons_id
-        nonlocal behaviour_jsons_map
-
-        current_behaviour_jsons_id = id(behaviour_jsons)
-        if current_behaviour_jsons_id != behaviour_jsons_id:
-            behaviour_jsons_id = current_behaviour_jsons_id
-            behaviour_jsons_map = f(behaviour_jsons)
-        return behaviour_jsons_map
-
-    return wrapper
-
-
-@_cache_map_based_on_behaviour_jsons
-def _behaviour_name_map(behaviour_jsons: BehaviourJsons) -> Dict[str, BehaviourJson]:
-    return {json["credentialSubject"]["ruleName"]: json for json in behaviour_jsons}
-
-
-@_cache_map_based_on_behaviour_jsons
-def _behaviour_id_map(behaviour_jsons: BehaviourJsons) -> Dict[str, BehaviourJson]:
-    return {json["credentialSubject"]["id"]: json for json in behaviour_jsons}
+    if not isinstance(behaviour_jsons, BehaviourIndex):
+        behaviour_jsons = BehaviourIndex(behaviour_jsons)
+    return behaviour_jsons.get(name)
@@ -1,32 +1,67 @@
+import collections
+import concurrent.futures
+import logging
+import threading
+import typing
 import requests
 import urllib.parse
 import warnings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from .remote_check_cache import RemoteCheck, RemoteCheckCache
 
+LOG = logging.getLogger(__name__)
+
+# TODO: Temporary bypass for example uri
+IGNORED_URIS = frozenset(["https://device-type.com"])
 
-def check_uri(json_data: dict, schema: dict, check_uri_resolves: bool) -> None:
-    """Checks uri resolves in a JSON object, provids soft warning if not.
+
+def get_uris(json_data: dict, schema: dict) -> typing.List[str]:
+    """Finds the URIs in a JSON object, checking that they are valid.
 
     Args:
         json_data: The JSON object to check
         schema: The JSON schema to use
-        check_uri_resolves: Whether to check if the uri resolves.
 
     Returns:
-        None
+        The values of every field with format `uri` in the schema
+
+    Raises:
+        ValueError: If a URI is not valid
     """
     properties = schema["properties"]
     uri_fields = [
         key for key in properties.keys() if properties[key].get("format") == "uri"
     ]
 
+    uris = []
     for uri_field in uri_fields:
         uri = json_data.get(uri_field)
         if uri is not None:
             # technically, this checks if the URI is valid URL,
             # but they're close enough that this will probably be okay
             urllib.parse.urlparse(uri)  # throws if invalid
-            if check_uri_resolves:
-                uri_resolves(uri)
+            uris.append(uri)
+    return uris
+
+
+def check_uri(json_data: dict, schema: dict, check_uri_resolves: bool) -> None:
+    """Checks uri resolves in a JSON object, provids soft warning if not.
+
+    To check the URIs of many claims, use `get_uris` for each claim, then
+    `resolve_claim_uris`, which checks each unique URI once, concurrently.
+
+    Args:
+        json_data: The JSON object to check
+        schema: The JSON schema to use
+        check_uri_resolves: Whether to check if the uri resolves.
+
+    Returns:
+        None
+    """
+    for uri in get_uris(json_data, schema):
+        if check_uri_resolves:
+            uri_resolves(uri)
 
 
 def uri_resolves(uri: str) -> None:
@@ -36,13 +71,158 @@ def uri_resolves(uri: str) -> None:
     Returns:
         None
     """
+    error = UriResolver().resolve(uri)
+    if error is not None:
+        warnings.warn(error)
 
-    # TODO: Temporary bypass for example uri
-    if not uri == "https://device-type.com":
+
+class UriResolver:
+    """Checks whether URIs resolve, concurrently and with connection reuse.
+
+    Requests share one `requests.Session`, which keeps connections alive in a pool per host.
+    At most `max_per_host` requests are made to a host at once, and failed connections and
+    server errors are retried up to `retries` times with exponential backoff.
+    If given a `RemoteCheckCache`, URIs checked recently are not checked again.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 32,
+        max_per_host: int = 4,
+        retries: int = 2,
+        timeout: float = 5,
+        cache: typing.Optional[RemoteCheckCache] = None,
+    ):
+        """
+        Args:
+            max_workers: The maximum number of concurrent requests
+            max_per_host: The maximum number of concurrent requests to a single host
+            retries: The maximum number of retries for each URI
+            timeout: The timeout of each request, in seconds
+            cache: Cache of the results of previous checks
+        """
+        self.cache = cache
+        self.max_workers = max_workers
+        self.max_per_host = max_per_host
+        # timeout of 5 seconds is pretty slow, but so are some people's servers
+        self.timeout = timeout
+        self.session = requests.Session()
+        retry = Retry(
+            total=retries,
+            backoff_factor=0.5,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=("HEAD",),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=max_workers, pool_maxsize=max_per_host, max_retries=retry
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._host_semaphores = collections.defaultdict(
+            lambda: threading.BoundedSemaphore(max_per_host)
+        )
+        self._lock = threading.Lock()
+
+    def _host_semaphore(self, uri: str) -> threading.BoundedSemaphore:
+        host = urllib.parse.urlparse(uri).netloc.lower()
+        with self._lock:
+            return self._host_semaphores[host]
+
+    def check(self, uri: str) -> RemoteCheck:
+        """Checks if a URI resolves
+
+        Args:
+            uri: The URI to check
+
+        Returns:
+            The HTTP status, and why the URI cannot be resolved, if it can't
+        """
+        if uri in IGNORED_URIS:
+            return RemoteCheck(None, None)
+        status = None
         try:
-            # timeout of 5 seconds is pretty slow, but so are some people's servers
-            response = requests.head(uri, timeout=5)
+            with self._host_semaphore(uri):
+                response = self.session.head(uri, timeout=self.timeout)
+            status = response.status_code
             # throws an error if HTTP Code >= 400
             response.raise_for_status()
         except Exception as error:
-            warnings.warn(f"URI {uri} cannot be resolved: {error}")
+            return RemoteCheck(status, f"URI {uri} cannot be resolved: {error}")
+        return RemoteCheck(status, None)
+
+    def resolve(self, uri: str) -> typing.Optional[str]:
+        """Checks if a URI resolves
+
+        Args:
+            uri: The URI to check
+
+        Returns:
+            A message explaining why the URI cannot be resolved, or None if it resolves
+        """
+        return self.check(uri).error
+
+    def _check_all(self, uris: typing.List[str]) -> typing.Dict[str, RemoteCheck]:
+        max_workers = min(self.max_workers, len(uris))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return dict(zip(uris, executor.map(self.check, uris)))
+
+    def resolve_all(self, uris: typing.Iterable[str]) -> typing.Dict[str, typing.Optional[str]]:
+        """Checks if URIs resolve, checking each unique URI once
+
+        Args:
+            uris: The URIs to check
+
+        Returns:
+            Map of each unique URI to the output of `resolve`
+        """
+        unique_uris = list(dict.fromkeys(uris))
+        if not unique_uris:
+            return {}
+        if self.cache is None:
+            checks = self._check_all(unique_uris)
+        else:
+            checks = self.cache.cached_check("uri", unique_uris, self._check_all)
+        return {uri: checks[uri].error for uri in unique_uris}
+
+    def close(self) -> None:
+        self.session.close()
+
+    def __enter__(self) -> "UriResolver":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+
+def resolve_claim_uris(
+    claim_uris: typing.Mapping[str, typing.Iterable[str]],
+    resolver: typing.Optional[UriResolver] = None,
+    cache: typing.Optional[RemoteCheckCache] = None,
+) -> typing.Dict[str, typing.List[str]]:
+    """Checks whether the URIs of many claims resolve, checking each unique URI once
+
+    Args:
+        claim_uris: Map of claim filepath to the URIs in the claim, e.g. from `get_uris`
+        resolver: The resolver to use. Defaults to a new `UriResolver`.
+        cache: Cache of the results of previous checks, used if `resolver` isn't given.
+
+    Returns:
+        Map of claim filepath to the messages of any URIs in it that cannot be resolved.
+        Claims whose URIs all resolve are omitted.
+    """
+    claim_uris = {claim: list(uris) for claim, uris in claim_uris.items()}
+    all_uris = (uri for uris in claim_uris.values() for uri in uris)
+    if resolver is None:
+        with UriResolver(cache=cache) as resolver:
+            errors = resolver.resolve_all(all_uris)
+    else:
+        errors = resolver.resolve_all(all_uris)
+    LOG.debug(f"Checked {len(errors)} unique URIs")
+
+    claim_errors = {}
+    for claim, uris in claim_uris.items():
+        messages = [errors[uri] for uri in uris if errors[uri] is not None]
+        if messages:
+            claim_errors[claim] = messages
+    return claim_errors
@@ -0,0 +1,45 @@
+import os
+import typing
+from pathlib import Path
+
+from .yaml_tools import get_claim_type, is_valid_yaml_claim
+
+
+def _walk_yaml_files(directory: str, relative_directory: str) -> typing.Iterator[typing.Tuple[str, str]]:
+    with os.scandir(directory) as entries:
+        # sort so that claims are always discovered in the same order
+        sorted_entries = sorted(entries, key=lambda entry: entry.name)
+    for entry in sorted_entries:
+        relative_path = os.path.join(relative_directory, entry.name)
+        if entry.is_dir():
+            yield from _walk_yaml_files(entry.path, relative_path)
+        elif entry.name.endswith(".yaml"):
+            yield entry.path, relative_path
+
+
+def find_claim_files(
+    d3_folders: typing.Iterable[Path],
+) -> typing.Iterator[typing.Tuple[str, str, str]]:
+    """Finds all D3 YAML claim files in the given folders in a single pass.
+
+    Each folder is walked once with `os.scandir`, and each file is classified
+    from its filename alone, e.g. `example.type.d3.yaml` is a `type` claim.
+
+    Raises:
+        AssertionError: If a YAML file doesn't have a valid D3 claim filename.
+
+    Args:
+        d3_folders: The folders containing D3 YAML files.
+
+    Yields:
+        Tuples of the claim filepath, the claim filepath relative to its folder,
+        and the claim type (e.g. `behaviour`).
+    """
+    for d3_folder in d3_folders:
+        for file_name, relative_file_name in _walk_yaml_files(str(Path(d3_folder)), ""):
+            claim_type = get_claim_type(file_name)
+            if claim_type is None:
+                # throws a descriptive error for invalid claim filenames
+                is_valid_yaml_claim(file_name)
+                claim_type = Path(file_name).suffixes[-3][1:]
+            yield file_name, relative_file_name, claim_type
@@ -5,20 +5,32 @@ from .guid_tools import get_parent_claims
 
 
 def build_claim_graph(claim_map: BehaviourMap) -> nx.DiGraph:
+    """Builds the inheritance graph of claims, with an edge from each parent to its child
+
+    Args:
+        claim_map: Map of claim GUID to claim
+
+    Returns:
+        The claim inheritance graph
+
+    Raises:
+        ValueError: If the claims have a cyclic dependency
+    """
     graph = nx.DiGraph()
-    for (id, claim) in claim_map.items():
-        parents = get_parent_claims(claim)
-        if id not in graph:
-            graph.add_node(id)
-        for parent_id in parents:
-            if parent_id not in graph:
-                graph.add_node(parent_id)
-            graph.add_edge(parent_id, id)
-            if not nx.is_directed_acyclic_graph(graph):
-                path = [id] + nx.shortest_path(graph, parent_id, id)
-                cyclic_chain = " -> ".join(path)
-                raise ValueError(f"Graph has Cyclic dependency: {cyclic_chain}")
-    return graph
+    graph.add_nodes_from(claim_map)
+    graph.add_edges_from(
+        (parent_id, id)
+        for (id, claim) in claim_map.items()
+        for parent_id in get_parent_claims(claim)
+    )
+    try:
+        cycle = nx.find_cycle(graph)
+    except nx.NetworkXNoCycle:
+        return graph
+    # report the chain from child to parent, e.g. A -> parent of A -> ... -> A
+    path = [child for (_parent, child) in reversed(cycle)]
+    cyclic_chain = " -> ".join(path + path[:1])
+    raise ValueError(f"Graph has Cyclic dependency: {cyclic_chain}")
 
 
 def plot_graph(graph: nx.DiGraph) -> None:
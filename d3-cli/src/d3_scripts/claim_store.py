@@ -0,0 +1,71 @@
+import typing
+from typing import Dict, Iterator, Tuple
+
+from .build_cache import hash_bytes
+from .executor import Executor
+from .yaml_tools import get_claim_type, parse_claim
+
+Claim = typing.Dict[str, typing.Any]
+
+
+def load_claim_entry(file_name: str) -> Tuple[Claim, str]:
+    """Reads and parses a YAML claim file, hashing the contents at the same time
+
+    Args:
+        file_name: The filepath to the YAML claim file
+
+    Returns:
+        Tuple of the parsed claim and the sha256 digest of the file contents
+    """
+    with open(file_name, "rb") as f:
+        contents = f.read()
+    return parse_claim(contents.decode("utf-8")), hash_bytes(contents)
+
+
+class ClaimStore:
+    """In-memory store of the parsed D3 claims of a build, keyed by source filepath.
+
+    Every claim file is parsed exactly once, in `load`, and later stages
+    of the build read the parsed claims from here.
+    """
+
+    def __init__(self):
+        self.claims: Dict[str, Claim] = {}
+        self.hashes: Dict[str, str] = {}
+
+    def load(self, file_names: typing.Sequence[str], executor: Executor) -> None:
+        """Parses the given claim files in parallel, adding them to the store
+
+        Args:
+            file_names: The filepaths to the YAML claim files
+            executor: The executor to parse the files with
+        """
+        for file_name, (claim, file_hash) in zip(file_names, executor.map(load_claim_entry, file_names)):
+            self.add(file_name, claim, file_hash)
+
+    def add(self, file_name: str, claim: Claim, file_hash: str) -> None:
+        self.claims[file_name] = claim
+        self.hashes[file_name] = file_hash
+
+    def files_by_type(self, type_code: str) -> typing.List[str]:
+        """Returns the filepaths of all claims with the given type, e.g. `behaviour`"""
+        return [
+            file_name for file_name in self.claims
+            if get_claim_type(file_name) == type_code
+        ]
+
+    def claims_by_type(self, type_code: str) -> typing.Tuple[Claim, ...]:
+        """Returns all claims with the given type, e.g. `behaviour`"""
+        return tuple(self.claims[file_name] for file_name in self.files_by_type(type_code))
+
+    def __getitem__(self, file_name: str) -> Claim:
+        return self.claims[file_name]
+
+    def __contains__(self, file_name: str) -> bool:
+        return file_name in self.claims
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.claims)
+
+    def __len__(self) -> int:
+        return len(self.claims)
@@ -0,0 +1,167 @@
+import bisect
+import gzip
+import json
+import logging
+import typing
+import xml.etree.ElementTree as ElementTree
+from pathlib import Path
+
+# name of the ingested index of a CPE dictionary, kept in the build output directory
+CPE_INDEX_FILENAME = ".d3-cpe-dictionary.txt"
+LOG = logging.getLogger(__name__)
+
+
+def _open(path: Path, mode: str = "rb") -> typing.IO:
+    if path.suffix == ".gz":
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+def _base_suffix(path: Path) -> str:
+    """Returns the suffix of a file, ignoring any `.gz` suffix"""
+    return Path(path.stem).suffix if path.suffix == ".gz" else path.suffix
+
+
+def _read_xml_cpe_names(path: Path) -> typing.Iterator[str]:
+    """Streams the CPE 2.3 names from an NVD official CPE dictionary XML file"""
+    with _open(path) as f:
+        events = ElementTree.iterparse(f, events=("start", "end"))
+        _event, root = next(events)
+        for event, element in events:
+            if event != "end":
+                continue
+            # tags are namespaced, e.g. {http://scap.nist.gov/schema/cpe-extension/2.3}cpe23-item
+            if element.tag.endswith("}cpe23-item"):
+                yield element.get("name")
+            elif element.tag.endswith("}cpe-item"):
+                # free memory as we go, including the root's references to the parsed items
+                root.clear()
+
+
+def _read_json_cpe_names(path: Path) -> typing.Iterator[str]:
+    """Reads the CPE names from an NVD CPE API 2.0 response, or CPE 2.0 feed file"""
+    with _open(path) as f:
+        data = json.load(f)
+    for product in data.get("products", []):
+        yield product["cpe"]["cpeName"]
+
+
+def _dictionary_files(path: Path) -> typing.List[Path]:
+    if path.is_dir():
+        return sorted(
+            file for file in path.rglob("*")
+            if _base_suffix(file) in (".xml", ".json") and file.is_file()
+        )
+    return [path]
+
+
+def _source_signature(files: typing.Iterable[Path]) -> str:
+    """Returns a string that changes whenever any of the given files change"""
+    return json.dumps([
+        [str(file.resolve()), file.stat().st_size, file.stat().st_mtime_ns] for file in files
+    ])
+
+
+class CpeDictionary:
+    """Sorted index of the CPE names in a local copy of the NVD CPE dictionary.
+
+    Supports exact and prefix lookups by binary search, so checking whether a CPE exists
+    takes microseconds, with no network access.
+    """
+
+    def __init__(self, cpe_names: typing.Iterable[str]):
+        """
+        Args:
+            cpe_names: The CPE 2.3 names in the dictionary, e.g. `cpe:2.3:h:samsung:galaxy_s10:-:*:*:*:*:*:*:*`
+        """
+        self.cpe_names: typing.List[str] = sorted(set(cpe_names))
+
+    @classmethod
+    def from_file(cls, path: Path) -> "CpeDictionary":
+        """Reads a CPE dictionary from NVD data files
+
+        Args:
+            path: An NVD official CPE dictionary XML file (e.g. `official-cpe-dictionary_v2.3.xml`),
+                  an NVD CPE API 2.0 JSON response or CPE 2.0 feed file, optionally gzipped,
+                  or a directory containing any number of these.
+
+        Returns:
+            The CPE dictionary
+        """
+        cpe_names = []
+        for file in _dictionary_files(Path(path)):
+            if _base_suffix(file) == ".xml":
+                cpe_names.extend(_read_xml_cpe_names(file))
+            else:
+                cpe_names.extend(_read_json_cpe_names(file))
+        return cls(cpe_names)
+
+    @classmethod
+    def load(cls, path: Path, index_dir: typing.Optional[Path] = None) -> "CpeDictionary":
+        """Reads a CPE dictionary from NVD data files, reusing a previously ingested index
+
+        Parsing the full NVD dictionary takes a while, so the sorted CPE names are saved
+        to `index_dir`, and reused until the NVD data files change.
+
+        Args:
+            path: See `from_file`
+            index_dir: The directory to save the ingested index in, e.g. the build output directory.
+                       If None, the index isn't saved.
+
+        Returns:
+            The CPE dictionary
+        """
+        if index_dir is None:
+            return cls.from_file(path)
+        index_path = Path(index_dir) / CPE_INDEX_FILENAME
+        signature = _source_signature(_dictionary_files(Path(path)))
+        try:
+            with open(index_path, encoding="utf-8") as f:
+                if f.readline().rstrip("\n") == signature:
+                    LOG.debug(f"Using ingested CPE dictionary {index_path}")
+                    cpe_dictionary = cls.__new__(cls)
+                    # saved in sorted order, so no need to sort again
+                    cpe_dictionary.cpe_names = f.read().splitlines()
+                    return cpe_dictionary
+        except FileNotFoundError:
+            pass
+
+        LOG.info(f"Ingesting CPE dictionary {path}")
+        cpe_dictionary = cls.from_file(path)
+        index_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(index_path, "w", encoding="utf-8") as f:
+            f.write(signature + "\n")
+            f.write("\n".join(cpe_dictionary.cpe_names))
+        return cpe_dictionary
+
+    def __len__(self) -> int:
+        return len(self.cpe_names)
+
+    def __contains__(self, cpe: str) -> bool:
+        """Checks whether a CPE name is in the dictionary (exact match)"""
+        i = bisect.bisect_left(self.cpe_names, cpe)
+        return i < len(self.cpe_names) and self.cpe_names[i] == cpe
+
+    def with_prefix(self, prefix: str) -> typing.Iterator[str]:
+        """Finds the CPE names in the dictionary that start with `prefix`, in sorted order"""
+        i = bisect.bisect_left(self.cpe_names, prefix)
+        while i < len(self.cpe_names) and self.cpe_names[i].startswith(prefix):
+            yield self.cpe_names[i]
+            i += 1
+
+    def matches(self, cpe: str) -> bool:
+        """Checks whether a CPE name is in the dictionary.
+
+        Trailing `*` (ANY) components match any value, so
+        `cpe:2.3:h:samsung:galaxy_s10:*:*:*:*:*:*:*:*` matches every version of
+        `cpe:2.3:h:samsung:galaxy_s10`.
+        """
+        if cpe in self:
+            return True
+        components = cpe.split(":")
+        while components and components[-1] == "*":
+            components.pop()
+        if len(components) == len(cpe.split(":")):
+            return False
+        prefix = ":".join(components) + ":"
+        return next(self.with_prefix(prefix), None) is not None
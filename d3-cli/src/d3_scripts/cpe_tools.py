@@ -1,6 +1,21 @@
+import collections
+import concurrent.futures
+import logging
+import os
+import threading
+import time
 import typing
 import requests
 import warnings
+from .cpe_dictionary import CpeDictionary
+from .remote_check_cache import RemoteCheck, RemoteCheckCache
+
+NVD_CVE_API = "https://services.nvd.nist.gov/rest/json/cves/2.0"
+# NVD allows 5 requests in a rolling 30 second window, or 50 with an API key
+NVD_RATE_LIMIT_PERIOD = 30
+NVD_RATE_LIMIT = 5
+NVD_RATE_LIMIT_WITH_API_KEY = 50
+LOG = logging.getLogger(__name__)
 
 
 def get_cpe(claim) -> typing.Optional[str]:
@@ -16,16 +31,120 @@ def get_cpe(claim) -> typing.Optional[str]:
     return claim.get("credentialSubject", {}).get("cpe", None)
 
 
-def check_cpes_resolve(cpes) -> None:
+class RateLimiter:
+    """Limits calls to at most `max_calls` in any `period` seconds, across threads"""
+
+    def __init__(self, max_calls: int, period: float):
+        self.max_calls = max_calls
+        self.period = period
+        self._calls: typing.Deque[float] = collections.deque()
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        """Blocks until another call can be made without exceeding the limit"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._calls and self._calls[0] <= now - self.period:
+                    self._calls.popleft()
+                if len(self._calls) < self.max_calls:
+                    self._calls.append(now)
+                    return
+                delay = self._calls[0] + self.period - now
+            time.sleep(delay)
+
+
+def check_cpe(
+    cpe: str,
+    session: typing.Optional[requests.Session] = None,
+    api_key: typing.Optional[str] = None,
+) -> RemoteCheck:
+    """
+    Checks if a CPE resolves to an item in the NIST national vulnerability database
+
+    Args:
+        cpe: The CPE to check
+        session: The session to make the request with, to reuse connections
+        api_key: NVD API key
+
+    Returns:
+        The HTTP status, and why the CPE cannot be resolved, if it can't
+    """
+    status = None
+    try:
+        uri = f"{NVD_CVE_API}?cpeName=" + cpe
+        headers = {"apiKey": api_key} if api_key else None
+        # timeout of 10 seconds is pretty slow, but so are some people's servers
+        response = (session or requests).head(uri, timeout=10, headers=headers)
+        status = response.status_code
+        # throws an error if HTTP Code >= 400
+        response.raise_for_status()
+    except Exception as error:
+        return RemoteCheck(status, f"CPE {cpe} cannot be resolved: {error}")
+    return RemoteCheck(status, None)
+
+
+def check_cpes_online(
+    cpes: typing.List[str], api_key: typing.Optional[str] = None
+) -> typing.Dict[str, RemoteCheck]:
+    """
+    Checks CPEs against the NVD API, concurrently but within the NVD rate limits
+
+    Args:
+        cpes: The CPEs to check
+        api_key: NVD API key, which allows a higher rate. Defaults to the `NVD_API_KEY` environment variable.
+
+    Returns:
+        Map of CPE to the result of `check_cpe`
+    """
+    if not cpes:
+        return {}
+    api_key = api_key or os.environ.get("NVD_API_KEY")
+    max_calls = NVD_RATE_LIMIT_WITH_API_KEY if api_key else NVD_RATE_LIMIT
+    rate_limiter = RateLimiter(max_calls, NVD_RATE_LIMIT_PERIOD)
+
+    with requests.Session() as session:
+        def check(cpe: str) -> RemoteCheck:
+            rate_limiter.wait()
+            return check_cpe(cpe, session=session, api_key=api_key)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(max_calls, len(cpes))) as executor:
+            return dict(zip(cpes, executor.map(check, cpes)))
+
+
+def check_cpes_resolve(
+    cpes: typing.Iterable[str],
+    cache: typing.Optional[RemoteCheckCache] = None,
+    cpe_dictionary: typing.Optional[CpeDictionary] = None,
+    check_online: bool = True,
+) -> None:
     """
-    Checks if the CPE resolves to an item in the NIST national vulnerability database
+    Checks if the CPEs resolve to items in the NIST national vulnerability database,
+    providing a soft warning for each that doesn't. Each unique CPE is checked once.
+
+    Args:
+        cpes: The CPEs to check
+        cache: Cache of the results of previous online checks
+        cpe_dictionary: Local copy of the NVD CPE dictionary. If given,
+                        CPEs are checked against it instead of online.
+        check_online: Whether to check CPEs against the NVD API, if no `cpe_dictionary` is given.
     """
-    for cpe in cpes:
-        try:
-            uri = "https://services.nvd.nist.gov/rest/json/cves/2.0?cpeName=" + cpe
-            # timeout of 10 seconds is pretty slow, but so are some people's servers
-            response = requests.head(uri, timeout=10)
-            # throws an error if HTTP Code >= 400
-            response.raise_for_status()
-        except Exception as error:
-            warnings.warn(f"CPE {cpe} cannot be resolved: {error}")
+    unique_cpes = list(dict.fromkeys(cpes))
+
+    if cpe_dictionary is not None:
+        for cpe in unique_cpes:
+            if not cpe_dictionary.matches(cpe):
+                warnings.warn(f"CPE {cpe} cannot be resolved: not found in CPE dictionary")
+        return
+
+    if not check_online:
+        LOG.info(f"Skipping online check of {len(unique_cpes)} CPEs")
+        return
+
+    if cache is None:
+        results = check_cpes_online(unique_cpes)
+    else:
+        results = cache.cached_check("cpe", unique_cpes, check_cpes_online)
+    for cpe in unique_cpes:
+        if results[cpe].error is not None:
+            warnings.warn(results[cpe].error)
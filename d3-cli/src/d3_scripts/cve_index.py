@@ -0,0 +1,288 @@
+import gzip
+import json
+import logging
+import sqlite3
+import typing
+from pathlib import Path
+
+# name of the CVE index, kept in the build output directory
+CVE_INDEX_FILENAME = ".d3-cve-index.sqlite"
+LOG = logging.getLogger(__name__)
+
+
+class CveRecord(typing.NamedTuple):
+    """The parts of an NVD CVE record used for matching"""
+
+    id: str
+    descriptions: typing.List[str]
+    cpes: typing.List[str]
+    """CPE 2.3 names/match strings of vulnerable configurations"""
+
+
+def _open(path: Path) -> typing.IO:
+    if path.suffix == ".gz":
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def _cpe_1_1_matches(nodes: typing.Iterable[dict]) -> typing.Iterator[str]:
+    for node in nodes:
+        for cpe_match in node.get("cpe_match", []):
+            if cpe_match.get("vulnerable", True):
+                yield cpe_match["cpe23Uri"]
+        yield from _cpe_1_1_matches(node.get("children", []))
+
+
+def _read_feed_1_1(data: dict) -> typing.Iterator[CveRecord]:
+    """Reads the CVEs from an NVD JSON 1.1 feed, e.g. `nvdcve-1.1-2022.json`"""
+    for item in data["CVE_Items"]:
+        cve = item["cve"]
+        yield CveRecord(
+            id=cve["CVE_data_meta"]["ID"],
+            descriptions=[
+                description["value"]
+                for description in cve.get("description", {}).get("description_data", [])
+            ],
+            cpes=list(_cpe_1_1_matches(item.get("configurations", {}).get("nodes", []))),
+        )
+
+
+def _read_feed_2_0(data: dict) -> typing.Iterator[CveRecord]:
+    """Reads the CVEs from an NVD CVE API 2.0 response or JSON 2.0 feed, e.g. `nvdcve-2.0-2022.json`"""
+    for item in data["vulnerabilities"]:
+        cve = item["cve"]
+        yield CveRecord(
+            id=cve["id"],
+            descriptions=[
+                description["value"]
+                for description in cve.get("descriptions", []) if description.get("lang", "en") == "en"
+            ],
+            cpes=[
+                cpe_match["criteria"]
+                for configuration in cve.get("configurations", [])
+                for node in configuration.get("nodes", [])
+                for cpe_match in node.get("cpeMatch", [])
+                if cpe_match.get("vulnerable", True)
+            ],
+        )
+
+
+def read_feed(path: Path) -> typing.Iterator[CveRecord]:
+    """Reads the CVEs from an NVD JSON 1.1 or 2.0 feed file, optionally gzipped
+
+    Args:
+        path: The filepath of the feed
+
+    Returns:
+        The CVEs in the feed
+    """
+    with _open(path) as f:
+        data = json.load(f)
+    if "CVE_Items" in data:
+        return _read_feed_1_1(data)
+    return _read_feed_2_0(data)
+
+
+def _cpe_product(cpe: str) -> typing.Tuple[str, str]:
+    """Splits a CPE 2.3 name into its `part:vendor:product` and its version"""
+    components = cpe.split(":")
+    return ":".join(components[2:5]), components[5] if len(components) > 5 else "*"
+
+
+def _versions_match(version: str, other_version: str) -> bool:
+    # ANY (*) and NA (-) versions match every version
+    return version in ("*", "-") or other_version in ("*", "-") or version == other_version
+
+
+def _fts_phrase(term: str) -> str:
+    """Quotes a search term as an FTS5 phrase, so that punctuation isn't parsed as query syntax"""
+    return '"' + term.replace('"', '""') + '"'
+
+
+class CveIndex:
+    """Local index of NVD CVE feeds, for matching D3 type claims to CVEs without network access.
+
+    CVE descriptions are indexed with SQLite FTS5 for full-text phrase search,
+    and the CPEs of vulnerable configurations are indexed by `part:vendor:product`.
+    Each feed file is only (re-)ingested when it is new or has changed.
+    """
+
+    def __init__(self, path: Path):
+        """
+        Args:
+            path: The filepath of the SQLite database. Created if it doesn't exist.
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(self.path)
+        with self.connection:
+            self.connection.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS feeds (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS cve_cpes (
+                    feed TEXT NOT NULL,
+                    cve_id TEXT NOT NULL,
+                    product TEXT NOT NULL,
+                    version TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS cve_cpes_product ON cve_cpes (product);
+                CREATE INDEX IF NOT EXISTS cve_cpes_feed ON cve_cpes (feed);
+                CREATE VIRTUAL TABLE IF NOT EXISTS cve_text USING fts5 (
+                    feed UNINDEXED, cve_id UNINDEXED, description
+                );
+                """
+            )
+
+    @classmethod
+    def in_build_dir(cls, output_dir: Path) -> "CveIndex":
+        """Opens the CVE index in a build output directory"""
+        return cls(Path(output_dir) / CVE_INDEX_FILENAME)
+
+    def update(self, feeds: Path) -> int:
+        """Ingests new or changed NVD feed files, and drops feeds that no longer exist
+
+        Args:
+            feeds: An NVD JSON 1.1 or 2.0 feed file, or a directory of them, optionally gzipped
+
+        Returns:
+            The number of feed files ingested
+        """
+        feeds = Path(feeds)
+        if feeds.is_dir():
+            feed_files = sorted(
+                file for file in feeds.rglob("*")
+                if file.name.endswith((".json", ".json.gz")) and file.is_file()
+            )
+        else:
+            feed_files = [feeds]
+        ingested = {
+            path: (size, mtime_ns)
+            for path, size, mtime_ns in self.connection.execute("SELECT path, size, mtime_ns FROM feeds")
+        }
+
+        n_ingested = 0
+        current_feeds = set()
+        for feed_file in feed_files:
+            feed = str(feed_file.resolve())
+            current_feeds.add(feed)
+            stat = feed_file.stat()
+            if ingested.get(feed) == (stat.st_size, stat.st_mtime_ns):
+                continue
+            LOG.info(f"Ingesting CVE feed {feed_file}")
+            records = list(read_feed(feed_file))
+            with self.connection:
+                self._delete_feed(feed)
+                self.connection.executemany(
+                    "INSERT INTO cve_cpes VALUES (?, ?, ?, ?)",
+                    (
+                        (feed, record.id, *_cpe_product(cpe))
+                        for record in records for cpe in record.cpes
+                    ),
+                )
+                self.connection.executemany(
+                    "INSERT INTO cve_text VALUES (?, ?, ?)",
+                    (
+                        (feed, record.id, description)
+                        for record in records for description in record.descriptions
+                    ),
+                )
+                self.connection.execute(
+                    "INSERT INTO feeds VALUES (?, ?, ?)", (feed, stat.st_size, stat.st_mtime_ns)
+                )
+            n_ingested += 1
+
+        with self.connection:
+            for feed in set(ingested) - current_feeds:
+                LOG.info(f"Dropping removed CVE feed {feed}")
+                self._delete_feed(feed)
+        return n_ingested
+
+    def _delete_feed(self, feed: str) -> None:
+        self.connection.execute("DELETE FROM cve_cpes WHERE feed = ?", (feed,))
+        self.connection.execute("DELETE FROM cve_text WHERE feed = ?", (feed,))
+        self.connection.execute("DELETE FROM feeds WHERE path = ?", (feed,))
+
+    def match_cpes(self, cpes: typing.Iterable[str]) -> typing.Dict[str, typing.List[str]]:
+        """Finds the CVEs affecting each CPE, i.e. with a vulnerable configuration
+        of the same product, with a matching version
+
+        Args:
+            cpes: CPE 2.3 names, e.g. `cpe:2.3:h:samsung:galaxy_s10:-:*:*:*:*:*:*:*`
+
+        Returns:
+            Map of each CPE to the sorted IDs of the CVEs affecting it
+        """
+        cpes = list(dict.fromkeys(cpes))
+        matches = {cpe: set() for cpe in cpes}
+        with self.connection:
+            # look up all products at once, by joining on a temporary table
+            self.connection.execute("CREATE TEMP TABLE IF NOT EXISTS query_cpes (cpe TEXT, product TEXT)")
+            self.connection.execute("DELETE FROM query_cpes")
+            self.connection.executemany(
+                "INSERT INTO query_cpes VALUES (?, ?)", ((cpe, _cpe_product(cpe)[0]) for cpe in cpes)
+            )
+            rows = self.connection.execute(
+                """SELECT DISTINCT query_cpes.cpe, cve_cpes.cve_id, cve_cpes.version
+                FROM query_cpes JOIN cve_cpes ON query_cpes.product = cve_cpes.product"""
+            ).fetchall()
+        for cpe, cve_id, version in rows:
+            if _versions_match(_cpe_product(cpe)[1], version):
+                matches[cpe].add(cve_id)
+        return {cpe: sorted(cve_ids) for cpe, cve_ids in matches.items()}
+
+    def match_text(self, terms: typing.Iterable[str]) -> typing.Dict[str, typing.List[str]]:
+        """Finds the CVEs whose description contains each term, as a phrase
+
+        Args:
+            terms: The terms to search for, e.g. model numbers
+
+        Returns:
+            Map of each term to the sorted IDs of the CVEs mentioning it
+        """
+        matches = {}
+        for term in dict.fromkeys(terms):
+            if not term.strip():
+                matches[term] = []
+                continue
+            rows = self.connection.execute(
+                "SELECT DISTINCT cve_id FROM cve_text WHERE cve_text MATCH ?",
+                (f"description:{_fts_phrase(term)}",),
+            )
+            matches[term] = sorted(cve_id for (cve_id,) in rows)
+        return matches
+
+    def match_types(self, type_jsons: typing.Iterable[dict]) -> typing.Dict[str, typing.List[str]]:
+        """Finds the CVEs affecting each D3 type claim, by its `cpe`, and by
+        its `modelNumber` (or its `name` if it has no model number) in CVE descriptions
+
+        Args:
+            type_jsons: The D3 type claims
+
+        Returns:
+            Map of type GUID to the sorted IDs of the CVEs affecting it
+        """
+        subjects = [type_json["credentialSubject"] for type_json in type_jsons]
+        cpe_matches = self.match_cpes(subject["cpe"] for subject in subjects if subject.get("cpe"))
+        search_terms = {
+            subject["id"]: subject.get("modelNumber", subject.get("name")) for subject in subjects
+        }
+        text_matches = self.match_text(term for term in search_terms.values() if term)
+        return {
+            subject["id"]: sorted(set(
+                cpe_matches.get(subject.get("cpe"), []) + text_matches.get(search_terms[subject["id"]], [])
+            ))
+            for subject in subjects
+        }
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __enter__(self) -> "CveIndex":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
@@ -0,0 +1,339 @@
+import logging
+import socket
+import typing
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .behaviour_matcher import BehaviourMatcher, Flow, TypeBehaviourMatchers
+from .mac_index import MacPrefixIndex, MAC_BITS, MAC_INDEX_FILENAME, parse_mac_prefix
+
+LOG = logging.getLogger(__name__)
+
+VIOLATIONS_FILENAME = "violations.csv"
+RULE_HITS_FILENAME = "rule_hits.csv"
+DEFAULT_CHUNK_SIZE = 1_000_000
+
+# accepted names of the columns of flow logs, by `Flow` field, or `type_id`/`mac` for the device
+FLOW_LOG_COLUMNS = {
+    "type_id": ["type_id", "type", "typeId", "device_type"],
+    "mac": ["mac", "device_mac"],
+    "protocol": ["protocol", "proto"],
+    "destination_ip": ["destination_ip", "dst_ip", "dest_ip", "destinationIp"],
+    "destination_port": ["destination_port", "dst_port", "dest_port", "destinationPort"],
+    "destination_name": ["destination_name", "dst_name", "destination_dns_name", "destinationDnsName", "domain"],
+    "source_ip": ["source_ip", "src_ip", "sourceIp"],
+    "source_port": ["source_port", "src_port", "sourcePort"],
+    "source_name": ["source_name", "src_name", "source_dns_name", "sourceDnsName"],
+    "destination_mac": ["destination_mac", "dst_mac", "destinationMac"],
+    "source_mac": ["source_mac", "src_mac", "sourceMac"],
+    "ether_type": ["ether_type", "etherType", "ethertype"],
+    "icmp_type": ["icmp_type", "icmpType"],
+    "icmp_code": ["icmp_code", "icmpCode"],
+}
+PROTOCOL_NUMBERS = {"icmp": 1, "tcp": 6, "udp": 17}
+_COMPRESSION_SUFFIXES = {".gz", ".bz2", ".zip", ".xz", ".zst"}
+
+
+class AuditSummary(typing.NamedTuple):
+    flows: int
+    """The number of flows audited"""
+    violations: int
+    """The number of flows that weren't allowed"""
+
+
+def read_flow_log(flow_log: Path, chunk_size: int = DEFAULT_CHUNK_SIZE) -> typing.Iterator[pd.DataFrame]:
+    """Reads a flow log in chunks, with the columns renamed to the keys of `FLOW_LOG_COLUMNS`
+
+    Args:
+        flow_log: CSV file, or NDJSON file if it ends in `.json`, `.jsonl` or `.ndjson`,
+                  optionally compressed.
+        chunk_size: The number of flows to read at a time
+
+    Yields:
+        The flows, as strings, with unknown values as empty strings,
+        and a column for each key of `FLOW_LOG_COLUMNS`
+    """
+    suffixes = [suffix for suffix in Path(flow_log).suffixes if suffix not in _COMPRESSION_SUFFIXES]
+    if suffixes and suffixes[-1] in (".json", ".jsonl", ".ndjson"):
+        chunks = pd.read_json(flow_log, lines=True, chunksize=chunk_size, dtype=False)
+    else:
+        chunks = pd.read_csv(flow_log, chunksize=chunk_size, dtype=str, keep_default_na=False)
+    renames = {name: field for field, names in FLOW_LOG_COLUMNS.items() for name in names}
+    for chunk in chunks:
+        chunk = chunk.rename(columns=renames)
+        chunk = chunk.loc[:, ~chunk.columns.duplicated()]
+        # NDJSON values may be numbers, null, or missing, so that chunks may have different columns
+        chunk = chunk.reindex(columns=list(FLOW_LOG_COLUMNS)).astype(object)
+        yield chunk.where(chunk.notna(), "").astype(str)
+
+
+def _parse_column(values: pd.Series, parse: typing.Callable[[str], int]) -> np.ndarray:
+    """Parses the values of a column to integers, once per distinct value, as flow logs are very repetitive
+
+    Args:
+        values: The values to parse
+        parse: Parses a non-empty value, raising ValueError if it's invalid
+
+    Returns:
+        The parsed values, -1 if empty or invalid
+    """
+    codes, unique_values = pd.factorize(values)
+    parsed = []
+    for value in unique_values.tolist():
+        try:
+            parsed.append(parse(value) if value else -1)
+        except (ValueError, OverflowError):
+            parsed.append(-1)
+    return np.array(parsed + [-1], dtype=np.int64)[codes]
+
+
+def _parse_int(value: str) -> int:
+    return int(float(value))
+
+
+def _parse_protocol(value: str) -> int:
+    if value.lower() in PROTOCOL_NUMBERS:
+        return PROTOCOL_NUMBERS[value.lower()]
+    return _parse_int(value)
+
+
+def _parse_ip4(value: str) -> int:
+    try:
+        return int.from_bytes(socket.inet_aton(value), "big") if value.count(".") == 3 else -1
+    except OSError:
+        return -1
+
+
+def _parse_mac(value: str) -> int:
+    mac, prefix_length = parse_mac_prefix(value)
+    if prefix_length != MAC_BITS:
+        raise ValueError(f"Invalid MAC address {value!r}")
+    return mac
+
+
+def _flow_columns(chunk: pd.DataFrame) -> typing.Tuple[typing.Dict[str, np.ndarray], np.ndarray]:
+    """Converts flows to the columns of `BehaviourMatcher.check_batch`
+
+    Returns:
+        The columns, and whether each flow has a non-IPv4 address, which `check_batch` can't check
+    """
+    columns = {}
+    needs_check = np.zeros(len(chunk), dtype=bool)
+    for field in Flow._fields:
+        if field not in chunk.columns:
+            continue
+        values = chunk[field]
+        if field.endswith("_ip"):
+            columns[field] = _parse_column(values, _parse_ip4)
+            # e.g. IPv6 addresses
+            needs_check |= (columns[field] == -1) & (values != "").to_numpy()
+        elif field.endswith("_name"):
+            columns[field] = values.to_numpy(dtype=str)
+        elif field.endswith("_mac"):
+            columns[field] = _parse_column(values, _parse_mac)
+        elif field == "protocol":
+            columns[field] = _parse_column(values, _parse_protocol)
+        else:
+            columns[field] = _parse_column(values, _parse_int)
+    return columns, needs_check
+
+
+def _flow(chunk: pd.DataFrame, columns: typing.Mapping[str, np.ndarray], row: int) -> Flow:
+    """Converts a flow to a `Flow`, for `BehaviourMatcher.check`"""
+    fields = {}
+    for field, values in columns.items():
+        value = chunk[field].iat[row] if field.endswith(("_ip", "_name", "_mac")) else int(values[row])
+        if value != "" and value != -1:
+            fields[field] = value
+    return Flow(**fields)
+
+
+def _check_flows(
+    matcher: BehaviourMatcher,
+    chunk: pd.DataFrame,
+    columns: typing.Mapping[str, np.ndarray],
+    needs_check: np.ndarray,
+) -> typing.Tuple[np.ndarray, np.ndarray]:
+    """Checks flows in a batch, except for flows with non-IPv4 addresses, which are checked one by one
+
+    Returns:
+        Whether each flow is allowed, and the index of the rule that decided it, or -1 if none
+    """
+    allowed, rules = matcher.check_batch(columns)
+    rule_indexes: typing.Dict[str, int] = {}
+    if needs_check.any():
+        for index, rule in enumerate(matcher.rules):
+            rule_indexes.setdefault(rule.name, index)
+    for row in np.flatnonzero(needs_check).tolist():
+        try:
+            decision = matcher.check(_flow(chunk, columns, row))
+        except ValueError as error:
+            LOG.warning(f"Ignoring invalid flow: {error}")
+            allowed[row], rules[row] = False, -1
+            continue
+        allowed[row] = decision.allowed
+        rules[row] = rule_indexes.get(decision.rule_name, -1)
+    return allowed, rules
+
+
+def _resolve_types(
+    chunk: pd.DataFrame, matchers: TypeBehaviourMatchers, mac_index: typing.Optional[MacPrefixIndex]
+) -> np.ndarray:
+    """Finds the D3 type of each flow, by its `type_id`, or else by its device's MAC address"""
+    if "type_id" in chunk.columns:
+        type_ids = chunk["type_id"].to_numpy(dtype=object)
+    else:
+        type_ids = np.full(len(chunk), "", dtype=object)
+    unknown = type_ids == ""
+    if unknown.any() and mac_index is not None and "mac" in chunk.columns:
+        macs = chunk["mac"].to_numpy(dtype=str)[unknown]
+        unique_macs, inverse = np.unique(macs, return_inverse=True)
+        mac_types = []
+        for mac in unique_macs.tolist():
+            try:
+                owners = [type_id for type_id in mac_index.lookup(mac) if type_id in matchers.type_behaviours]
+            except ValueError:
+                owners = []
+            if len(owners) > 1:
+                LOG.warning(f"MAC address {mac} matches types {owners}, auditing it as {owners[0]}")
+            mac_types.append(owners[0] if owners else "")
+        type_ids[unknown] = np.array(mac_types, dtype=object)[inverse.reshape(-1)]
+    return type_ids
+
+
+def _rule_names(matcher: BehaviourMatcher) -> np.ndarray:
+    """Returns the name of each rule of a matcher, followed by "", so that indexing it by rule gives "" for -1"""
+    return np.array([rule.name for rule in matcher.rules] + [""], dtype=object)
+
+
+def audit_flow_log(
+    build_dir: Path,
+    flow_log: Path,
+    output_dir: Path,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    include_malicious: bool = True,
+) -> AuditSummary:
+    """Audits a log of the network flows of devices against the behaviours of their D3 types
+
+    Flows are read in chunks, and each chunk is checked in batches of flows of the same behaviour
+    (see `BehaviourMatcher.check_batch`). Flows matching a malicious behaviour are violations,
+    whatever the behaviour of their type.
+
+    Args:
+        build_dir: The output directory of `d3_build`
+        flow_log: CSV or NDJSON flow log (see `read_flow_log`), with a column for either
+                  the D3 type ID or the MAC address of each flow's device
+        output_dir: Directory to write `violations.csv` and `rule_hits.csv` to
+        chunk_size: The number of flows to read at a time
+        include_malicious: Whether to check flows against the malicious behaviours in the build
+
+    Returns:
+        The number of flows audited, and of violations
+    """
+    build_dir, output_dir = Path(build_dir), Path(output_dir)
+    matchers = TypeBehaviourMatchers.from_build_dir(build_dir, include_malicious=include_malicious)
+    if (build_dir / MAC_INDEX_FILENAME).exists():
+        mac_index = MacPrefixIndex.load(build_dir / MAC_INDEX_FILENAME)
+    else:
+        mac_index = None
+        LOG.warning(f"No {MAC_INDEX_FILENAME} in {build_dir}, so devices can only be identified by type_id")
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    violations_path = output_dir / VIOLATIONS_FILENAME
+    violations_path.unlink(missing_ok=True)
+    # the number of flows decided by each rule, by behaviour ID, or for all malicious rules
+    behaviour_hits = {behaviour_id: np.zeros(len(matcher.rules), dtype=np.int64)
+                      for behaviour_id, matcher in matchers.behaviour_matchers.items()}
+    malicious_hits = np.zeros(len(matchers.malicious_rule_behaviours), dtype=np.int64)
+    if matchers.malicious_matcher is not None:
+        # indexed by the rule of each flow, so that no flow is looked up one at a time
+        malicious_rule_names = _rule_names(matchers.malicious_matcher)
+        malicious_rule_behaviours = np.array(matchers.malicious_rule_behaviours, dtype=object)
+    summary = AuditSummary(flows=0, violations=0)
+    for chunk in read_flow_log(flow_log, chunk_size):
+        columns, needs_check = _flow_columns(chunk)
+        type_ids = _resolve_types(chunk, matchers, mac_index)
+        type_codes, unique_type_ids = pd.factorize(type_ids)
+        behaviour_ids = np.array(
+            [matchers.type_behaviours.get(type_id, "") for type_id in unique_type_ids], dtype=object
+        )[type_codes]
+        allowed = np.zeros(len(chunk), dtype=bool)
+        rule_names = np.full(len(chunk), "", dtype=object)
+        reasons = np.full(len(chunk), "", dtype=object)
+        decided = np.zeros(len(chunk), dtype=bool)
+
+        if matchers.malicious_matcher is not None:
+            _allowed, rules = _check_flows(matchers.malicious_matcher, chunk, columns, needs_check)
+            malicious_hits += np.bincount(rules[rules >= 0], minlength=len(malicious_hits))
+            decided = rules >= 0
+            rule_names[decided] = malicious_rule_names[rules[decided]]
+            reasons[decided] = "malicious"
+            behaviour_ids[decided] = malicious_rule_behaviours[rules[decided]]
+
+        reasons[~decided & (type_ids == "")] = "unknown type"
+        reasons[~decided & (type_ids != "") & (behaviour_ids == "")] = "no behaviour"
+        undecided = np.flatnonzero(~decided & (behaviour_ids != ""))
+        codes, unique_behaviour_ids = pd.factorize(behaviour_ids[undecided])
+        order = np.argsort(codes, kind="stable")
+        groups = np.split(undecided[order], np.flatnonzero(np.diff(codes[order])) + 1) if len(order) else []
+        for behaviour_id, rows in zip(unique_behaviour_ids, groups):
+            matcher = matchers.behaviour_matchers.get(behaviour_id)
+            if matcher is None:
+                reasons[rows] = "no behaviour"
+                continue
+            group_allowed, rules = _check_flows(
+                matcher,
+                chunk.iloc[rows],
+                {field: values[rows] for field, values in columns.items()},
+                needs_check[rows],
+            )
+            behaviour_hits[behaviour_id] += np.bincount(rules[rules >= 0], minlength=len(matcher.rules))
+            allowed[rows] = group_allowed
+            rule_names[rows] = _rule_names(matcher)[rules]
+            reasons[rows] = np.where(group_allowed, "", np.where(rules >= 0, "disallowed", "no matching rule"))
+
+        violations = chunk.assign(
+            row=np.arange(summary.flows, summary.flows + len(chunk)) + 1,
+            type_id=type_ids,
+            behaviour_id=behaviour_ids,
+            rule_name=rule_names,
+            reason=reasons,
+        )[~allowed]
+        violations = violations[["row", *(column for column in violations.columns if column != "row")]]
+        violations.to_csv(violations_path, mode="a", header=not violations_path.exists(), index=False)
+        summary = AuditSummary(flows=summary.flows + len(chunk), violations=summary.violations + len(violations))
+        LOG.info(f"Audited {summary.flows} flows, {summary.violations} violations")
+
+    if not violations_path.exists():
+        pd.DataFrame(columns=["row", *FLOW_LOG_COLUMNS, "behaviour_id", "rule_name", "reason"]).to_csv(
+            violations_path, index=False
+        )
+    _write_rule_hits(matchers, behaviour_hits, malicious_hits, output_dir / RULE_HITS_FILENAME)
+    return summary
+
+
+def _write_rule_hits(
+    matchers: TypeBehaviourMatchers,
+    behaviour_hits: typing.Mapping[str, np.ndarray],
+    malicious_hits: np.ndarray,
+    path: Path,
+) -> None:
+    """Writes the number of flows decided by every rule of the behaviours of the types,
+    and by the malicious rules that decided any flows"""
+    rows = []
+    for behaviour_id, hits in sorted(behaviour_hits.items()):
+        matcher = matchers.behaviour_matchers[behaviour_id]
+        rows.extend(
+            (behaviour_id, index, rule.name, rule_hits)
+            for index, (rule, rule_hits) in enumerate(zip(matcher.rules, hits.tolist()))
+        )
+    # the malicious rules of all malicious behaviours are compiled together, in order of behaviour
+    rule_offsets: typing.Dict[str, int] = {}
+    for index, behaviour_id in enumerate(matchers.malicious_rule_behaviours):
+        rule_offset = rule_offsets.setdefault(behaviour_id, index)
+        if malicious_hits[index]:
+            rule_name = matchers.malicious_matcher.rules[index].name
+            rows.append((behaviour_id, index - rule_offset, rule_name, int(malicious_hits[index])))
+    pd.DataFrame(rows, columns=["behaviour_id", "rule_index", "rule_name", "hits"]).to_csv(path, index=False)
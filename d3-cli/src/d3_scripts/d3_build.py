@@ -1,24 +1,37 @@
 #! /usr/bin/python3
 
+import collections
+import os
 from pathlib import Path
 from bidict import bidict
-import multiprocessing as mp
 import logging
 from tqdm import tqdm
-import functools
-from .d3_utils import process_claim_file
+from copy import deepcopy
+from .d3_utils import (
+    init_build_context, process_claim_in_context, resolve_claim_in_context, get_claim_uris, log_unresolved_uris
+)
 from .guid_tools import get_guid, check_guids, get_parent_claims, check_guids_array
-from .yaml_tools import is_valid_yaml_claim, get_yaml_suffixes, load_claim
+from .yaml_tools import YAML_BACKEND
+from .claim_discovery import find_claim_files
 from .claim_graph import build_claim_graph
+from .check_behaviours_resolve import BehaviourIndex
+from .resolve_behaviour_rules import aggregate_inherited_rules
 from .build_type_map import build_type_map
-from .d3_build_vulnerabilities import build_vulnerabilities
-from .d3_build_malicious_behaviours import get_malicious_behaviours
+from .d3_build_vulnerabilities import build_vulnerabilities, build_vulnerabilities_offline
+from .cve_index import CveIndex
+from .mac_index import MacPrefixIndex, MAC_INDEX_FILENAME
+from .d3_build_malicious_behaviours import (
+    malicious_behaviour_claims, malicious_behaviour_json_filepath, sync_malicious_behaviours
+)
 from .json_tools import write_json
 import typing
-from tempfile import TemporaryDirectory
-import yaml
-from multiprocessing.pool import Pool, ThreadPool, MaybeEncodingError
+from multiprocessing.pool import MaybeEncodingError
 from .cpe_tools import get_cpe, check_cpes_resolve
+from .cpe_dictionary import CpeDictionary
+from .build_cache import BuildCache, LineageHasher
+from .claim_store import ClaimStore
+from .executor import Executor
+from .remote_check_cache import RemoteCheckCache, DEFAULT_REMOTE_CHECK_TTL
 
 
 class PathFinder:
@@ -28,17 +41,26 @@ class PathFinder:
 
     def add_to_d3_map(self, claim_filepath, folder):
         claim_relative_filepath = claim_filepath.relative_to(folder)
-        json_filepath = Path(
-            self.output_dir, str(
-                claim_relative_filepath).replace(".yaml", ".json")
+        self.add_relative_to_d3_map(str(claim_filepath), str(claim_relative_filepath))
+        return claim_filepath
+
+    def add_relative_to_d3_map(self, claim_filepath: str, claim_relative_filepath: str):
+        """Maps a YAML claim to its JSON filepath in the output directory.
+
+        Args:
+            claim_filepath: The filepath to the YAML claim
+            claim_relative_filepath: The filepath to the YAML claim, relative to its D3 folder
+        """
+        # paths are stored as strings, since hashing Path objects is slow for large trees
+        json_filepath = os.path.join(
+            self.output_dir, claim_relative_filepath.replace(".yaml", ".json")
         )
         if json_filepath in self.d3_src_dst_map.inverse:
             raise Exception(
                 f"""Claim collision: {claim_filepath} and
             {self.d3_src_dst_map.inverse[json_filepath]} both map to {json_filepath}"""
             )
-        self.d3_src_dst_map[str(claim_filepath)] = json_filepath
-        return claim_filepath
+        self.d3_src_dst_map[claim_filepath] = json_filepath
 
     def get_json_filepath(self, yaml_filepath: str):
         """Returns the filepath to the JSON file for a given YAML file.
@@ -49,17 +71,10 @@ class PathFinder:
         Returns:
             The filepath to the JSON file
         """
-        json_file_name = self.d3_src_dst_map[yaml_filepath]
+        json_file_name = Path(self.d3_src_dst_map[yaml_filepath])
         return json_file_name
 
 
-def claim_handler(file_name):
-    stringified_file_name = str(file_name)
-    if is_valid_yaml_claim(stringified_file_name):
-        return stringified_file_name
-    return False
-
-
 def d3_build(
     d3_folders: typing.Iterable[Path],
     output_dir: Path,
@@ -67,7 +82,15 @@ def d3_build(
     skip_vuln: bool = False,
     skip_mal: bool = False,
     pass_on_failure: bool = False,
-):
+    use_cache: bool = True,
+    jobs: typing.Optional[int] = None,
+    remote_check_ttl: float = DEFAULT_REMOTE_CHECK_TTL,
+    refresh_remote_checks: bool = False,
+    cpe_dictionary: typing.Optional[Path] = None,
+    cve_feeds: typing.Optional[Path] = None,
+    malicious_feed: typing.Optional[Path] = None,
+    write_claims: bool = True,
+) -> typing.Optional[typing.Dict[Path, dict]]:
     """Build compressed D3 files from D3 YAML files
 
     Args:
@@ -78,61 +101,81 @@ def d3_build(
                             leave this off normally.
         pass_on_failure: Whether to allow build to continue on failure
                          to validate file claims
+        use_cache: Whether to skip claims whose content and lineage are
+                   unchanged since the last build into `output_dir`.
+        jobs: The maximum number of worker processes. Defaults to one less than the CPU count.
+        remote_check_ttl: The number of seconds for which the results of checking
+                          URIs and CPEs are cached in `output_dir`.
+        refresh_remote_checks: Whether to ignore cached results, checking every URI and CPE again.
+        cpe_dictionary: Local NVD CPE dictionary file(s) to check CPEs against.
+                        If not given, CPEs are checked online if `check_uri_resolves` is set.
+        cve_feeds: Local NVD JSON feed file(s) to find vulnerabilities of types in.
+                   If not given, and not `skip_vuln`, the remote CVE dataset is searched instead.
+        malicious_feed: Local copy of the URLhaus CSV of online malware URLs to add malicious
+                        behaviours for. If not given, and not `skip_mal`, it is downloaded.
+        write_claims: Whether to write the built claims to `output_dir`. If not, the built claims
+                      are returned instead, every claim is built, and only the caches, e.g. of
+                      remote checks, are kept in `output_dir`.
+
+    Returns:
+        If not `write_claims`, map of the JSON filepath each built claim would be written to,
+        to the built claim, including the malicious behaviours unless `skip_mal`.
     """
     pathFinder = PathFinder(output_dir=output_dir)
-
-    d3_files = (
-        pathFinder.add_to_d3_map(d3_file, d3_folder)
-        for d3_folder in d3_folders
-        for d3_file in d3_folder.glob("**/*.yaml")
-    )
+    built_claims: typing.Dict[Path, dict] = {}
 
     print("Compiling D3 claims...")
+    logging.info(f"Using {YAML_BACKEND} YAML backend")
     bar_format = "{desc: <20}|{bar}| {percentage:3.0f}% [{elapsed}]"
     pbar = tqdm(total=100, ncols=80, bar_format=bar_format)
-    pbar.set_description("Setting up worker pool ")
-    pool_size = max(mp.cpu_count() - 1, 1)
-    pool = Pool(processes=pool_size)
-    pbar.update(10)
 
     # Get list of YAML files and check for invalid claims
     pbar.set_description("Finding claims")
-    files_to_process = pool.map(claim_handler, d3_files)
-    files_to_process = [file for file in files_to_process if file]
-    pbar.update(15)
+    files_to_process = []
+    claim_type_counts = collections.Counter()
+    for claim_file, claim_relative_file, claim_type in find_claim_files(d3_folders):
+        pathFinder.add_relative_to_d3_map(claim_file, claim_relative_file)
+        files_to_process.append(claim_file)
+        claim_type_counts[claim_type] += 1
+    logging.info(f"Found claims: {dict(claim_type_counts)}")
+    pbar.update(25)
 
     if not skip_mal:
-        # retrieve malicious malware urls and add malicious behaviours
-        pbar.set_description("Retrieving malicious URLs")
-        malicious_behaviours = get_malicious_behaviours()
-        malicious_behaviours_dir = TemporaryDirectory()
-        malicious_behaviours_dir.path = Path(malicious_behaviours_dir.name)
-        folder = malicious_behaviours_dir.path / "maliciousUrls"
-        folder.mkdir(parents=True, exist_ok=True)
-        for malicious_behaviour in malicious_behaviours:
-            id = malicious_behaviour["id"]
-            behaviour_filepath = folder / f'mal-{id}.behaviour.d3.yaml'
-            behaviour_yaml = {"type": "d3-device-type-behaviour",
-                              "credentialSubject": malicious_behaviour}
-            with open(behaviour_filepath, 'w') as outfile:
-                yaml.dump(behaviour_yaml, outfile, default_flow_style=False)
-            pathFinder.add_to_d3_map(
-                behaviour_filepath, malicious_behaviours_dir.path)
-            files_to_process.append(str(behaviour_filepath))
+        # retrieve malicious malware urls, and only write the malicious
+        # behaviours that were added or changed since the last build
+        pbar.set_description("Syncing malicious URLs")
+        if write_claims:
+            sync_malicious_behaviours(output_dir, malicious_feed, use_cache=use_cache)
+        else:
+            built_claims.update(
+                (malicious_behaviour_json_filepath(output_dir, behaviour_id), claim)
+                for behaviour_id, claim in malicious_behaviour_claims(malicious_feed).items()
+            )
     pbar.update(10)
 
     pbar.set_description("Loading claims")
-    behaviour_files = get_files_by_type(files_to_process, "behaviour")
-    behaviour_jsons = tuple(pool.map(load_claim, behaviour_files))
-    type_files = get_files_by_type(files_to_process, "type")
-    type_jsons = tuple(pool.map(load_claim, type_files))
-    claim_jsons = behaviour_jsons + type_jsons
-    pbar.update(5)
+    claim_store = ClaimStore()
+    with Executor(jobs, n_tasks=len(files_to_process)) as executor:
+        claim_store.load(files_to_process, executor)
+        behaviour_files = claim_store.files_by_type("behaviour")
+        behaviour_jsons = claim_store.claims_by_type("behaviour")
+        type_files = claim_store.files_by_type("type")
+        type_jsons = claim_store.claims_by_type("type")
+        claim_files = behaviour_files + type_files
+        claim_jsons = behaviour_jsons + type_jsons
+        pbar.update(5)
 
-    if not skip_vuln:
-        pbar.set_description("Searching CVE dataset for vulnerabilities")
-        cve_vulnerabilities, type_jsons = build_vulnerabilities(
-            type_jsons, pool, pbar, percentage_total=15)
+        if not skip_vuln and cve_feeds is None:
+            pbar.set_description("Searching CVE dataset for vulnerabilities")
+            cve_vulnerabilities, type_jsons = build_vulnerabilities(
+                type_jsons, executor, pbar, percentage_total=15)
+    if not skip_vuln and cve_feeds is not None:
+        pbar.set_description("Searching CVE feeds for vulnerabilities")
+        with CveIndex.in_build_dir(output_dir) as cve_index:
+            cve_index.update(cve_feeds)
+            cve_vulnerabilities, type_jsons = build_vulnerabilities_offline(type_jsons, cve_index)
+        pbar.update(15)
+    if not skip_vuln and write_claims:
         outputFolder = Path(output_dir, "cve_vulnerabilities")
         Path(outputFolder).mkdir(parents=True, exist_ok=True)
         for vuln in cve_vulnerabilities:
@@ -140,21 +183,16 @@ def d3_build(
                 outputFolder, f"{vuln['credentialSubject']['id']}.json")
             # write JSON for CVE vulnerability
             write_json(json_file_name, vuln)
-    else:
+    if skip_vuln:
         pbar.update(15)
     pbar.update(5)
 
     # check for duplicate GUID/UUIDs
     pbar.set_description("Checking UUIDs")
-    guids = [guid for guid in pool.map(get_guid, claim_jsons) if guid]
-    check_guids(guids, files_to_process)
-    parent_guids = list(pool.map(get_parent_claims, claim_jsons))
-    check_guids_array(parent_guids, files_to_process)
-    pbar.update(5)
-
-    pbar.set_description("Checking CPEs")
-    cpes = [cpe for cpe in pool.map(get_cpe, claim_jsons) if cpe]
-    check_cpes_resolve(cpes)
+    guids = [guid for guid in map(get_guid, claim_jsons) if guid]
+    check_guids(guids, claim_files, claim_jsons)
+    parent_guids = list(map(get_parent_claims, claim_jsons))
+    check_guids_array(parent_guids, claim_files, claim_jsons)
     pbar.update(5)
 
     # Pass behaviour files into process_claim_file function
@@ -164,42 +202,115 @@ def d3_build(
         claim["credentialSubject"]["id"]: claim for claim in behaviour_jsons
     }
     behaviour_graph = build_claim_graph(behaviour_map)
-    type_map = build_type_map(type_jsons)
-    process_claim = functools.partial(
-        process_claim_file,
+    # found once for all behaviours, instead of walking every behaviour's ancestors in the workers
+    inherited_rules = aggregate_inherited_rules(behaviour_map, behaviour_graph)
+    # build_type_map modifies the claims, so keep the parsed claims in claim_store intact
+    type_map = build_type_map([deepcopy(claim) for claim in type_jsons])
+    if write_claims:
+        # index of which type owns each MAC address, by the prefixes each type declares
+        MacPrefixIndex.from_type_claims(type_jsons).save(Path(output_dir, MAC_INDEX_FILENAME))
+
+    remote_check_cache = RemoteCheckCache.in_build_dir(
+        output_dir, ttl=remote_check_ttl, refresh=refresh_remote_checks
+    )
+    with remote_check_cache:
+        pbar.set_description("Checking CPEs")
+        cpes = [cpe for cpe in map(get_cpe, claim_jsons) if cpe]
+        check_cpes_resolve(
+            cpes,
+            remote_check_cache,
+            cpe_dictionary=CpeDictionary.load(cpe_dictionary, index_dir=output_dir) if cpe_dictionary else None,
+            check_online=check_uri_resolves,
+        )
+        pbar.update(5)
+
+        if check_uri_resolves:
+            # URIs are checked for every claim, even if unchanged, since the sites they point to may have changed
+            pbar.set_description("Checking URIs resolve")
+            log_unresolved_uris({
+                file: get_claim_uris(file, claim_store[file], type_map)
+                for file in files_to_process
+            }, cache=remote_check_cache)
+
+    build_cache = BuildCache(output_dir)
+    lineage_hasher = LineageHasher(
+        file_hashes=claim_store.hashes,
+        file_ids={
+            file: get_guid(claim_store[file]) for file in claim_store
+            if get_guid(claim_store[file])
+        },
+        behaviour_map=behaviour_map,
+        type_map=type_map,
+    )
+    claim_digests = {
+        file: lineage_hasher.file_digest(file, claim_store[file])
+        for file in files_to_process
+    }
+    if use_cache and write_claims:
+        changed_files = [
+            file for file in files_to_process
+            if not build_cache.is_fresh(pathFinder.get_json_filepath(file), claim_digests[file])
+        ]
+        logging.info(
+            f"Skipping {len(files_to_process) - len(changed_files)} unchanged claims"
+        )
+    else:
+        changed_files = files_to_process
+
+    build_context = dict(
         behaviour_map=behaviour_map,
+        behaviour_index=BehaviourIndex(behaviour_map.values()),
         behaviour_graph=behaviour_graph,
+        inherited_rules=inherited_rules,
         type_map=type_map,
-        check_uri_resolves=check_uri_resolves,
+        # already checked above, once per unique URI
+        check_uri_resolves=False,
         pass_on_failure=pass_on_failure,
         get_json_filepath=pathFinder.get_json_filepath,
     )
     pbar.update(10)
 
     pbar.set_description("Processing claims")
+    changed_claims = [(file, claim_store[file]) for file in changed_files]
+    # each worker receives the build context once, instead of it being
+    # pickled with every chunk of claims
+    executor_kwargs = dict(
+        n_tasks=len(changed_claims),
+        initializer=init_build_context,
+        initargs=(build_context,),
+    )
+    process_claim = process_claim_in_context if write_claims else resolve_claim_in_context
     try:
-        for i, warnings in enumerate(pool.map(process_claim, files_to_process)):
-            for warning in warnings:
-                logging.warning(f"{warning} in {files_to_process[i]}")
+        with Executor(jobs, **executor_kwargs) as executor:
+            results = executor.starmap(process_claim, changed_claims)
     except MaybeEncodingError:
         logging.warning(
             "Error encountered in pool.map, retrying with thread pool...")
         logging.warning("This may take a while...")
-        pool_size = max(mp.cpu_count() - 1, 1)
-        pool = ThreadPool(processes=pool_size)
-        for i, warnings in enumerate(pool.map(process_claim, files_to_process)):
-            for warning in warnings:
-                logging.warning(f"{warning} in {files_to_process[i]}")
+        with Executor(jobs, threads=True, **executor_kwargs) as executor:
+            results = executor.starmap(process_claim, changed_claims)
+    if write_claims:
+        all_warnings = [warnings for _written, warnings in results]
+        # claims skipped because of `pass_on_failure` may have a stale JSON from an earlier build
+        skipped_files = {file for file, (written, _warnings) in zip(changed_files, results) if not written}
+    else:
+        all_warnings = [warnings for _claim, warnings in results]
+        built_claims.update(
+            (pathFinder.get_json_filepath(file), claim)
+            for file, (claim, _warnings) in zip(changed_files, results)
+            if claim is not None
+        )
+    for file, warnings in zip(changed_files, all_warnings):
+        for warning in warnings:
+            logging.warning(f"{warning} in {file}")
+
+    if write_claims:
+        for file in files_to_process:
+            if file not in skipped_files:
+                build_cache.record(pathFinder.get_json_filepath(file), claim_digests[file])
+        build_cache.save()
 
-    try:
-        malicious_behaviours_dir.cleanup()
-    except UnboundLocalError:
-        pass
-    pool.close()
     pbar.update(20)
     pbar.set_description("Done!")
     pbar.close()
-
-
-def get_files_by_type(files, type_code):
-    return [file for file in files if get_yaml_suffixes(file)[0] == "." + type_code]
+    return None if write_claims else built_claims
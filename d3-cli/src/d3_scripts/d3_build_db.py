@@ -1,23 +1,158 @@
 #! /usr/bin/python3
+import typing
+from tempfile import TemporaryDirectory
 from tqdm import tqdm
 from pathlib import Path
 
-from .export_tools import CsvExporter
+from .executor import Executor
+from .export_tools import (
+    CsvExporter, ParquetExporter, SqliteExporter, SQLITE_FILENAME, claim_arrow_records, claim_sqlite_rows
+)
 from .d3_build import d3_build
 
+T = typing.TypeVar("T")
+# a D3 claim JSON, and the claim if it's already loaded
+ClaimItem = typing.Tuple[Path, typing.Optional[dict]]
+# number of shards per worker, so that workers that finish early can take more
+SHARDS_PER_JOB = 4
+BAR_FORMAT = "{bar}| {percentage:3.0f}% ({n_fmt}/{total_fmt}) [{elapsed}]"
+EXPORT_FORMATS = ["csv", "sqlite", "parquet"]
 
-def d3_build_db(json_dir: Path, csv_dir: Path):
-    csv_exporter = CsvExporter(csv_dir=csv_dir)
-    if not json_dir.exists():
+
+def export_csv_shard(csv_dir: Path, claims: typing.List[ClaimItem]) -> int:
+    """Exports D3 claim JSONs to CSVs without headers, to be merged by `CsvExporter.append_csv_shards`
+
+    Args:
+        csv_dir: The directory to export the shard to.
+        claims: The D3 claim JSONs of the shard, in order, each with its claim,
+                or `None` to load it from the file.
+
+    Returns:
+        The number of exported claims.
+    """
+    with CsvExporter(csv_dir=csv_dir) as csv_exporter:
+        csv_exporter.create_csv_templates(write_header=False)
+        for file, claim in claims:
+            csv_exporter.d3_json_export_csv(file, claim)
+    return len(claims)
+
+
+def d3_build_db(
+    json_dir: typing.Optional[Path],
+    csv_dir: Path,
+    jobs: typing.Optional[int] = None,
+    export_format: str = "csv",
+    claims: typing.Optional[typing.Mapping[Path, dict]] = None,
+):
+    """Exports the D3 claim JSONs of a build directory to the D3DB output CSVs,
+    or to a SQLite database, or to Parquet files
+
+    Rows are in the order of the sorted JSON files. The claims of a build can be exported
+    without writing them to disk first, by passing those returned by
+    `d3_build(..., write_claims=False)` as `claims`, which gives the same rows. With several workers, contiguous
+    shards of the files are exported in parallel and then concatenated in order,
+    so the CSVs are the same.
+
+    Args:
+        json_dir: The build directory. Ignored if `claims` are given.
+        csv_dir: The directory to write the CSVs, the SQLite database `d3db.sqlite`,
+                 or the Parquet files, to.
+        jobs: The maximum number of worker processes. Defaults to `executor.default_jobs()`.
+        export_format: One of `EXPORT_FORMATS`.
+        claims: Map of the JSON filepath of each built claim to the claim, to export instead of `json_dir`.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format {export_format!r}, expected one of {EXPORT_FORMATS}")
+    if claims is None and not json_dir.exists():
         print("D3 claims not compiled. Compiling now...")
         d3_build()
 
     print("Exporting D3 claims...")
     # sort so that the *.csv files are relatively consistent
-    files_to_process = sorted(json_dir.glob("**/*.d3.json"))
+    if claims is None:
+        files_to_process: typing.List[ClaimItem] = [(file, None) for file in sorted(json_dir.glob("**/*.d3.json"))]
+    else:
+        files_to_process = sorted(claims.items(), key=lambda item: Path(item[0]))
+    if export_format == "sqlite":
+        d3_build_sqlite(files_to_process, Path(csv_dir) / SQLITE_FILENAME, jobs)
+        return
+    if export_format == "parquet":
+        d3_build_parquet(files_to_process, Path(csv_dir), jobs)
+        return
+
+    with CsvExporter(csv_dir=csv_dir) as csv_exporter, \
+            Executor(jobs, n_tasks=len(files_to_process)) as executor:
+        csv_exporter.create_csv_templates()
+        if executor.is_serial:
+            for file, claim in tqdm(files_to_process, bar_format=BAR_FORMAT, ncols=80):
+                csv_exporter.d3_json_export_csv(file, claim)
+            return
+
+        n_shards = executor.jobs * SHARDS_PER_JOB
+        shard_size = -(-len(files_to_process) // n_shards)
+        shards = [files_to_process[i:i + shard_size] for i in range(0, len(files_to_process), shard_size)]
+        with TemporaryDirectory(dir=csv_dir, prefix=".shards-") as shards_dir:
+            shard_dirs = [Path(shards_dir) / str(i) for i in range(len(shards))]
+            with tqdm(total=len(files_to_process), bar_format=BAR_FORMAT, ncols=80) as pbar:
+                for n_files in executor.imap(_export_csv_shard, zip(shard_dirs, shards)):
+                    pbar.update(n_files)
+            csv_exporter.append_csv_shards(shard_dirs)
+
+
+def d3_build_sqlite(files: typing.List[ClaimItem], sqlite_path: Path, jobs: typing.Optional[int] = None):
+    """Exports D3 claim JSONs to a SQLite database, in a single transaction
+
+    The claims are converted to rows in parallel, and inserted in order by this process.
+    Foreign keys are checked when the export is committed, so a claim that refers to a
+    type or behaviour that isn't exported, e.g. one skipped by `d3_build(..., pass_on_failure=True)`,
+    fails the whole export, and the existing database is kept.
+
+    Args:
+        files: The D3 claim JSONs, in order, each with its claim, or `None` to load it from the file.
+        sqlite_path: The filepath of the database, which is replaced.
+        jobs: The maximum number of worker processes. Defaults to `executor.default_jobs()`.
+
+    Raises:
+        sqlite3.IntegrityError: If a foreign key refers to a row that doesn't exist.
+    """
+    with SqliteExporter(sqlite_path) as sqlite_exporter:
+        _export_in_workers(files, claim_sqlite_rows, sqlite_exporter.export_rows, jobs)
+
+
+def d3_build_parquet(files: typing.List[ClaimItem], parquet_dir: Path, jobs: typing.Optional[int] = None):
+    """Exports D3 claim JSONs to a Parquet file per table, which requires pyarrow
+
+    The claims are converted to records in parallel, and written in order by this process.
+
+    Args:
+        files: The D3 claim JSONs, in order, each with its claim, or `None` to load it from the file.
+        parquet_dir: The directory to write the Parquet files to.
+        jobs: The maximum number of worker processes. Defaults to `executor.default_jobs()`.
+    """
+    with ParquetExporter(parquet_dir) as parquet_exporter:
+        _export_in_workers(files, claim_arrow_records, parquet_exporter.export_records, jobs)
+
+
+def _export_in_workers(
+    files: typing.List[ClaimItem],
+    convert: typing.Callable[[Path, typing.Optional[dict]], T],
+    export: typing.Callable[[T], None],
+    jobs: typing.Optional[int] = None,
+):
+    """Converts claims in worker processes, exporting the results in order in this process"""
+    with Executor(jobs, n_tasks=len(files)) as executor:
+        chunksize = max(len(files) // (executor.jobs * SHARDS_PER_JOB), 1)
+        for converted in tqdm(
+            executor.imap(_convert_claim, ((convert, file, claim) for file, claim in files), chunksize=chunksize),
+            total=len(files), bar_format=BAR_FORMAT, ncols=80,
+        ):
+            export(converted)
+
+
+def _convert_claim(args: typing.Tuple[typing.Callable[[Path, typing.Optional[dict]], T], Path, typing.Optional[dict]]):
+    convert, file, claim = args
+    return convert(file, claim)
 
-    csv_exporter.create_csv_templates()
 
-    bar_format = "{bar}| {percentage:3.0f}% ({n_fmt}/{total_fmt}) [{elapsed}]"
-    for file in tqdm(files_to_process, bar_format=bar_format, ncols=80):
-        csv_exporter.d3_json_export_csv(file)
+def _export_csv_shard(args: typing.Tuple[Path, typing.List[ClaimItem]]) -> int:
+    return export_csv_shard(*args)
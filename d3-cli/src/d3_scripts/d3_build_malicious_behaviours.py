@@ -1,7 +1,20 @@
+import csv
+import json
+import logging
+import typing
 import requests
-import re
+from pathlib import Path
 from uuid import UUID
 import random
+from .json_tools import write_json, claim_digest
+from .urlhaus_snapshot import UrlhausSnapshot
+from .validate_schemas import validate_d3_claims
+
+# online active malware urls - https://urlhaus.abuse.ch/api/
+URLHAUS_CSV_ONLINE = "https://urlhaus.abuse.ch/downloads/csv_online/"
+# folder of the malicious behaviours in the build output directory
+MALICIOUS_BEHAVIOURS_DIR = "maliciousUrls"
+LOG = logging.getLogger(__name__)
 
 
 def generate_seeded_uuid(seed):
@@ -11,40 +24,247 @@ def generate_seeded_uuid(seed):
     return uuid.hex
 
 
-def get_malicious_behaviours():
-    # online active malware urls - https://urlhaus.abuse.ch/api/
-    request = "https://urlhaus.abuse.ch/downloads/csv_online/"
-    response = requests.get(request)
-    csv_data = response.text.split("\r\n")
-    headers = [header.strip("#").strip() for header in csv_data[8].split(",")]
-    data = [re.findall('"([^"]*)"', row) for row in csv_data[9:-1]]
-    json_data = [{headers[i]: entry for (i, entry) in enumerate(row)} for row in data]
-    behaviours = [
-        {
-            "malicious": True,
-            "ruleName": f"{row['id']}-{row['threat']}",
-            "id": generate_seeded_uuid((row["id"])),
-            "rules": [
-                {
-                    "name": f"Traffic to {row['id']}-{row['threat']}",
-                    "matches": {
-                        "ip4": {
-                            "destinationDnsName": {
-                                "addr": row["url"],
-                                "allowed": False,
-                            }
+def parse_urlhaus_csv(lines: typing.Iterable[str]) -> typing.Iterator[typing.Dict[str, str]]:
+    """Parses a URLhaus CSV export one line at a time
+
+    The column names are in the last comment (`#`) line before the data, e.g.
+    `# id,dateadded,url,url_status,last_online,threat,tags,urlhaus_link,reporter`
+
+    Args:
+        lines: The lines of the CSV
+
+    Returns:
+        The rows of the CSV, as maps of column name to value
+
+    Raises:
+        ValueError: If a data line comes before any header line.
+    """
+    headers = None
+
+    def is_data_line(line: str) -> bool:
+        nonlocal headers
+        if line.startswith("#"):
+            if "," in line:
+                headers = [header.strip("#").strip() for header in line.split(",")]
+            return False
+        return bool(line.strip())
+
+    # csv.reader pulls lines lazily, so headers are set before the first data row is parsed
+    for row in csv.reader(filter(is_data_line, lines)):
+        if headers is None:
+            raise ValueError("URLhaus CSV has no header line")
+        yield dict(zip(headers, row))
+
+
+def _iter_file_lines(source: Path) -> typing.Iterator[str]:
+    with open(source, newline="", encoding="utf-8") as f:
+        yield from f
+
+
+def _iter_response_lines(response: requests.Response) -> typing.Iterator[str]:
+    with response:
+        response.encoding = response.encoding or "utf-8"
+        yield from response.iter_lines(decode_unicode=True)
+
+
+def _feed_file_state(source: Path) -> str:
+    stat = source.stat()
+    return json.dumps({"path": str(source.resolve()), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns})
+
+
+def fetch_urlhaus_feed(
+    source: typing.Optional[Path] = None,
+    feed_state: typing.Optional[str] = None,
+) -> typing.Tuple[typing.Optional[str], typing.Optional[typing.Iterator[str]]]:
+    """Fetches the URLhaus CSV of online malware URLs, unless it is unchanged
+
+    Args:
+        source: A local copy of the URLhaus CSV. If None, it is downloaded.
+        feed_state: The state of the feed when it was last fetched, if known.
+                    Downloads are made conditional on the feed having changed since.
+
+    Returns:
+        The current state of the feed, and the lines of the CSV, or None if the feed is unchanged
+    """
+    if source is not None:
+        state = _feed_file_state(Path(source))
+        if state == feed_state:
+            return state, None
+        return state, _iter_file_lines(source)
+
+    previous_state = json.loads(feed_state) if feed_state else {}
+    headers = {}
+    if previous_state.get("url") == URLHAUS_CSV_ONLINE:
+        if previous_state.get("ETag"):
+            headers["If-None-Match"] = previous_state["ETag"]
+        if previous_state.get("Last-Modified"):
+            headers["If-Modified-Since"] = previous_state["Last-Modified"]
+    response = requests.get(URLHAUS_CSV_ONLINE, stream=True, headers=headers)
+    if response.status_code == 304:
+        response.close()
+        return feed_state, None
+    response.raise_for_status()
+    state = {"url": URLHAUS_CSV_ONLINE}
+    for header in ("ETag", "Last-Modified"):
+        state[header] = response.headers.get(header)
+    return json.dumps(state), _iter_response_lines(response)
+
+
+def malicious_behaviour(row: typing.Mapping[str, str]) -> dict:
+    """Creates the credentialSubject of a behaviour claim that blocks a URLhaus URL
+
+    Args:
+        row: A row of the URLhaus CSV
+    """
+    return {
+        "malicious": True,
+        "ruleName": f"{row['id']}-{row['threat']}",
+        "id": generate_seeded_uuid((row["id"])),
+        "rules": [
+            {
+                "name": f"Traffic to {row['id']}-{row['threat']}",
+                "matches": {
+                    "ip4": {
+                        "destinationDnsName": {
+                            "addr": row["url"],
+                            "allowed": False,
                         }
                     }
-                },
-                {
-                    "name": f"Traffic from {row['id']}-{row['threat']}",
-                    "matches": {
-                        "ip4": {
-                            "sourceDnsName": row["url"]
-                        }
+                }
+            },
+            {
+                "name": f"Traffic from {row['id']}-{row['threat']}",
+                "matches": {
+                    "ip4": {
+                        "sourceDnsName": row["url"]
                     }
                 }
-            ]
+            }
+        ]
+    }
+
+
+def iter_malicious_behaviours(source: typing.Optional[Path] = None) -> typing.Iterator[dict]:
+    """Streams malicious behaviours from the URLhaus list of online malware URLs
+
+    Args:
+        source: A local copy of the URLhaus CSV. If None, it is downloaded.
+
+    Returns:
+        The credentialSubject of a behaviour claim for each URL
+    """
+    _feed_state, lines = fetch_urlhaus_feed(source)
+    for row in parse_urlhaus_csv(lines):
+        yield malicious_behaviour(row)
+
+
+def get_malicious_behaviours(source: typing.Optional[Path] = None) -> typing.List[dict]:
+    """Returns malicious behaviours from the URLhaus list of online malware URLs
+
+    See `iter_malicious_behaviours`.
+    """
+    return list(iter_malicious_behaviours(source))
+
+
+def malicious_behaviour_claims(source: typing.Optional[Path] = None) -> typing.Dict[str, dict]:
+    """Returns the malicious behaviour claims of the URLhaus list of online malware URLs
+
+    Unlike `sync_malicious_behaviours`, the claims are only validated, not written to a build directory.
+
+    Args:
+        source: A local copy of the URLhaus CSV. If None, it is downloaded.
+
+    Returns:
+        Map of behaviour ID to its behaviour claim
+    """
+    claims = {}
+    for behaviour in iter_malicious_behaviours(source):
+        claims[behaviour["id"]] = {"type": "d3-device-type-behaviour", "credentialSubject": behaviour}
+    validate_d3_claims(claims.values(), "behaviour")
+    return claims
+
+
+def malicious_behaviour_json_filepath(output_dir: Path, behaviour_id: str) -> Path:
+    """Returns the filepath of the built JSON claim of a malicious behaviour"""
+    return Path(output_dir, MALICIOUS_BEHAVIOURS_DIR, f"mal-{behaviour_id}.behaviour.d3.json")
+
+
+class MaliciousBehavioursDelta(typing.NamedTuple):
+    """The IDs of the malicious behaviours changed by `sync_malicious_behaviours`"""
+
+    added: typing.List[str]
+    changed: typing.List[str]
+    removed: typing.List[str]
+
+
+def sync_malicious_behaviours(
+    output_dir: Path,
+    source: typing.Optional[Path] = None,
+    use_cache: bool = True,
+) -> MaliciousBehavioursDelta:
+    """Brings the malicious behaviours in a build output directory up to date with URLhaus
+
+    The feed is compared against the `UrlhausSnapshot` of the last feed ingested into
+    `output_dir`, so only the behaviours added or changed since are written,
+    and the behaviours of removed URLs are deleted.
+    If the feed itself is unchanged, it isn't downloaded or parsed at all.
+
+    Args:
+        output_dir: The build output directory
+        source: A local copy of the URLhaus CSV. If None, it is downloaded.
+        use_cache: If False, every malicious behaviour is written again.
+
+    Returns:
+        The malicious behaviours that were added, changed and removed
+    """
+    output_dir = Path(output_dir)
+    with UrlhausSnapshot.in_build_dir(output_dir) as snapshot:
+        previous_digests = snapshot.digests()
+        feed_state = snapshot.feed_state
+        if feed_state is None and not previous_digests:
+            # first sync, so remove any behaviours built before the snapshot existed
+            previous_digests = {
+                json_file.name[len("mal-"):-len(".behaviour.d3.json")]: ""
+                for json_file in (output_dir / MALICIOUS_BEHAVIOURS_DIR).glob("mal-*.behaviour.d3.json")
+            }
+        # behaviours missing from the output directory have to be written again
+        stale_ids = {
+            behaviour_id for behaviour_id in previous_digests
+            if not use_cache or not malicious_behaviour_json_filepath(output_dir, behaviour_id).exists()
         }
-        for row in json_data]
-    return behaviours
+
+        feed_state, lines = fetch_urlhaus_feed(source, None if stale_ids else feed_state)
+        if lines is None:
+            LOG.info("URLhaus feed is unchanged since the last build")
+            return MaliciousBehavioursDelta(added=[], changed=[], removed=[])
+
+        digests = {}
+        updated_claims = {}
+        for row in parse_urlhaus_csv(lines):
+            claim = {"type": "d3-device-type-behaviour", "credentialSubject": malicious_behaviour(row)}
+            behaviour_id = claim["credentialSubject"]["id"]
+            digests[behaviour_id] = claim_digest(claim)
+            if digests[behaviour_id] != previous_digests.get(behaviour_id) or behaviour_id in stale_ids:
+                updated_claims[behaviour_id] = claim
+        removed = [behaviour_id for behaviour_id in previous_digests if behaviour_id not in digests]
+
+        # every malicious behaviour has the same form, so validate them all at once
+        validate_d3_claims(updated_claims.values(), "behaviour")
+        (output_dir / MALICIOUS_BEHAVIOURS_DIR).mkdir(parents=True, exist_ok=True)
+        for behaviour_id, claim in updated_claims.items():
+            # sorted keys, matching the output of claims loaded from YAML
+            write_json(malicious_behaviour_json_filepath(output_dir, behaviour_id), claim, sort_keys=True)
+        for behaviour_id in removed:
+            malicious_behaviour_json_filepath(output_dir, behaviour_id).unlink(missing_ok=True)
+        snapshot.apply(feed_state, {behaviour_id: digests[behaviour_id] for behaviour_id in updated_claims}, removed)
+
+    delta = MaliciousBehavioursDelta(
+        added=[behaviour_id for behaviour_id in updated_claims if behaviour_id not in previous_digests],
+        changed=[behaviour_id for behaviour_id in updated_claims if behaviour_id in previous_digests],
+        removed=removed,
+    )
+    LOG.info(
+        f"Malicious behaviours: {len(delta.added)} added, {len(delta.changed)} changed, "
+        f"{len(delta.removed)} removed, {len(digests) - len(updated_claims)} unchanged"
+    )
+    return delta
@@ -2,6 +2,8 @@ import requests
 import json
 import urllib.parse as urllp
 import re
+import typing
+from .cve_index import CveIndex
 
 
 def flatten(lst):
@@ -22,16 +24,21 @@ def json_stringify(s):
     return json.dumps(s, separators=(",", ":"))
 
 
-def reproject(vuln):
+def vuln_claim(cve_id: str) -> dict:
+    """Creates a D3 vulnerability claim for a CVE"""
     return {
         "type": "d3-device-type-vuln",
         "credentialSubject": {
-            "id": vuln["CVE_data_meta"]["ID"],
-            "vulnerability": f"https://nvd.nist.gov/vuln/detail/{vuln['CVE_data_meta']['ID']}",
+            "id": cve_id,
+            "vulnerability": f"https://nvd.nist.gov/vuln/detail/{cve_id}",
         },
     }
 
 
+def reproject(vuln):
+    return vuln_claim(vuln["CVE_data_meta"]["ID"])
+
+
 def get_vulnerabilities(string_to_search_for, projection={"CVE_data_meta": 1}):
     ndJSON = False
     datasetId = "Efl8dagnBm"
@@ -86,3 +93,39 @@ def retrieve_vulnerability(type_json):
         )
         return cve_vulnerabilities, type_json
     return [], type_json
+
+
+def build_vulnerabilities_offline(
+    type_jsons: typing.Sequence[dict], cve_index: CveIndex
+) -> typing.Tuple[typing.List[dict], typing.List[dict]]:
+    """Finds the vulnerabilities of type claims in a local CVE index, in bulk
+
+    Args:
+        type_jsons: The D3 type claims
+        cve_index: The CVE index, see `CveIndex.match_types`
+
+    Returns:
+        The vulnerability claims of all matched CVEs, and the type claims with
+        the IDs of the matched CVEs added to their vulnerabilities.
+        Type claims are copied if changed, not modified.
+    """
+    matches = cve_index.match_types(type_jsons)
+    type_jsons_with_vulnerabilities = []
+    cve_ids = set()
+    for type_json in type_jsons:
+        current_vulnerabilities = type_json["credentialSubject"].get("vulnerabilities", [])
+        new_vulnerabilities = [
+            cve_id for cve_id in matches[type_json["credentialSubject"]["id"]]
+            if cve_id not in current_vulnerabilities
+        ]
+        if new_vulnerabilities:
+            type_json = {
+                **type_json,
+                "credentialSubject": {
+                    **type_json["credentialSubject"],
+                    "vulnerabilities": current_vulnerabilities + new_vulnerabilities,
+                },
+            }
+        cve_ids.update(new_vulnerabilities)
+        type_jsons_with_vulnerabilities.append(type_json)
+    return [vuln_claim(cve_id) for cve_id in sorted(cve_ids)], type_jsons_with_vulnerabilities
@@ -1,8 +1,10 @@
 #! /usr/bin/python3
 from .guid import guid
 from .d3_build import d3_build
-from .d3_build_db import d3_build_db
+from .d3_build_db import d3_build_db, EXPORT_FORMATS
+from .d3_audit import audit_flow_log
 from .d3_utils import validate_d3_claim_files
+from .remote_check_cache import DEFAULT_REMOTE_CHECK_TTL
 from .website_builder import build_website
 from tempfile import TemporaryDirectory
 import argparse
@@ -57,9 +59,11 @@ def cli(argv=None):
               'firmwares.\n'
               'website creates a directory containing the source for a static website of claims which can be browsed,'
               'with unique uris for each type.\n'
+              'audit checks the flows in --flow-log against the behaviours of their devices\' types, writing the '
+              'violations and the number of flows decided by each rule to the output directory.\n'
               ),
         default="build",
-        choices=["build", "lint", "export", "website"],
+        choices=["build", "lint", "export", "website", "audit"],
     )
     # COMMENTED OUT AS THIS FUNCTIONALITY IS DEPRECATED, REPLACED BY CPE LOOKUP
     # parser.add_argument(
@@ -76,19 +80,91 @@ def cli(argv=None):
         This takes a bit of time, and requires an internet connection
         so you may wish to skip this step for local testing.""",
     )
+    parser.add_argument(
+        "--malicious-feed",
+        nargs="?",
+        help="""local copy of the URLhaus CSV of online malware URLs
+        (https://urlhaus.abuse.ch/downloads/csv_online/) to add malicious behaviours from,
+        instead of downloading it.""",
+        type=Path,
+    )
+    parser.add_argument(
+        "--export-format",
+        nargs="?",
+        help="""format to export to in export mode.
+        csv writes a CSV file per table, sqlite writes a single d3db.sqlite database
+        with the same tables, foreign keys and indexes, and parquet writes a typed
+        Parquet file per table (requires pyarrow, e.g. pip install d3-cli[parquet]).""",
+        default="csv",
+        choices=EXPORT_FORMATS,
+    )
     parser.add_argument(
         "--build-dir",
         nargs="?",
         help="""build directory with json claims to export to build website with.
-        Specifying this will skip build step in export mode and website mode.""",
+        Specifying this will skip build step in export mode, website mode and audit mode.""",
+        type=Path,
+    )
+    parser.add_argument(
+        "--flow-log",
+        nargs="?",
+        help="""CSV or NDJSON log of network flows to audit, optionally compressed.
+        Each flow needs the type_id or the mac of its device, and its destination_ip,
+        destination_name and/or destination_port.""",
         type=Path,
     )
     parser.add_argument(
         "--check_uri_resolves",
         action="store_true",
-        help="""check that URIs/refs resolve.
+        help="""check that URIs/refs resolve, and that CPEs exist using the NVD API
+        (unless --cpe-dictionary is given).
         This can be very slow, so you may want to leave this off normally.""",
     )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="""rebuild every claim, even if it and the claims it depends on
+        are unchanged since the last build into the output directory.""",
+    )
+    parser.add_argument(
+        "--remote-check-ttl",
+        nargs="?",
+        help="""number of seconds for which the results of checking URIs and CPEs
+        are cached in the output directory. Defaults to one day.""",
+        default=DEFAULT_REMOTE_CHECK_TTL,
+        type=float,
+    )
+    parser.add_argument(
+        "--refresh-remote-checks",
+        action="store_true",
+        help="ignore cached results, checking every URI and CPE again.",
+    )
+    parser.add_argument(
+        "--cpe-dictionary",
+        nargs="?",
+        help="""NVD CPE dictionary to check CPEs against, instead of the NVD API.
+        Either the official CPE dictionary XML, CPE 2.0 JSON feed files,
+        or a directory containing them, optionally gzipped.""",
+        type=Path,
+    )
+    parser.add_argument(
+        "--cve-feeds",
+        nargs="?",
+        help="""NVD JSON 1.1 or 2.0 CVE feed, or a directory of feeds, optionally gzipped.
+        If given, types are matched to CVEs by CPE, and by model number or name,
+        and the vulnerabilities are added to the build.
+        Feeds are indexed in the output directory, and only new or changed feeds are re-indexed.""",
+        type=Path,
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        nargs="?",
+        help="""maximum number of worker processes to use.
+        Defaults to one less than the number of CPUs.
+        Small inputs are always processed in a single process.""",
+        type=int,
+    )
     parser.add_argument(
         "--web-address",
         nargs="?",
@@ -120,7 +196,8 @@ def cli(argv=None):
 
     export_only = (args.build_dir is not None and args.mode == "export")
     website_only = (args.build_dir is not None and args.mode == "website")
-    if len(args.input) == 0 and not (export_only or website_only):
+    audit_only = (args.build_dir is not None and args.mode == "audit")
+    if len(args.input) == 0 and not (export_only or website_only or audit_only):
         logging.warning("No directories provided, Exiting...")
         return
 
@@ -134,7 +211,7 @@ def cli(argv=None):
             )
         )
         validate_d3_claim_files(
-            d3_files, check_uri_resolves=args.check_uri_resolves
+            d3_files, check_uri_resolves=args.check_uri_resolves, jobs=args.jobs
         )
         logging.info("All files passed linting successfully.")
 
@@ -144,8 +221,15 @@ def cli(argv=None):
             d3_folders=args.input,
             output_dir=args.output,
             check_uri_resolves=args.check_uri_resolves,
-            skip_vuln=True,
+            skip_vuln=args.cve_feeds is None,
             skip_mal=args.skip_mal,
+            use_cache=not args.no_cache,
+            jobs=args.jobs,
+            remote_check_ttl=args.remote_check_ttl,
+            refresh_remote_checks=args.refresh_remote_checks,
+            cpe_dictionary=args.cpe_dictionary,
+            cve_feeds=args.cve_feeds,
+            malicious_feed=args.malicious_feed,
         )
 
     elif args.mode == "export":
@@ -154,18 +238,28 @@ def cli(argv=None):
             build_dir = Path(args.build_dir)
             if not build_dir.exists():
                 raise Exception("Non existent build-dir provided. Exiting.")
+            claims = None
         else:
+            # the built claims are exported straight from memory, so the temporary
+            # build directory only holds the caches of the build
             temp_dir = TemporaryDirectory()
             build_dir = Path(temp_dir.name)
-            d3_build(
+            claims = d3_build(
                 d3_folders=args.input,
                 output_dir=build_dir,
                 check_uri_resolves=args.check_uri_resolves,
-                skip_vuln=True,
+                skip_vuln=args.cve_feeds is None,
                 skip_mal=args.skip_mal,
+                jobs=args.jobs,
+                remote_check_ttl=args.remote_check_ttl,
+                refresh_remote_checks=args.refresh_remote_checks,
+                cpe_dictionary=args.cpe_dictionary,
+                cve_feeds=args.cve_feeds,
+                malicious_feed=args.malicious_feed,
+                write_claims=False,
             )
 
-        d3_build_db(build_dir, args.output)
+        d3_build_db(build_dir, args.output, jobs=args.jobs, export_format=args.export_format, claims=claims)
         try:
             temp_dir.cleanup()
         except NameError:
@@ -184,11 +278,17 @@ def cli(argv=None):
                 d3_folders=args.input,
                 output_dir=build_dir,
                 check_uri_resolves=args.check_uri_resolves,
-                skip_vuln=True,
+                skip_vuln=args.cve_feeds is None,
                 skip_mal=args.skip_mal,
+                jobs=args.jobs,
+                remote_check_ttl=args.remote_check_ttl,
+                refresh_remote_checks=args.refresh_remote_checks,
+                cpe_dictionary=args.cpe_dictionary,
+                cve_feeds=args.cve_feeds,
+                malicious_feed=args.malicious_feed,
             )
         logging.info("building website")
-        d3_files = [d3_file for d3_file in build_dir.glob("**/*.json")]
+        d3_files = [d3_file for d3_file in build_dir.glob("**/*.d3.json")]
         output_path = Path(args.output) if args.output else Path.cwd() / "site"
         build_website(d3_files, output_path, web_address=args.web_address)
         try:
@@ -196,6 +296,38 @@ def cli(argv=None):
         except NameError:
             pass
 
+    elif args.mode == "audit":
+        if args.flow_log is None or not args.flow_log.exists():
+            raise Exception("Non existent flow-log provided. Exiting.")
+        if args.build_dir:
+            build_dir = Path(args.build_dir)
+            if not build_dir.exists():
+                raise Exception("Non existent build-dir provided. Exiting.")
+        else:
+            logging.info("building json data")
+            temp_dir = TemporaryDirectory()
+            build_dir = Path(temp_dir.name)
+            d3_build(
+                d3_folders=args.input,
+                output_dir=build_dir,
+                check_uri_resolves=args.check_uri_resolves,
+                skip_vuln=args.cve_feeds is None,
+                skip_mal=args.skip_mal,
+                jobs=args.jobs,
+                remote_check_ttl=args.remote_check_ttl,
+                refresh_remote_checks=args.refresh_remote_checks,
+                cpe_dictionary=args.cpe_dictionary,
+                cve_feeds=args.cve_feeds,
+                malicious_feed=args.malicious_feed,
+            )
+        logging.info("auditing")
+        summary = audit_flow_log(build_dir, args.flow_log, args.output)
+        logging.info(f"{summary.violations} of {summary.flows} flows are violations")
+        try:
+            temp_dir.cleanup()
+        except NameError:
+            pass
+
     else:
         raise Exception("unknown mode")
 
@@ -34,6 +34,12 @@ def cli(argv=None):
         action="store_true",
         help="Check that URIs/refs resolve. This can be very slow, so you may want to leave this off normally.",
     )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        help="Maximum number of worker processes. Defaults to one less than the number of CPUs.",
+    )
     debug_level_group = parser.add_mutually_exclusive_group()
     debug_level_group.add_argument(
         "--verbose", "-v", dest="log_level", action="append_const", const=-10,
@@ -55,7 +61,9 @@ def cli(argv=None):
         ),
     )
 
-    validate_d3_claim_files(yaml_file_names, check_uri_resolves=args.check_uri_resolves)
+    validate_d3_claim_files(
+        yaml_file_names, check_uri_resolves=args.check_uri_resolves, jobs=args.jobs
+    )
 
 
 if __name__ == "__main__":
@@ -1,38 +1,59 @@
+#!/usr/bin/env python3
 # Options:
 #  a) Download from web link and populate into ./db folder:
-#     python3 d3_populate.py\
+#     python3 -m d3_scripts.d3_populate\
 #         https://gitlab.com/wireshark/wireshark/-/raw/master/manuf ./db
 #  b) Retrieve from file and populate into ./db folder:
-#     python3 d3_populate.py ../examples/manuf.txt ./db
+#     python3 -m d3_scripts.d3_populate ../examples/manuf.txt ./db
 
+import argparse
+import io
+import logging
 import re
 import csv
 import requests
-import sys
 import os
-import yaml
+import typing
 import uuid
 from pathlib import Path
+from .executor import Executor
+from .yaml_tools import dump_yaml
 
 GIT_REPO_ADDRESS = "https://gitlab.com/wireshark/wireshark/-/raw/master/manuf"
 POPULATE_FOLDER_PATH = str(Path("./db"))
 DEVICE_TYPE_FILENAME = "device.type.d3.yaml"
+LOG = logging.getLogger(__name__)
 
+_hp = "[0-9a-fA-F]{2}"
+MANUF_RE = re.compile(r"^({}:{}:{})((:{})*)(/[0-9][0-9])*$".format(_hp, _hp, _hp, _hp))
 
-def get_web_file(url: str):
-    data = requests.get(url, allow_redirects=True)
-    csv_out = csv.reader(data.text.splitlines(), delimiter="\t")
-    return csv_out
 
+def get_web_file(url: str) -> typing.Iterator[typing.List[str]]:
+    """Streams the rows of a manuf file from a web link"""
+    with requests.get(url, allow_redirects=True, stream=True) as data:
+        data.raise_for_status()
+        data.encoding = data.encoding or "utf-8"
+        yield from csv.reader(data.iter_lines(decode_unicode=True), delimiter="\t")
 
-def get_storage_file(path: str):
-    try:
-        with open(path, "r") as f:
-            content = f.read()
-            csv_out = csv.reader(content.splitlines(), delimiter="\t")
-        return csv_out
-    except OSError:
-        pass
+
+def get_storage_file(path: str) -> typing.Iterator[typing.List[str]]:
+    """Streams the rows of a local manuf file"""
+    with open(path, "r") as f:
+        yield from csv.reader(f, delimiter="\t")
+
+
+def get_manuf_rows(source: str) -> typing.Iterator[typing.List[str]]:
+    """Streams the rows of a manuf file
+
+    Args:
+        source: The filepath of a local manuf file, or a web link to one
+
+    Returns:
+        The tab-separated rows of the manuf file
+    """
+    if os.path.isfile(source):
+        return get_storage_file(source)
+    return get_web_file(source)
 
 
 def generate_d3_type(mac: str, short_name: str, long_name: str):
@@ -49,74 +70,130 @@ def generate_d3_type(mac: str, short_name: str, long_name: str):
     }
 
 
-def dump_yaml_files(populate_folder: str, d3_dict):
-    for key in d3_dict:
-        company_folder_path = os.path.join(populate_folder, key)
-
-        # Create the folder with the given short company name
-        os.makedirs(company_folder_path, exist_ok=True)
-
-        yaml_file_path = os.path.join(company_folder_path, DEVICE_TYPE_FILENAME)
-
-        d3_type = d3_dict[key]
-        with open(yaml_file_path, mode="wt", encoding="utf-8") as file:
-            yaml.dump(d3_type, file)
-            print("Added {}".format(yaml_file_path))
+def parse_manuf(rows: typing.Iterable[typing.List[str]]) -> typing.Dict[str, dict]:
+    """Groups the MAC address blocks of a manuf file by company
 
+    Args:
+        rows: The rows of a manuf file, e.g. from `get_manuf_rows`
 
-def d3_populate(csv_data, populate_folder: str):
-    print("Populating with data from {}".format(git_repo))
-    print("Populating to {}".format(populate_folder))
-
-    hp = "[0-9a-fA-F]{2}"
-    manuf_re = re.compile(r"^({}:{}:{})((:{})*)(/[0-9][0-9])*$".format(hp, hp, hp, hp))
-
+    Returns:
+        Map of each company's short name to its D3 type claim
+    """
     d3_dict = {}
-
-    for row in csv_out:
+    for row in rows:
         # Only process rows that have a MAC address and company assigned
-        if len(row) >= 2:
-            m = manuf_re.match(row[0])
-            if m is not None:
-                if m.group(2) == "":
-                    mac = m.group(1) + ":00:00:00/24"
-                else:
-                    mac = m.group(1) + m.group(2) + m.group(4)
-
-                # Create the folder with the company name
-                short_name = row[1]
-
-                try:
-                    long_name = row[2]
-                except IndexError:
-                    long_name = ""
-
-                if short_name in d3_dict:
-                    d3_type = d3_dict[short_name]
-                else:
-                    d3_type = generate_d3_type(mac, short_name, long_name)
-
-                # Add the mac address to the corresponding company
-                d3_type["credentialSubject"]["macAddresses"].append(mac)
-                d3_dict[short_name] = d3_type
-
-    # Save the yaml/json object to files
-    dump_yaml_files(populate_folder, d3_dict)
+        if len(row) < 2:
+            continue
+        m = MANUF_RE.match(row[0])
+        if m is None:
+            continue
+        if m.group(2) == "":
+            mac = m.group(1) + ":00:00:00/24"
+        else:
+            mac = m.group(1) + m.group(2) + m.group(4)
+
+        short_name = row[1]
+        long_name = row[2] if len(row) > 2 else ""
+
+        if short_name not in d3_dict:
+            d3_dict[short_name] = generate_d3_type(mac, short_name, long_name)
+
+        # Add the mac address to the corresponding company
+        d3_dict[short_name]["credentialSubject"]["macAddresses"].append(mac)
+    return d3_dict
+
+
+def dump_yaml_file(populate_folder: str, short_name: str, d3_type: dict) -> bool:
+    """Writes the D3 type claim of a company, unless it is unchanged
+
+    Args:
+        populate_folder: The folder to populate
+        short_name: The short name of the company, used as its folder name
+        d3_type: The D3 type claim of the company
+
+    Returns:
+        Boolean indicating whether the file was written
+    """
+    yaml_file_path = os.path.join(populate_folder, short_name, DEVICE_TYPE_FILENAME)
+    stream = io.StringIO()
+    dump_yaml(d3_type, stream)
+    content = stream.getvalue()
+    try:
+        with open(yaml_file_path, mode="rt", encoding="utf-8") as file:
+            if file.read() == content:
+                return False
+    except FileNotFoundError:
+        # Create the folder with the given short company name
+        os.makedirs(os.path.dirname(yaml_file_path), exist_ok=True)
+    with open(yaml_file_path, mode="wt", encoding="utf-8") as file:
+        file.write(content)
+    return True
+
+
+def dump_yaml_files(populate_folder: str, d3_dict: typing.Mapping[str, dict], jobs: typing.Optional[int] = None) -> int:
+    """Writes the D3 type claim of each company in parallel, skipping unchanged claims
+
+    Args:
+        populate_folder: The folder to populate
+        d3_dict: Map of each company's short name to its D3 type claim
+        jobs: The maximum number of worker processes
+
+    Returns:
+        The number of files written
+    """
+    args = [(populate_folder, short_name, d3_type) for short_name, d3_type in d3_dict.items()]
+    with Executor(jobs, n_tasks=len(args)) as executor:
+        written = executor.starmap(dump_yaml_file, args)
+    for (_folder, short_name, _d3_type), was_written in zip(args, written):
+        if was_written:
+            LOG.debug(f"Added {os.path.join(populate_folder, short_name, DEVICE_TYPE_FILENAME)}")
+    return sum(written)
+
+
+def d3_populate(source: str, populate_folder: str, jobs: typing.Optional[int] = None) -> int:
+    """Populates a folder with a D3 type claim for each company in a Wireshark manuf file
+
+    Args:
+        source: The filepath of a local manuf file, or a web link to one
+        populate_folder: The folder to populate
+        jobs: The maximum number of worker processes
+
+    Returns:
+        The number of files written. Companies whose claims are unchanged aren't written again.
+    """
+    LOG.info(f"Populating with data from {source}")
+    LOG.info(f"Populating to {populate_folder}")
+    d3_dict = parse_manuf(get_manuf_rows(source))
+    n_written = dump_yaml_files(populate_folder, d3_dict, jobs=jobs)
+    LOG.info(f"Wrote {n_written} companies, {len(d3_dict) - n_written} unchanged")
+    return n_written
+
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Populate a folder with D3 type claims for the companies in a Wireshark manuf file",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "source",
+        nargs="?",
+        default=GIT_REPO_ADDRESS,
+        help="The filepath of a local manuf file, or a web link to one",
+    )
+    parser.add_argument(
+        "populate_folder", nargs="?", default=POPULATE_FOLDER_PATH, help="The folder to populate",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        help="Maximum number of worker processes. Defaults to one less than the number of CPUs.",
+    )
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    d3_populate(args.source, str(Path(args.populate_folder)), jobs=args.jobs)
 
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        git_repo = GIT_REPO_ADDRESS
-        populate_folder = POPULATE_FOLDER_PATH
-    elif len(sys.argv) == 2:
-        git_repo = sys.argv[1]
-        populate_folder = POPULATE_FOLDER_PATH
-    else:
-        git_repo = sys.argv[1]
-        populate_folder = str(Path(sys.argv[2]))
-
-    csv_out = get_storage_file(git_repo)
-    if csv_out is None:
-        csv_out = get_web_file(git_repo)
-
-    d3_populate(csv_out, populate_folder)
+    cli()
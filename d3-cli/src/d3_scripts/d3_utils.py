@@ -1,25 +1,25 @@
-import functools
 import logging
 from pyclbr import Function
 import typing
 import warnings
 from pathlib import Path
-import multiprocessing
 from networkx import DiGraph
 import tqdm
 import jsonschema
 
-from .yaml_tools import is_valid_yaml_claim, load_claim, lint_yaml
+from .yaml_tools import is_valid_yaml_claim, load_claim, lint_yaml, YAML_BACKEND
 from .json_tools import is_json_unchanged, write_json
 from .validate_schemas import (
     get_schema_validator_from_path,
     validate_claim_meta_schema,
     validate_d3_claim_schema,
 )
-from .check_uri_resolve import check_uri
-from .check_behaviours_resolve import check_behaviours_resolve, BehaviourMap
-from .resolve_behaviour_rules import resolve_behaviour_rules
+from .check_uri_resolve import check_uri, get_uris, resolve_claim_uris
+from .remote_check_cache import RemoteCheckCache
+from .check_behaviours_resolve import check_behaviours_resolve, BehaviourMap, BehaviourIndex
+from .resolve_behaviour_rules import resolve_behaviour_rules, InheritedRules
 from .d3_constants import d3_type_codes
+from .executor import Executor
 from typing import Sequence, Mapping, Any
 from copy import deepcopy
 
@@ -27,65 +27,206 @@ TypeJson = Mapping[str, Any]
 TypeJsons = Sequence[TypeJson]
 LOG = logging.getLogger(__name__)
 
+# keyword arguments to process_claim_file shared by every claim in a build,
+# installed once per worker process by `init_build_context`
+_build_context: typing.Dict[str, Any] = {}
 
-def _validate_d3_claim_uri(yaml_file_path: str, **check_uri_kwargs):
+
+def _validate_d3_claim_uri(yaml_file_path: str) -> typing.List[str]:
     """Checks whether the given YAML file has valid URIs.
 
+    Returns:
+        The URIs in the YAML file.
+
     Raises:
-        Exception: If the YAML file has a URI that is not valid/resolveable.
+        Exception: If the YAML file has a URI that is not valid.
     """
     # import yaml claim to Python dict (JSON)
     claim = load_claim(yaml_file_path)
     schema = get_schema_validator_from_path(yaml_file_path).schema
-    # check URIs and other refs resolve
-    check_uri(
-        claim["credentialSubject"], schema, **check_uri_kwargs,
-    )
+    return get_uris(claim["credentialSubject"], schema)
+
+
+def get_claim_uris(
+    yaml_file_name: str, claim: dict, type_map: BehaviourMap
+) -> typing.List[str]:
+    """Finds the URIs that `process_claim_file` would check in a claim.
+
+    Type claims are checked with the properties they inherit from their parents.
+
+    Args:
+        yaml_file_name: The filepath to the YAML file
+        claim: The loaded claim from `yaml_file_name`
+        type_map: Map of type GUID to type claim (as returned by `build_type_map`)
+
+    Returns:
+        The URIs in the claim. Empty if any URI is invalid, since
+        `process_claim_file` reports invalid URIs.
+    """
+    subject = claim.get("credentialSubject", {})
+    if claim.get("type") == d3_type_codes["type"] and subject.get("id") in type_map:
+        subject = type_map[subject["id"]]["credentialSubject"]
+    schema = get_schema_validator_from_path(yaml_file_name).schema
+    try:
+        return get_uris(subject, schema)
+    except ValueError:
+        return []
+
+
+def log_unresolved_uris(
+    claim_uris: typing.Mapping[str, typing.Iterable[str]],
+    cache: typing.Optional[RemoteCheckCache] = None,
+) -> None:
+    """Checks whether the URIs of many claims resolve, and logs a warning for each that doesn't.
+
+    Each unique URI is only checked once, and URIs are checked concurrently.
+
+    Args:
+        claim_uris: Map of claim filepath to the URIs in the claim
+        cache: Cache of the results of previous checks
+    """
+    for yaml_file_name, messages in resolve_claim_uris(claim_uris, cache=cache).items():
+        for message in messages:
+            LOG.warning(f"{message} in {yaml_file_name}")
 
 
 def validate_d3_claim_files(
-    yaml_file_names: typing.Sequence[str], check_uri_resolves: bool = False
+    yaml_file_names: typing.Sequence[str],
+    check_uri_resolves: bool = False,
+    jobs: typing.Optional[int] = None,
 ):
     """Checks whether D3 claim files are valid.
 
     Performs each check sequentially, (e.g. like a normal CI task)
     so if one fails, the rest are not checked.
+
+    Args:
+        yaml_file_names: The filepaths to the YAML claim files
+        check_uri_resolves: Whether to check URIs/refs resolveable/valid
+        jobs: The maximum number of worker processes. Small inputs are checked in this process.
     """
+    LOG.info(f"Using {YAML_BACKEND} YAML backend")
     stages = {
         "Checking if D3 files have correct filename": is_valid_yaml_claim,
         "Linting D3 files": lint_yaml,
         "Checking whether D3 files match JSONSchema": validate_d3_claim_schema,
-        "Checking whether URIs/refs resolve": functools.partial(
-            _validate_d3_claim_uri, check_uri_resolves=check_uri_resolves,
-        ),
+        "Checking whether URIs/refs are valid": _validate_d3_claim_uri,
     }
 
-    with multiprocessing.Pool() as pool:
+    # the URIs in each file, found by the URI stage
+    claim_uris: typing.Dict[str, typing.List[str]] = {}
+    with Executor(jobs, n_tasks=len(yaml_file_names)) as executor:
         for description, function in stages.items():
             # use imap so that progress bar only updates when each chunk is done
-            result_generator = pool.imap(function, yaml_file_names, chunksize=16)
-            for _result in tqdm.tqdm(
+            result_generator = executor.imap(function, yaml_file_names, chunksize=16)
+            results = list(tqdm.tqdm(
                 result_generator,
                 unit="files",
                 desc=description,
                 disable=logging.getLogger().getEffectiveLevel() > logging.INFO,
                 delay=0.5,  # delay to show progress bar
                 total=len(yaml_file_names),
-            ):
-                pass
+            ))
+            if function is _validate_d3_claim_uri:
+                claim_uris = dict(zip(yaml_file_names, results))
+
+    if check_uri_resolves:
+        LOG.info("Checking whether URIs/refs resolve")
+        log_unresolved_uris(claim_uris)
 
     return True
 
 
+def resolve_claim(
+    yaml_file_name: str,
+    claim: dict,
+    behaviour_map: BehaviourMap,
+    behaviour_index: BehaviourIndex,
+    behaviour_graph: DiGraph,
+    inherited_rules: typing.Optional[InheritedRules],
+    type_map: BehaviourMap,
+    check_uri_resolves: bool,
+) -> typing.Tuple[dict, typing.List[Warning]]:
+    """Resolves a D3 claim into its built form, as written by `process_claim_file`.
+
+    Validates the claim against the JSONSchema for its type, aggregates inherited
+    behaviour rules, uses the type in `type_map` with its inherited properties,
+    inherits firmware behaviours from their type, checks URIs/refs and resolves behaviours.
+
+    Args:
+        yaml_file_name: The filepath to the YAML file
+        claim: The claim loaded from `yaml_file_name`, which is modified
+        behaviour_index: Index of `behaviour_map` by GUID and ruleName
+        inherited_rules: The rules each behaviour inherits, from `aggregate_inherited_rules`.
+                         If `None`, they are found from `behaviour_graph` for each claim.
+        check_uri_resolves: Whether to check URIs/refs resolveable/valid
+
+    Returns:
+        The built claim, and a list of warnings
+    """
+    schema_validator = get_schema_validator_from_path(yaml_file_name)
+    schema = schema_validator.schema
+    try:
+        schema_validator.validate(claim["credentialSubject"])
+    except jsonschema.exceptions.ValidationError as err:
+        raise Exception(f"Error validating credentialSubject for {yaml_file_name}: {err}")
+
+    if claim["type"] == d3_type_codes["behaviour"]:
+        # Gets aggregated rules, checking that specified parents exist
+        aggregated_rules = resolve_behaviour_rules(
+            claim, behaviour_map, behaviour_graph, inherited_rules
+        )
+        # Replace claim rules with aggregated rules from parents
+        claim["credentialSubject"]["rules"] = aggregated_rules
+
+    if claim["type"] == d3_type_codes["type"]:
+        claim_id = claim["credentialSubject"]["id"]
+        # update type claim to use object in type_map - includes inherited properties
+        claim = deepcopy(
+            type_map[claim_id]
+        )  # must use deepcopy to prevent modification of type_map
+
+    if claim["type"] == d3_type_codes["firmware"]:
+        firmware_type = claim["credentialSubject"].get("type", None)
+        if type_map.get(firmware_type, None) is None:
+            raise ValueError(
+                f"Type {firmware_type} of firmware claim {claim['credentialSubject']['id']} not found"
+            )
+        if claim["credentialSubject"].get("behaviour", None) is None:
+            # if no behaviour of it's own, inherit from parent type to which firmware belongs
+            type_behaviour = type_map[firmware_type]["credentialSubject"].get(
+                "behaviour", None
+            )
+            if type_behaviour is not None:
+                claim["credentialSubject"]["behaviour"] = type_behaviour
+
+    # check URIs and other refs resolve
+    with warnings.catch_warnings(record=True) as uri_warnings:
+        check_uri(
+            claim["credentialSubject"],
+            schema,
+            check_uri_resolves=check_uri_resolves,
+        )
+
+    # check behaviour statement is valid, if so add to claim
+    claim["credentialSubject"] = check_behaviours_resolve(
+        claim["credentialSubject"], schema, behaviour_index
+    )
+    return claim, [*uri_warnings]
+
+
 def process_claim_file(
     yaml_file_name: str,
+    claim: typing.Optional[dict],
     behaviour_map: BehaviourMap,
+    behaviour_index: BehaviourIndex,
     behaviour_graph: DiGraph,
+    inherited_rules: typing.Optional[InheritedRules],
     type_map: BehaviourMap,
     check_uri_resolves: bool,
     pass_on_failure: bool,
     get_json_filepath: Function,
-) -> typing.List[Warning]:
+) -> typing.Tuple[bool, typing.List[Warning]]:
     """Processes a single D3 claim file.
     Checks include:
     - is unchanged claim
@@ -95,84 +236,112 @@ def process_claim_file(
 
     Args:
         yaml_file_name: The filepath to the YAML file
+        claim: The already loaded claim from `yaml_file_name`.
+               If `None`, the claim is loaded from the file.
+        behaviour_index: Index of `behaviour_map` by GUID and ruleName
+        inherited_rules: The rules each behaviour inherits, from `aggregate_inherited_rules`.
+                         If `None`, they are found from `behaviour_graph` for each claim.
         check_uri_resolves: Whether to check URIs/refs resolveable/valid
 
     Returns:
-        List of warnings. If empty, no warnings.
+        Whether the JSON of the claim was written or is already up to date,
+        which is not the case if the claim was skipped because of `pass_on_failure`,
+        and a list of warnings. If empty, no warnings.
         Warnings are hidden by default in multiprocessing.
     """
     json_file_name = get_json_filepath(yaml_file_name)
     Path(json_file_name).parent.mkdir(parents=True, exist_ok=True)
 
-    # import yaml claim to Python dict (JSON)
-    claim = load_claim(yaml_file_name)
+    if claim is None:
+        # import yaml claim to Python dict (JSON)
+        claim = load_claim(yaml_file_name)
+    else:
+        # the claim is modified below, so don't change the caller's copy
+        claim = deepcopy(claim)
 
     # if JSON already exists and is unchanged then skip, unless claim has parents (parents may have changed)
     if len(claim.get("credentialSubject", {}).get("parents", [])) and is_json_unchanged(
         json_file_name, claim
     ):
-        return []
+        return True, []
 
     # validate schema
     validate_claim_meta_schema(claim)
 
     try:
-        schema_validator = get_schema_validator_from_path(yaml_file_name)
-        schema = schema_validator.schema
-        try:
-            schema_validator.validate(claim["credentialSubject"])
-        except jsonschema.exceptions.ValidationError as err:
-            raise Exception(f"Error validating credentialSubject for {yaml_file_name}: {err}")
-
-        if claim["type"] == d3_type_codes["behaviour"]:
-            # Gets aggregated rules, checking that specified parents exist
-            aggregated_rules = resolve_behaviour_rules(
-                claim, behaviour_map, behaviour_graph
-            )
-            # Replace claim rules with aggregated rules from parents
-            claim["credentialSubject"]["rules"] = aggregated_rules
-
-        if claim["type"] == d3_type_codes["type"]:
-            claim_id = claim["credentialSubject"]["id"]
-            # update type claim to use object in type_map - includes inherited properties
-            claim = deepcopy(
-                type_map[claim_id]
-            )  # must use deepcopy to prevent modification of type_map
-
-        if claim["type"] == d3_type_codes["firmware"]:
-            firmware_type = claim["credentialSubject"].get("type", None)
-            if type_map.get(firmware_type, None) is None:
-                raise ValueError(
-                    f"Type {firmware_type} of firmware claim {claim['credentialSubject']['id']} not found"
-                )
-            if claim["credentialSubject"].get("behaviour", None) is None:
-                # if no behaviour of it's own, inherit from parent type to which firmware belongs
-                type_behaviour = type_map[firmware_type]["credentialSubject"].get(
-                    "behaviour", None
-                )
-                if type_behaviour is not None:
-                    claim["credentialSubject"]["behaviour"] = type_behaviour
-
-        # check URIs and other refs resolve
-        with warnings.catch_warnings(record=True) as uri_warnings:
-            check_uri(
-                claim["credentialSubject"],
-                schema,
-                check_uri_resolves=check_uri_resolves,
-            )
-
-        # check behaviour statement is valid, if so add to claim
-        claim["credentialSubject"] = check_behaviours_resolve(
-            claim["credentialSubject"], schema, behaviour_map.values()
+        claim, uri_warnings = resolve_claim(
+            yaml_file_name,
+            claim,
+            behaviour_map=behaviour_map,
+            behaviour_index=behaviour_index,
+            behaviour_graph=behaviour_graph,
+            inherited_rules=inherited_rules,
+            type_map=type_map,
+            check_uri_resolves=check_uri_resolves,
         )
 
         # write JSON if valid
         write_json(json_file_name, claim)
 
-        return [*uri_warnings]
+        return True, uri_warnings
     except FileNotFoundError as err:
         if pass_on_failure:
             LOG.warn(f"Skipping claim {yaml_file_name} due to error: ${err}")
-            return []
+            return False, []
         else:
             raise err
+
+
+def init_build_context(build_context: typing.Dict[str, Any]) -> None:
+    """Installs the build context used by `process_claim_in_context`.
+
+    Intended as a worker pool initializer, so that the large shared objects
+    of a build (e.g. the behaviour map and index) are sent to each worker once,
+    instead of being pickled with every chunk of tasks.
+
+    Args:
+        build_context: Keyword arguments to pass to `process_claim_file`,
+                       other than `yaml_file_name` and `claim`.
+    """
+    _build_context.clear()
+    _build_context.update(build_context)
+
+
+def process_claim_in_context(
+    yaml_file_name: str, claim: typing.Optional[dict]
+) -> typing.Tuple[bool, typing.List[Warning]]:
+    """Processes a single D3 claim file using the installed build context.
+
+    See `process_claim_file` and `init_build_context`.
+    """
+    return process_claim_file(yaml_file_name, claim, **_build_context)
+
+
+def resolve_claim_in_context(
+    yaml_file_name: str, claim: typing.Optional[dict]
+) -> typing.Tuple[typing.Optional[dict], typing.List[Warning]]:
+    """Resolves a single D3 claim using the installed build context, without writing it.
+
+    See `resolve_claim` and `init_build_context`.
+
+    Returns:
+        The built claim, or `None` if it was skipped because of `pass_on_failure`, and a list of warnings
+    """
+    claim = load_claim(yaml_file_name) if claim is None else deepcopy(claim)
+    validate_claim_meta_schema(claim)
+    try:
+        return resolve_claim(
+            yaml_file_name,
+            claim,
+            behaviour_map=_build_context["behaviour_map"],
+            behaviour_index=_build_context["behaviour_index"],
+            behaviour_graph=_build_context["behaviour_graph"],
+            inherited_rules=_build_context["inherited_rules"],
+            type_map=_build_context["type_map"],
+            check_uri_resolves=_build_context["check_uri_resolves"],
+        )
+    except FileNotFoundError as err:
+        if _build_context["pass_on_failure"]:
+            LOG.warn(f"Skipping claim {yaml_file_name} due to error: ${err}")
+            return None, []
+        raise err
@@ -0,0 +1,116 @@
+import logging
+import multiprocessing
+import typing
+from multiprocessing.pool import Pool, ThreadPool
+
+T = typing.TypeVar("T")
+LOG = logging.getLogger(__name__)
+
+# Starting a worker process costs about as much as processing this many claims,
+# so inputs smaller than this per worker are processed in fewer workers, or serially
+MIN_TASKS_PER_WORKER = 32
+
+
+def default_jobs() -> int:
+    """Returns the default number of worker processes: one less than the CPU count"""
+    return max(multiprocessing.cpu_count() - 1, 1)
+
+
+class Executor:
+    """Maps functions over iterables, in a pool of workers or serially in this process.
+
+    The worker pool is only started when first needed, and is always cleaned up
+    when used as a context manager, even if an exception is raised.
+
+    The number of workers is limited so that each has at least `MIN_TASKS_PER_WORKER`
+    tasks. If that leaves a single worker, tasks are run serially in this process,
+    since starting a pool would take longer than the tasks themselves.
+    """
+
+    def __init__(
+        self,
+        jobs: typing.Optional[int] = None,
+        n_tasks: typing.Optional[int] = None,
+        initializer: typing.Optional[typing.Callable[..., None]] = None,
+        initargs: typing.Tuple = (),
+        threads: bool = False,
+    ):
+        """
+        Args:
+            jobs: The maximum number of workers. Defaults to `default_jobs()`.
+            n_tasks: The expected number of tasks, if known, used to pick the number of workers.
+            initializer: Function called once in each worker (or in this process if serial)
+                         before any tasks, e.g. to install shared state.
+            initargs: Arguments to pass to `initializer`.
+            threads: Use a pool of threads instead of processes.
+        """
+        self.jobs = jobs if jobs and jobs > 0 else default_jobs()
+        if n_tasks is not None:
+            self.jobs = max(min(self.jobs, n_tasks // MIN_TASKS_PER_WORKER), 1)
+        self.initializer = initializer
+        self.initargs = initargs
+        self.threads = threads
+        self._pool: typing.Optional[Pool] = None
+        self._initialized = False
+
+    @property
+    def is_serial(self) -> bool:
+        return self.jobs == 1
+
+    def _get_pool(self) -> Pool:
+        if self._pool is None:
+            pool_class = ThreadPool if self.threads else Pool
+            LOG.debug(f"Starting {pool_class.__name__} with {self.jobs} workers")
+            self._pool = pool_class(
+                processes=self.jobs, initializer=self.initializer, initargs=self.initargs
+            )
+        return self._pool
+
+    def _initialize_serial(self) -> None:
+        if not self._initialized and self.initializer is not None:
+            self.initializer(*self.initargs)
+        self._initialized = True
+
+    def map(self, func: typing.Callable[..., T], iterable: typing.Iterable, chunksize=None) -> typing.List[T]:
+        """Equivalent to `multiprocessing.pool.Pool.map`"""
+        if self.is_serial:
+            self._initialize_serial()
+            return list(map(func, iterable))
+        return self._get_pool().map(func, iterable, chunksize)
+
+    def starmap(self, func: typing.Callable[..., T], iterable: typing.Iterable, chunksize=None) -> typing.List[T]:
+        """Equivalent to `multiprocessing.pool.Pool.starmap`"""
+        if self.is_serial:
+            self._initialize_serial()
+            return [func(*args) for args in iterable]
+        return self._get_pool().starmap(func, iterable, chunksize)
+
+    def imap(self, func: typing.Callable[..., T], iterable: typing.Iterable, chunksize=1) -> typing.Iterator[T]:
+        """Equivalent to `multiprocessing.pool.Pool.imap`"""
+        if self.is_serial:
+            self._initialize_serial()
+            return map(func, iterable)
+        return self._get_pool().imap(func, iterable, chunksize)
+
+    def close(self) -> None:
+        """Waits for any outstanding tasks, then stops the workers"""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def terminate(self) -> None:
+        """Stops the workers immediately, discarding any outstanding tasks"""
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self) -> "Executor":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
@@ -1,6 +1,10 @@
+import logging
+import os
+import shutil
+import sqlite3
 from csv import DictWriter
 from pathlib import Path
-from typing import Union, List
+from typing import Any, Dict, Iterable, Mapping, Optional, TextIO, Tuple, Union, List
 from uuid import UUID, uuid5
 from json import dumps
 
@@ -11,6 +15,120 @@ from .yaml_tools import get_yaml_suffixes
 path_type = Union[Path, str]
 id_type = Union[str, UUID]
 
+# size of the write buffer of each CSV file, so that rows are written in large blocks
+CSV_BUFFER_SIZE = 1 << 20
+# name of the SQLite database written by `SqliteExporter`
+SQLITE_FILENAME = "d3db.sqlite"
+LOG = logging.getLogger(__name__)
+
+# the tables of `csv_headers`, with the list columns of types normalised into child tables.
+# Foreign keys are deferred, so that rows can be inserted in any order in the export transaction.
+SQLITE_SCHEMA = """
+CREATE TABLE type (
+    id TEXT PRIMARY KEY,
+    manufacturer TEXT,
+    manufactureruri TEXT,
+    modelnumber TEXT,
+    modelsupporturi TEXT,
+    modelinformationuri TEXT,
+    name TEXT,
+    tags TEXT,
+    behaviour TEXT,
+    cpe TEXT
+);
+CREATE TABLE type_alias (
+    typeid TEXT NOT NULL REFERENCES type (id) DEFERRABLE INITIALLY DEFERRED,
+    alias TEXT NOT NULL,
+    PRIMARY KEY (typeid, alias)
+) WITHOUT ROWID;
+CREATE TABLE type_macaddress (
+    typeid TEXT NOT NULL REFERENCES type (id) DEFERRABLE INITIALLY DEFERRED,
+    macaddress TEXT NOT NULL,
+    PRIMARY KEY (typeid, macaddress)
+) WITHOUT ROWID;
+CREATE TABLE type_parent (
+    typeid TEXT NOT NULL REFERENCES type (id) DEFERRABLE INITIALLY DEFERRED,
+    parentid TEXT NOT NULL REFERENCES type (id) DEFERRABLE INITIALLY DEFERRED,
+    PRIMARY KEY (typeid, parentid)
+) WITHOUT ROWID;
+CREATE TABLE type_child (
+    typeid TEXT NOT NULL REFERENCES type (id) DEFERRABLE INITIALLY DEFERRED,
+    childid TEXT NOT NULL REFERENCES type (id) DEFERRABLE INITIALLY DEFERRED,
+    PRIMARY KEY (typeid, childid)
+) WITHOUT ROWID;
+CREATE TABLE type_vulnerability (
+    typeid TEXT NOT NULL REFERENCES type (id) DEFERRABLE INITIALLY DEFERRED,
+    vulnerability TEXT NOT NULL,
+    PRIMARY KEY (typeid, vulnerability)
+) WITHOUT ROWID;
+CREATE TABLE firmware (
+    id TEXT PRIMARY KEY,
+    type TEXT REFERENCES type (id) DEFERRABLE INITIALLY DEFERRED,
+    versions TEXT,
+    behaviour TEXT
+);
+CREATE TABLE behaviour (
+    id TEXT NOT NULL,
+    ruleid TEXT PRIMARY KEY,
+    rulename TEXT,
+    malicious INTEGER NOT NULL
+);
+CREATE TABLE behaviour_eth (
+    ruleid TEXT PRIMARY KEY REFERENCES behaviour (ruleid) DEFERRABLE INITIALLY DEFERRED,
+    sourcemac TEXT,
+    destinationmac TEXT,
+    ethertype INTEGER
+);
+CREATE TABLE behaviour_ip4 (
+    ruleid TEXT PRIMARY KEY REFERENCES behaviour (ruleid) DEFERRABLE INITIALLY DEFERRED,
+    sourceip4 TEXT,
+    destinationip4 TEXT,
+    sourcednsname TEXT,
+    destinationdnsname TEXT,
+    protocol INTEGER
+);
+CREATE TABLE behaviour_tcp (
+    ruleid TEXT PRIMARY KEY REFERENCES behaviour (ruleid) DEFERRABLE INITIALLY DEFERRED,
+    sourceport INTEGER,
+    destinationport INTEGER
+);
+CREATE TABLE behaviour_udp (
+    ruleid TEXT PRIMARY KEY REFERENCES behaviour (ruleid) DEFERRABLE INITIALLY DEFERRED,
+    sourceport INTEGER,
+    destinationport INTEGER
+);
+"""
+# created once the rows are inserted, which is faster than updating them on every insert
+SQLITE_INDEXES = [
+    "CREATE INDEX type_behaviour ON type (behaviour)",
+    "CREATE INDEX type_name ON type (name)",
+    "CREATE INDEX type_manufacturer ON type (manufacturer)",
+    "CREATE INDEX type_macaddress_macaddress ON type_macaddress (macaddress)",
+    "CREATE INDEX type_parent_parentid ON type_parent (parentid)",
+    "CREATE INDEX type_child_childid ON type_child (childid)",
+    "CREATE INDEX type_vulnerability_vulnerability ON type_vulnerability (vulnerability)",
+    "CREATE INDEX firmware_type ON firmware (type)",
+    "CREATE INDEX firmware_behaviour ON firmware (behaviour)",
+    "CREATE INDEX behaviour_id ON behaviour (id)",
+]
+# the list columns of type claims, and the child tables and columns they are normalised into
+SQLITE_TYPE_LISTS = {
+    "aliases": ("type_alias", "alias"),
+    "macaddresses": ("type_macaddress", "macaddress"),
+    "parents": ("type_parent", "parentid"),
+    "children": ("type_child", "childid"),
+    "vulnerabilities": ("type_vulnerability", "vulnerability"),
+}
+# number of rows of a table to insert at a time
+SQLITE_BATCH_SIZE = 10000
+
+# columns of the Parquet export that are integers, or allow/disallow trees of addresses,
+# the other columns are strings, or lists of strings for the list columns of types
+ARROW_INT_COLUMNS = {"protocol", "ethertype", "sourceport", "destinationport"}
+ARROW_ADDRESS_COLUMNS = {"sourceip4", "destinationip4", "sourcednsname", "destinationdnsname"}
+# number of rows of a table in each row group of the Parquet export
+ARROW_BATCH_SIZE = 65536
+
 
 def stringify(value):
     if type(value) == dict:
@@ -37,18 +155,63 @@ def get_ruleid(id: id_type, name: str) -> str:
 
 
 class CsvExporter:
+    """Exports D3 claim JSONs to the D3DB output CSVs.
+
+    Use as a context manager, so that the CSV files opened by `create_csv_templates`
+    are flushed and closed once the export is done.
+    """
+
     def __init__(self, csv_dir: Path):
         self.csv_dir = csv_dir
+        # the open CSV files, and their writers, by table name (e.g. `type` for `type.csv`)
+        self._csv_files: Dict[str, TextIO] = {}
+        self._csv_writers: Dict[str, DictWriter] = {}
 
-    def create_csv_templates(self,) -> None:
-        """Creates the csv files + header for the D3DB output CSVs"""
+    def create_csv_templates(self, write_header: bool = True) -> None:
+        """Creates the csv files + header for the D3DB output CSVs,
+        keeping them open for writing rows to until `close` is called
+
+        Args:
+            write_header: Whether to write the header, e.g. not for shards to be merged
+                          by `append_csv_shards`.
+        """
+        self.close()
         self.csv_dir.mkdir(parents=True, exist_ok=True)
 
         for name, header in csv_headers.items():
             file_name = self.csv_dir / f"{name}.csv"
-            with open(file_name, "w") as csv_file:
-                csv_writer = DictWriter(csv_file, fieldnames=header, dialect="unix")
+            csv_file = open(file_name, "w", buffering=CSV_BUFFER_SIZE)
+            self._csv_files[name] = csv_file
+            csv_writer = DictWriter(csv_file, fieldnames=header, dialect="unix")
+            if write_header:
                 csv_writer.writeheader()
+            self._csv_writers[name] = csv_writer
+
+    def append_csv_shards(self, shard_dirs: Iterable[Path]) -> None:
+        """Appends the rows of the CSVs exported to other directories without headers, in order,
+        to the CSV files opened by `create_csv_templates`
+
+        Args:
+            shard_dirs: The directories of the exported shards.
+        """
+        for shard_dir in shard_dirs:
+            for name, csv_file in self._csv_files.items():
+                with open(Path(shard_dir) / f"{name}.csv", newline="") as shard_file:
+                    shutil.copyfileobj(shard_file, csv_file, CSV_BUFFER_SIZE)
+
+    def close(self) -> None:
+        """Flushes and closes the CSV files opened by `create_csv_templates`"""
+        csv_files = list(self._csv_files.values())
+        self._csv_files.clear()
+        self._csv_writers.clear()
+        for csv_file in csv_files:
+            csv_file.close()
+
+    def __enter__(self) -> "CsvExporter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
 
     def write_csv_data(
         self, file_name: path_type, headers: List[str], data: dict
@@ -60,6 +223,11 @@ class CsvExporter:
             headers: A list of headers.
             data: A dict of data (keyed on the headers).
         """
+        file_name = Path(file_name)
+        name = file_name.stem
+        if name in self._csv_writers and file_name == self.csv_dir / f"{name}.csv" and headers == csv_headers[name]:
+            self.write_table_row(name, data)
+            return
         try:
             with open(file_name, "a") as csv_file:
                 csv_writer = DictWriter(csv_file, fieldnames=headers, dialect="unix")
@@ -68,51 +236,79 @@ class CsvExporter:
             print(f"\nError writing CSV data {data} with headers {headers}")
             raise err
 
-    def export_type_csv(self, file_path: path_type) -> None:
+    def write_table_row(self, name: str, data: dict) -> None:
+        """Writes a row of data to a D3DB output CSV.
+
+        If the csv file was opened by `create_csv_templates`, the row is written to its buffer,
+        otherwise the file is opened to append the row.
+
+        Args:
+            name: The name of the table, e.g. `type` for `type.csv`.
+            data: A dict of data (keyed on the headers of the table).
+        """
+        csv_writer = self._csv_writers.get(name)
+        if csv_writer is None:
+            self.write_csv_data(self.csv_dir / f"{name}.csv", csv_headers[name], data)
+            return
+        try:
+            csv_writer.writerow(data)
+        except ValueError as err:
+            print(f"\nError writing CSV data {data} with headers {csv_headers[name]}")
+            raise err
+
+    def export_type_csv(self, file_path: path_type, claim: Optional[dict] = None) -> None:
         """Exports a D3 type claim JSON to a csv file entry
 
         Args:
             file_path: The path to the D3 type claim JSON.
+            claim: The already loaded claim of `file_path`. If `None`, it is loaded from the file.
         """
-        file_name = self.csv_dir / "type.csv"
-        data = load_json(file_path)["credentialSubject"]
+        data = _claim_subject(file_path, claim)
         data = {k.lower(): v for k, v in data.items()}
         data["behaviour"] = data.get("behaviour", {}).get("id", "")
         data["parents"] = ",".join([parent["id"] for parent in data.get("parents", [])])
         data["children"] = ",".join([child["id"] for child in data.get("children", [])])
-        self.write_csv_data(file_name, csv_headers["type"], data)
+        self.write_table_row("type", data)
 
-    def export_firmware_csv(self, file_path: path_type) -> None:
+    def export_firmware_csv(self, file_path: path_type, claim: Optional[dict] = None) -> None:
         """Exports a D3 firmware claim JSON to a csv file entry
 
         Args:
             file_path: The path to the D3 firmware claim JSON.
+            claim: The already loaded claim of `file_path`. If `None`, it is loaded from the file.
         """
-        file_name = self.csv_dir / "firmware.csv"
-        data = load_json(file_path)["credentialSubject"]
+        data = _claim_subject(file_path, claim)
         data = {k.lower(): v for k, v in data.items()}
         data["behaviour"] = data.get("behaviour", {}).get("id", "")
-        self.write_csv_data(file_name, csv_headers["firmware"], data)
+        self.write_table_row("firmware", data)
 
-    def export_behaviour_csv(self, file_path: path_type) -> None:
+    def export_behaviour_csv(self, file_path: path_type, claim: Optional[dict] = None) -> None:
         """Exports a D3 behaviour claim JSON to a csv file entry
 
+        A rule with the same name as an earlier rule of the claim would have the same
+        `ruleid`, so it is skipped with a warning, as in the SQLite and Parquet exports.
+
         Args:
             file_path: The path to the D3 behaviour claim JSON.
+            claim: The already loaded claim of `file_path`. If `None`, it is loaded from the file.
         """
-        behaviour_file = self.csv_dir / "behaviour.csv"
-        data = load_json(file_path)["credentialSubject"]
+        data = _claim_subject(file_path, claim)
         behaviour = {"id": data["id"]}
         behaviour_name = (
             data["ruleName"] if data.get("ruleName", "") else file_path.stem
         )
 
+        rule_ids = set()
         for i, rule in enumerate(data["rules"]):
             name = rule.get("ruleName")
             rule_name = name if name else f"rule_{i}"
             behaviour["ruleid"] = get_ruleid(behaviour["id"], rule_name)
+            if behaviour["ruleid"] in rule_ids:
+                LOG.warning(f"Skipping rule with duplicate name {rule_name!r} in {file_path}")
+                continue
+            rule_ids.add(behaviour["ruleid"])
             behaviour["rulename"] = f"{behaviour_name}/{rule_name}"
-            self.write_csv_data(behaviour_file, csv_headers["behaviour"], behaviour)
+            self.write_table_row("behaviour", behaviour)
 
             for rule_type in behaviour_rule_types:
                 self.export_rule_csv(rule_type, rule, behaviour["ruleid"])
@@ -130,25 +326,351 @@ class CsvExporter:
             return
         data = {k.lower(): stringify(v) for k, v in data.items()}
         data["ruleid"] = entry_id
-        rule_stem = f"behaviour_{rule_type}"
-        file_name = self.csv_dir / f"{rule_stem}.csv"
+        self.write_table_row(f"behaviour_{rule_type}", data)
 
-        self.write_csv_data(file_name, csv_headers[rule_stem], data)
-
-    def d3_json_export_csv(self, file_path: path_type) -> None:
+    def d3_json_export_csv(self, file_path: path_type, claim: Optional[dict] = None) -> None:
         """Exports a D3 claim JSON to a csv file entry based on its type.
 
         Args:
             file_path: The path to the D3 claim JSON.
+            claim: The already loaded claim of `file_path`. If `None`, it is loaded from the file.
         """
         d3_type = get_yaml_suffixes(file_path)[0].replace(".", "")
         if d3_type == "type":
-            self.export_type_csv(file_path)
+            self.export_type_csv(file_path, claim)
         elif d3_type == "behaviour":
-            self.export_behaviour_csv(file_path)
+            self.export_behaviour_csv(file_path, claim)
         elif d3_type == "firmware":
-            self.export_firmware_csv(file_path)
+            self.export_firmware_csv(file_path, claim)
         elif d3_type == "vuln":
             pass
         else:
             raise ValueError(f"Unknown D3 claim type: {d3_type}")
+
+
+def _claim_subject(file_path: path_type, claim: Optional[dict]) -> dict:
+    """Returns the credentialSubject of a D3 claim, loading the claim JSON if it isn't given"""
+    return (load_json(file_path) if claim is None else claim)["credentialSubject"]
+
+
+def _sqlite_value(value: Any) -> Any:
+    """Converts a value of a claim to a SQLite value, with objects and arrays as JSON"""
+    if isinstance(value, (dict, list)):
+        return dumps(value, separators=(',', ':'))
+    return value
+
+
+def claim_records(file_path: path_type, claim: Optional[dict] = None) -> Dict[str, List[Dict[str, Any]]]:
+    """Converts a D3 claim JSON to records of the tables of `csv_headers`, based on its type.
+
+    Unlike the CSV export, list columns are lists (of IDs for parents/children), behaviour
+    matches are kept as they are in the claim, and `malicious` is a boolean. As in the CSV
+    export, a rule with the same name as an earlier rule of its claim is skipped with a warning.
+
+    Args:
+        file_path: The path to the D3 claim JSON.
+        claim: The already loaded claim of `file_path`. If `None`, it is loaded from the file.
+
+    Returns:
+        Map of table name to the records to add to it, keyed on the headers of the table.
+    """
+    d3_type = get_yaml_suffixes(file_path)[0].replace(".", "")
+    if d3_type == "vuln":
+        return {}
+    if d3_type not in ("type", "behaviour", "firmware"):
+        raise ValueError(f"Unknown D3 claim type: {d3_type}")
+    data = _claim_subject(file_path, claim)
+
+    if d3_type in ("type", "firmware"):
+        data = {k.lower(): v for k, v in data.items()}
+        data["behaviour"] = data.get("behaviour", {}).get("id")
+        record = {column: data.get(column) for column in csv_headers[d3_type]}
+        if d3_type == "type":
+            for column in SQLITE_TYPE_LISTS:
+                values = [value["id"] if isinstance(value, dict) else value for value in data.get(column, [])]
+                record[column] = list(dict.fromkeys(values))
+        return {d3_type: [record]}
+
+    behaviour_name = data["ruleName"] if data.get("ruleName", "") else Path(file_path).stem
+    rule_tables = [name for name in csv_headers if name.startswith("behaviour_")]
+    records: Dict[str, List[Dict[str, Any]]] = {name: [] for name in ["behaviour", *rule_tables]}
+    rule_ids = set()
+    for i, rule in enumerate(data["rules"]):
+        name = rule.get("ruleName")
+        rule_name = name if name else f"rule_{i}"
+        rule_id = get_ruleid(data["id"], rule_name)
+        if rule_id in rule_ids:
+            LOG.warning(f"Skipping rule with duplicate name {rule_name!r} in {file_path}")
+            continue
+        rule_ids.add(rule_id)
+        records["behaviour"].append({
+            "id": data["id"],
+            "ruleid": rule_id,
+            "rulename": f"{behaviour_name}/{rule_name}",
+            "malicious": bool(data.get("malicious", False)),
+        })
+        for table in rule_tables:
+            match = rule["matches"].get(table[len("behaviour_"):])
+            if match:
+                match = {k.lower(): v for k, v in match.items()}
+                match["ruleid"] = rule_id
+                records[table].append({column: match.get(column) for column in csv_headers[table]})
+    return records
+
+
+def claim_sqlite_rows(file_path: path_type, claim: Optional[dict] = None) -> Dict[str, List[Tuple]]:
+    """Converts a D3 claim JSON to rows of the tables of `SQLITE_SCHEMA`, based on its type.
+
+    Args:
+        file_path: The path to the D3 claim JSON.
+        claim: The already loaded claim of `file_path`. If `None`, it is loaded from the file.
+
+    Returns:
+        Map of table name to the rows to insert into it, in the order of its columns.
+    """
+    rows: Dict[str, List[Tuple]] = {}
+    for table, records in claim_records(file_path, claim).items():
+        if table == "type":
+            for record in records:
+                for column, (list_table, _list_column) in SQLITE_TYPE_LISTS.items():
+                    rows.setdefault(list_table, []).extend((record["id"], value) for value in record.pop(column))
+        rows[table] = [
+            tuple(int(value) if isinstance(value, bool) else _sqlite_value(value) for value in record.values())
+            for record in records
+        ]
+    return rows
+
+
+class SqliteExporter:
+    """Exports D3 claim JSONs to a SQLite database of the tables of `SQLITE_SCHEMA`.
+
+    The rows are inserted in a single transaction, into a temporary file that replaces
+    the database once the export is committed, so that readers never see a partial export.
+    Use as a context manager, which commits the export unless an exception is raised.
+    """
+
+    def __init__(self, path: Path):
+        """
+        Args:
+            path: The filepath of the SQLite database. Replaced if it exists.
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._temp_path = self.path.with_name(f".{self.path.name}.tmp")
+        self._temp_path.unlink(missing_ok=True)
+        self.connection = sqlite3.connect(self._temp_path)
+        self.connection.executescript(SQLITE_SCHEMA)
+        # the temporary file is discarded if the export fails, so it needn't be durable
+        self.connection.execute("PRAGMA journal_mode = MEMORY")
+        self.connection.execute("PRAGMA synchronous = OFF")
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.execute("BEGIN")
+        self._rows: Dict[str, List[Tuple]] = {}
+
+    def export_rows(self, rows: Mapping[str, List[Tuple]]) -> None:
+        """Inserts rows from `claim_sqlite_rows`, in batches
+
+        Args:
+            rows: Map of table name to the rows to insert into it.
+        """
+        for table, table_rows in rows.items():
+            buffer = self._rows.setdefault(table, [])
+            buffer.extend(table_rows)
+            if len(buffer) >= SQLITE_BATCH_SIZE:
+                self._insert(table)
+
+    def d3_json_export_sqlite(self, file_path: path_type, claim: Optional[dict] = None) -> None:
+        """Exports a D3 claim JSON to rows of the database based on its type.
+
+        Args:
+            file_path: The path to the D3 claim JSON.
+            claim: The already loaded claim of `file_path`. If `None`, it is loaded from the file.
+        """
+        self.export_rows(claim_sqlite_rows(file_path, claim))
+
+    def _insert(self, table: str) -> None:
+        rows = self._rows.pop(table, [])
+        if rows:
+            placeholders = ", ".join("?" * len(rows[0]))
+            self.connection.executemany(f"INSERT INTO {table} VALUES ({placeholders})", rows)
+
+    def commit(self) -> None:
+        """Inserts any remaining rows, creates the indexes, and commits the export,
+        replacing the database
+
+        Raises:
+            sqlite3.IntegrityError: If a foreign key refers to a row that doesn't exist.
+        """
+        for table in list(self._rows):
+            self._insert(table)
+        for index in SQLITE_INDEXES:
+            self.connection.execute(index)
+        self.connection.commit()
+        self.connection.close()
+        os.replace(self._temp_path, self.path)
+
+    def close(self) -> None:
+        """Discards the export, unless it was committed"""
+        try:
+            self.connection.close()
+        finally:
+            self._temp_path.unlink(missing_ok=True)
+
+    def __enter__(self) -> "SqliteExporter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        try:
+            if exc_type is None:
+                self.commit()
+        finally:
+            self.close()
+
+
+def _import_pyarrow():
+    """Imports pyarrow, which is only needed for the Parquet export, so is an optional dependency"""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as error:
+        raise ImportError(
+            "The parquet export format requires pyarrow, e.g. `pip install d3-cli[parquet]`"
+        ) from error
+    return pyarrow, pyarrow.parquet
+
+
+def arrow_schemas() -> Dict[str, Any]:
+    """Returns the Arrow schema of each table of `csv_headers`, for the Parquet export.
+
+    Allow/disallow trees of addresses are structs of the root `addr` and `allowed`,
+    and its descendants, flattened in pre-order into `children`, where the `parent`
+    of each descendant is the index of its parent in `children`, or -1 for the root.
+    """
+    pa, _pq = _import_pyarrow()
+    address_node_fields = [("addr", pa.string()), ("allowed", pa.bool_())]
+    address_type = pa.struct([
+        *address_node_fields,
+        ("children", pa.list_(pa.struct([*address_node_fields, ("parent", pa.int32())]))),
+    ])
+
+    def column_type(table: str, column: str):
+        if table == "type" and column in SQLITE_TYPE_LISTS:
+            return pa.list_(pa.string())
+        if column == "malicious":
+            return pa.bool_()
+        if column in ARROW_INT_COLUMNS:
+            return pa.int64()
+        if column in ARROW_ADDRESS_COLUMNS:
+            return address_type
+        return pa.string()
+
+    return {
+        table: pa.schema([(column, column_type(table, column)) for column in headers])
+        for table, headers in csv_headers.items()
+    }
+
+
+def _arrow_address(value: Any) -> Any:
+    """Converts an address or allow/disallow tree of addresses to the struct of `arrow_schemas`"""
+    if value is None:
+        return None
+    if not isinstance(value, dict):
+        return {"addr": str(value), "allowed": None, "children": []}
+    children: List[Dict[str, Any]] = []
+
+    def add_children(node: dict, parent: int) -> None:
+        for child in node.get("children", []):
+            children.append({"addr": child.get("addr"), "allowed": child.get("allowed"), "parent": parent})
+            add_children(child, len(children) - 1)
+
+    add_children(value, -1)
+    return {"addr": value.get("addr"), "allowed": value.get("allowed"), "children": children}
+
+
+def claim_arrow_records(file_path: path_type, claim: Optional[dict] = None) -> Dict[str, List[Dict[str, Any]]]:
+    """Converts a D3 claim JSON to records of the tables of `arrow_schemas`, based on its type.
+
+    Args:
+        file_path: The path to the D3 claim JSON.
+        claim: The already loaded claim of `file_path`. If `None`, it is loaded from the file.
+
+    Returns:
+        Map of table name to the records to add to it.
+    """
+    records = claim_records(file_path, claim)
+    for table_records in records.values():
+        for record in table_records:
+            for column, value in record.items():
+                if column in ARROW_INT_COLUMNS and value is not None:
+                    record[column] = int(value)
+                elif column in ARROW_ADDRESS_COLUMNS:
+                    record[column] = _arrow_address(value)
+    return records
+
+
+class ParquetExporter:
+    """Exports D3 claim JSONs to a Parquet file per table of `csv_headers`, with the types of `arrow_schemas`.
+
+    Records are written in row groups of `ARROW_BATCH_SIZE`. Use as a context manager,
+    so that the remaining records are written and the files are closed.
+
+    Requires the optional dependency pyarrow.
+    """
+
+    def __init__(self, parquet_dir: Path):
+        """
+        Args:
+            parquet_dir: The directory to write the `<table>.parquet` files to.
+
+        Raises:
+            ImportError: If pyarrow isn't installed.
+        """
+        self._pa, pq = _import_pyarrow()
+        self.parquet_dir = Path(parquet_dir)
+        self.parquet_dir.mkdir(parents=True, exist_ok=True)
+        self._schemas = arrow_schemas()
+        self._writers = {
+            table: pq.ParquetWriter(str(self.parquet_dir / f"{table}.parquet"), schema)
+            for table, schema in self._schemas.items()
+        }
+        self._records: Dict[str, List[Dict[str, Any]]] = {table: [] for table in self._schemas}
+
+    def export_records(self, records: Mapping[str, List[Dict[str, Any]]]) -> None:
+        """Adds records from `claim_arrow_records`, writing a row group whenever a table has enough
+
+        Args:
+            records: Map of table name to the records to add to it.
+        """
+        for table, table_records in records.items():
+            buffer = self._records[table]
+            buffer.extend(table_records)
+            if len(buffer) >= ARROW_BATCH_SIZE:
+                self._write(table)
+
+    def d3_json_export_parquet(self, file_path: path_type, claim: Optional[dict] = None) -> None:
+        """Exports a D3 claim JSON to records of the tables based on its type.
+
+        Args:
+            file_path: The path to the D3 claim JSON.
+            claim: The already loaded claim of `file_path`. If `None`, it is loaded from the file.
+        """
+        self.export_records(claim_arrow_records(file_path, claim))
+
+    def _write(self, table: str) -> None:
+        records = self._records[table]
+        if records:
+            self._writers[table].write_table(self._pa.Table.from_pylist(records, schema=self._schemas[table]))
+            self._records[table] = []
+
+    def close(self) -> None:
+        """Writes any remaining records, and closes the files"""
+        for table, writer in self._writers.items():
+            self._write(table)
+            writer.close()
+        self._writers = {}
+
+    def __enter__(self) -> "ParquetExporter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
@@ -64,31 +64,39 @@ def is_valid_guid(guid: str):
         return False
 
 
-def check_guids(guids: typing.List[str], file_names: typing.List[str]) -> bool:
+def check_guids(
+    guids: typing.List[str],
+    file_names: typing.List[str],
+    claims: typing.Optional[typing.Sequence[dict]] = None,
+) -> bool:
     """
     Checks all GUIDs are unique and of the correct type
     Args:
         guids: A list of GUIDs
         file_name: The filepaths to the YAML files
+        claims: The already loaded claims of `file_names`, in the same order.
+                If given, the files won't be parsed again to report errors.
     Returns:
         Boolean indicating if the GUIDs are unique and of the correct type
     """
     # ensure no duplicate GUIDs
     assert len(guids) == len(
         set(guids)
-    ), f"Duplicate GUIDs found: \n{get_duplicate_guids(guids, file_names)}"
+    ), f"Duplicate GUIDs found: \n{get_duplicate_guids(guids, file_names, claims)}"
 
     # ensure each GUID is a valid UUID
     for guid in guids:
         assert is_valid_guid(
             guid
-        ), f"Invalid GUID format: \n{find_guid_file_names(guid, file_names)}"
+        ), f"Invalid GUID format: \n{find_guid_file_names(guid, file_names, claims)}"
 
     return True
 
 
 def check_guids_array(
-    guids: typing.List[typing.List[str]], file_names: typing.List[str]
+    guids: typing.List[typing.List[str]],
+    file_names: typing.List[str],
+    claims: typing.Optional[typing.Sequence[dict]] = None,
 ) -> bool:
     """
     Checks all parent GUIDs are unique (not referenced multiple times) and are
@@ -96,21 +104,29 @@ def check_guids_array(
     Args:
         guids: A list of lists of GUIDs
         file_name: The filepaths to the YAML files
+        claims: The already loaded claims of `file_names`, in the same order.
     Returns:
         Boolean indicating if the GUIDs are unique and of the correct type
     """
+    if claims is None:
+        claims = [None] * len(file_names)
     return all(
-        check_guids(guid_list, [file_name])
-        for guid_list, file_name in zip(guids, file_names)
+        check_guids(guid_list, [file_name], None if claim is None else [claim])
+        for guid_list, file_name, claim in zip(guids, file_names, claims)
     )
 
 
-def get_duplicate_guids(guids: typing.List[str], file_names: typing.List[str]) -> str:
+def get_duplicate_guids(
+    guids: typing.List[str],
+    file_names: typing.List[str],
+    claims: typing.Optional[typing.Sequence[dict]] = None,
+) -> str:
     """
     Find duplicate GUIDs, and the name of their containing filename.
     Args:
         guids: A list of GUIDs
         file_name: The filepaths to the YAML files
+        claims: The already loaded claims of `file_names`, in the same order.
     Returns:
         Message containing duplicate GUIDs and their filenames
     """
@@ -118,21 +134,31 @@ def get_duplicate_guids(guids: typing.List[str], file_names: typing.List[str]) -
 
     guids_counter = collections.Counter(guids)
     duplicates = [guid for guid in guids_counter if guids_counter[guid] > 1]
-    return "\n".join([find_guid_file_names(guid, file_names) for guid in duplicates])
+    return "\n".join([find_guid_file_names(guid, file_names, claims) for guid in duplicates])
 
 
-def find_guid_file_names(guid_id: str, file_names: typing.List[str]) -> str:
+def find_guid_file_names(
+    guid_id: str,
+    file_names: typing.List[str],
+    claims: typing.Optional[typing.Sequence[dict]] = None,
+) -> str:
     """
     Function for finding the file name(s) in which a `guid_id` is found
     Args:
         guid_id: The guid to search for
         file_names: The filepaths to the YAML files
+        claims: The already loaded claims of `file_names`, in the same order.
+                If not given, each file is loaded to find its GUID.
     Returns:
         Message displaying the files that have the given GUID
     """
+    if claims is None:
+        guids = (get_guid_from_file(file_name) for file_name in file_names)
+    else:
+        guids = (get_guid(claim) for claim in claims)
     files = [
         file_name
-        for file_name in file_names
-        if get_guid_from_file(file_name) == guid_id
+        for file_name, guid in zip(file_names, guids)
+        if guid == guid_id
     ]
     return guid_id + " in files:\n" + "\n".join(files)
@@ -1,9 +1,5 @@
+import hashlib
 import json
-import pandas as pd
-
-
-def flatten_dict(dict):
-    return list(pd.json_normalize(dict).T.to_dict().values())[0]
 
 
 def load_json(file_name: str):
@@ -37,38 +33,59 @@ def is_json_unchanged(file_name: str, claim: dict):
         return False
 
 
-def is_json_same_as_claim(json_data, claim):
-    """Checks if json data is equivalent to claim data"""
-    flat_json_data = flatten_dict(json_data)
-    flat_claim_data = flatten_dict(claim)
-    for key in flat_claim_data:
-        equal = compare_properties(key, flat_json_data, flat_claim_data)
-        if not equal:
-            return False
-    return True
+def claim_digest(data) -> str:
+    """Returns a digest of JSON data that doesn't depend on dict key order
+
+    Args:
+        data: JSON compatible data, e.g. a D3 claim
+
+    Returns:
+        The sha256 digest of the canonical JSON serialisation of `data`
+    """
+    canonical_json = json.dumps(data, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical_json.encode("utf-8")).hexdigest()
 
 
-def compare_properties(key, flat_json_data, flat_claim_data):
-    if key == "credentialSubject.behaviour":
-        return flat_claim_data.get(key, None) == flat_json_data.get(
-            "credentialSubject.behaviour.id", None
-        ) or flat_claim_data.get(key, None) == flat_json_data.get(
-            "credentialSubject.behaviour.name", None
-        )
-    else:
-        return flat_json_data.get(key, None) == flat_claim_data.get(key, None)
+def _project_onto_claim(json_data, claim, path=()):
+    """Projects built JSON data onto the structure of its source claim.
+
+    Drops any object fields the build adds (e.g. type `children`), and maps
+    resolved `credentialSubject.behaviour` objects back to the id/name used by the claim.
+    Arrays are compared as a whole, so aren't projected.
+    """
+    if isinstance(claim, dict):
+        if not isinstance(json_data, dict):
+            return json_data
+        return {
+            key: _project_onto_claim(json_data.get(key, None), value, (*path, key))
+            for key, value in claim.items()
+        }
+    if path == ("credentialSubject", "behaviour") and isinstance(json_data, dict):
+        # the build resolves the behaviour name/id to {id, name}
+        if claim in (json_data.get("id", None), json_data.get("name", None)):
+            return claim
+    return json_data
+
+
+def is_json_same_as_claim(json_data, claim):
+    """Checks if json data is equivalent to claim data
+
+    Fields added by the build and the resolved behaviour are ignored.
+    """
+    return claim_digest(_project_onto_claim(json_data, claim)) == claim_digest(claim)
 
 
-def write_json(file_name: str, json_data: dict):
+def write_json(file_name: str, json_data: dict, sort_keys: bool = False):
     """Writes a JSON file from a Python dict.
 
     Args:
         file_name: The filepath to the JSON file
         json_data: The data to write to the JSON file
+        sort_keys: Whether to write dict keys in sorted order
 
     Returns:
         Boolean indicating if the JSON file was successfully written
     """
     with open(file_name, "w") as f:
-        json.dump(json_data, f, indent=2)
+        json.dump(json_data, f, indent=2, sort_keys=sort_keys)
     return True
@@ -0,0 +1,264 @@
+import io
+import logging
+import re
+import typing
+import zipfile
+from pathlib import Path
+
+import numpy as np
+
+# name of the MAC prefix index, written to the build output directory
+MAC_INDEX_FILENAME = "mac_index.npz"
+MAC_BITS = 48
+LOG = logging.getLogger(__name__)
+
+_MAC_SEPARATORS_RE = re.compile(r"[:\-.]")
+_HEX_RE = re.compile(r"^[0-9a-fA-F]{1,12}$")
+
+
+def parse_mac_prefix(mac_prefix: str) -> typing.Tuple[int, int]:
+    """Parses a MAC address or MAC address prefix
+
+    Args:
+        mac_prefix: e.g. `aa:bb:cc:00:00:00/24`, `00:1B:C5:00:00:10/36`,
+                    `C5-5E-87-89-3C-3B` or `aa:bb:cc`.
+                    Without a `/` mask, the prefix is as long as the given digits.
+
+    Returns:
+        The first MAC address of the prefix as an integer, and the length of the prefix in bits
+
+    Raises:
+        ValueError: If `mac_prefix` is not a valid MAC address prefix
+    """
+    address, _, mask = mac_prefix.strip().partition("/")
+    digits = _MAC_SEPARATORS_RE.sub("", address)
+    if not _HEX_RE.match(digits):
+        raise ValueError(f"Invalid MAC address prefix {mac_prefix!r}")
+    prefix_length = int(mask) if mask else len(digits) * 4
+    if not 0 <= prefix_length <= MAC_BITS:
+        raise ValueError(f"Invalid MAC address prefix length in {mac_prefix!r}")
+    value = int(digits, 16) << (MAC_BITS - len(digits) * 4)
+    # clear any host bits, e.g. `00:1B:C5:00:00:10/36` starts at `00:1B:C5:00:00:00`
+    host_bits = MAC_BITS - prefix_length
+    return value >> host_bits << host_bits, prefix_length
+
+
+def parse_macs(macs: typing.Iterable[str]) -> np.ndarray:
+    """Parses MAC addresses, e.g. `aa:bb:cc:dd:ee:ff` or `AA-BB-CC-DD-EE-FF`, to integers
+
+    Args:
+        macs: The MAC addresses
+
+    Returns:
+        The MAC addresses as an array of unsigned 64-bit integers
+
+    Raises:
+        ValueError: If a MAC address is not valid
+    """
+    values = []
+    for mac in macs:
+        digits = _MAC_SEPARATORS_RE.sub("", mac.strip())
+        if len(digits) != 12 or not _HEX_RE.match(digits):
+            raise ValueError(f"Invalid MAC address {mac!r}")
+        values.append(int(digits, 16))
+    return np.array(values, dtype=np.uint64)
+
+
+class MacPrefixIndex:
+    """Longest-prefix-match index of the MAC address prefixes of D3 type claims.
+
+    The (possibly nested) prefixes are flattened into sorted, disjoint ranges of MAC addresses,
+    each owned by the types with the most specific prefix covering it, so that looking up
+    any number of MACs is a single vectorized binary search.
+    """
+
+    def __init__(
+        self,
+        boundaries: np.ndarray,
+        groups: np.ndarray,
+        group_offsets: np.ndarray,
+        group_members: np.ndarray,
+        type_ids: np.ndarray,
+    ):
+        """Use `from_prefixes`, `from_type_claims` or `load` instead.
+
+        Args:
+            boundaries: The sorted first MAC address of each range
+            groups: The owner group of each range, or -1 if no type owns the range
+            group_offsets: Where each owner group starts in `group_members`, followed by its length
+            group_members: The indexes in `type_ids` of the types in each owner group
+            type_ids: The IDs of the types
+        """
+        self.boundaries = boundaries
+        self.groups = groups
+        self.group_offsets = group_offsets
+        self.group_members = group_members
+        self.type_ids = type_ids
+
+    @classmethod
+    def from_prefixes(cls, prefixes: typing.Iterable[typing.Tuple[str, str]]) -> "MacPrefixIndex":
+        """Builds an index of MAC address prefixes
+
+        Args:
+            prefixes: Pairs of a MAC address prefix (see `parse_mac_prefix`) and the ID of its type.
+                      Invalid prefixes are skipped with a warning.
+
+        Returns:
+            The index
+        """
+        owners: typing.Dict[typing.Tuple[int, int], typing.Set[str]] = {}
+        for mac_prefix, type_id in prefixes:
+            try:
+                owners.setdefault(parse_mac_prefix(mac_prefix), set()).add(type_id)
+            except ValueError as error:
+                LOG.warning(f"{error} in type {type_id}")
+
+        type_ids = sorted(set().union(*owners.values()))
+        type_indexes = {type_id: i for i, type_id in enumerate(type_ids)}
+        group_indexes: typing.Dict[typing.Tuple[int, ...], int] = {}
+        ranges = []
+        for (start, prefix_length), prefix_owners in owners.items():
+            group = tuple(sorted(type_indexes[type_id] for type_id in prefix_owners))
+            group_index = group_indexes.setdefault(group, len(group_indexes))
+            ranges.append((start, prefix_length, start + (1 << (MAC_BITS - prefix_length)), group_index))
+
+        # sweep through the prefixes, widest first for the same start, keeping a stack of
+        # the enclosing prefixes, so that each address belongs to its most specific prefix
+        segments = [(0, -1)]
+
+        def add_segment(boundary: int, group: int):
+            if segments[-1][0] == boundary:
+                segments.pop()
+            if not segments or segments[-1][1] != group:
+                segments.append((boundary, group))
+
+        stack: typing.List[typing.Tuple[int, int]] = []
+        for start, _prefix_length, end, group in sorted(ranges):
+            while stack and stack[-1][0] <= start:
+                closed_end, _group = stack.pop()
+                add_segment(closed_end, stack[-1][1] if stack else -1)
+            add_segment(start, group)
+            stack.append((end, group))
+        while stack:
+            closed_end, _group = stack.pop()
+            add_segment(closed_end, stack[-1][1] if stack else -1)
+        # the last range may end after the last MAC address
+        segments = [(boundary, group) for boundary, group in segments if boundary < 1 << MAC_BITS]
+
+        groups = sorted(group_indexes, key=group_indexes.get)
+        return cls(
+            boundaries=np.array([boundary for boundary, _group in segments], dtype=np.uint64),
+            groups=np.array([group for _boundary, group in segments], dtype=np.int32),
+            group_offsets=np.cumsum([0] + [len(group) for group in groups], dtype=np.int32),
+            group_members=np.array([member for group in groups for member in group], dtype=np.int32),
+            type_ids=np.array(type_ids, dtype=str),
+        )
+
+    @classmethod
+    def from_type_claims(cls, type_jsons: typing.Iterable[dict]) -> "MacPrefixIndex":
+        """Builds an index of the `macAddresses` of D3 type claims
+
+        Args:
+            type_jsons: The D3 type claims
+
+        Returns:
+            The index
+        """
+        return cls.from_prefixes(
+            (mac_prefix, type_json["credentialSubject"]["id"])
+            for type_json in type_jsons
+            for mac_prefix in type_json["credentialSubject"].get("macAddresses", [])
+        )
+
+    def lookup_groups(self, macs: typing.Union[typing.Iterable[str], np.ndarray]) -> np.ndarray:
+        """Finds the owner group of each MAC address, vectorized
+
+        Args:
+            macs: MAC addresses, or an array of them as integers (see `parse_macs`)
+
+        Returns:
+            The index of the owner group of each MAC address (see `group`), or -1 if none
+        """
+        if not isinstance(macs, np.ndarray):
+            macs = parse_macs(macs)
+        if len(self.boundaries) == 0:
+            return np.full(len(macs), -1, dtype=np.int32)
+        return self.groups[np.searchsorted(self.boundaries, macs.astype(np.uint64), side="right") - 1]
+
+    def group(self, group_index: int) -> typing.Tuple[str, ...]:
+        """Returns the sorted IDs of the types in an owner group, or none if `group_index` is -1"""
+        if group_index < 0:
+            return ()
+        members = self.group_members[self.group_offsets[group_index]:self.group_offsets[group_index + 1]]
+        return tuple(str(type_id) for type_id in self.type_ids[members])
+
+    def lookup_many(
+        self, macs: typing.Union[typing.Iterable[str], np.ndarray]
+    ) -> typing.List[typing.Tuple[str, ...]]:
+        """Finds the types with the most specific MAC address prefix matching each MAC address
+
+        Args:
+            macs: MAC addresses, or an array of them as integers (see `parse_macs`)
+
+        Returns:
+            The sorted IDs of the types owning each MAC address, empty if none do
+        """
+        groups = self.lookup_groups(macs)
+        group_types = [self.group(group_index) for group_index in range(len(self.group_offsets) - 1)]
+        return [group_types[group_index] if group_index >= 0 else () for group_index in groups.tolist()]
+
+    def lookup(self, mac: str) -> typing.Tuple[str, ...]:
+        """Finds the types with the most specific MAC address prefix matching a MAC address
+
+        Args:
+            mac: The MAC address, e.g. `aa:bb:cc:dd:ee:ff`
+
+        Returns:
+            The sorted IDs of the types owning the MAC address, empty if none do
+        """
+        return self.lookup_many([mac])[0]
+
+    def __len__(self) -> int:
+        """The number of disjoint ranges of MAC addresses in the index"""
+        return len(self.boundaries)
+
+    def _to_bytes(self) -> bytes:
+        arrays = dict(
+            boundaries=self.boundaries,
+            groups=self.groups,
+            group_offsets=self.group_offsets,
+            group_members=self.group_members,
+            type_ids=self.type_ids,
+        )
+        buffer = io.BytesIO()
+        # same as `np.savez_compressed`, but with fixed timestamps, so the same index has the same bytes
+        with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as npz:
+            for name, array in arrays.items():
+                info = zipfile.ZipInfo(f"{name}.npy", date_time=(1980, 1, 1, 0, 0, 0))
+                info.compress_type = zipfile.ZIP_DEFLATED
+                with npz.open(info, "w") as f:
+                    np.lib.format.write_array(f, np.asanyarray(array), allow_pickle=False)
+        return buffer.getvalue()
+
+    def save(self, path: Path) -> bool:
+        """Saves the index as a NumPy `.npz` file, unless the file is unchanged
+
+        Args:
+            path: The filepath to save the index to
+
+        Returns:
+            Boolean indicating whether the file was written
+        """
+        path = Path(path)
+        data = self._to_bytes()
+        if path.exists() and path.read_bytes() == data:
+            return False
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+        return True
+
+    @classmethod
+    def load(cls, path: Path) -> "MacPrefixIndex":
+        """Loads an index saved with `save`, e.g. the `mac_index.npz` of a build output directory"""
+        with np.load(path, allow_pickle=False) as data:
+            return cls(**{name: data[name] for name in data.files})
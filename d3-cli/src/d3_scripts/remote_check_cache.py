@@ -0,0 +1,155 @@
+import logging
+import sqlite3
+import time
+import typing
+from pathlib import Path
+
+REMOTE_CHECK_CACHE_FILENAME = ".d3-remote-checks.sqlite"
+# re-check remote resources once a day by default
+DEFAULT_REMOTE_CHECK_TTL = 24 * 60 * 60
+# HTTP statuses of failures that may be temporary, as well as server errors (5xx)
+TRANSIENT_HTTP_STATUSES = {408, 429}
+LOG = logging.getLogger(__name__)
+
+
+class RemoteCheck(typing.NamedTuple):
+    """The result of checking whether a remote resource (e.g. a URI) resolves"""
+
+    status: typing.Optional[int]
+    """The HTTP status code, or None if no response was received"""
+    error: typing.Optional[str]
+    """Why the resource cannot be resolved, or None if it resolves"""
+
+    @property
+    def is_transient(self) -> bool:
+        """Whether the check failed in a way that may be temporary, e.g. a timeout,
+        a connection error, a rate limit or a server error, so it should be checked again"""
+        if self.error is None:
+            return False
+        return self.status is None or self.status in TRANSIENT_HTTP_STATUSES or self.status >= 500
+
+
+class RemoteCheckCache:
+    """SQLite cache of remote check results, so unchanged resources aren't checked on every build.
+
+    Results are keyed by the kind of check (e.g. `uri` or `cpe`) and the checked value,
+    and are stale once they are older than the TTL.
+    Transient failures (see `RemoteCheck.is_transient`) aren't cached by `cached_check`.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        ttl: float = DEFAULT_REMOTE_CHECK_TTL,
+        refresh: bool = False,
+    ):
+        """
+        Args:
+            path: The filepath of the SQLite database. Created if it doesn't exist.
+            ttl: The number of seconds for which a result is fresh.
+            refresh: Treat every result as stale, so that everything is checked again.
+        """
+        self.path = Path(path)
+        self.ttl = ttl
+        self.refresh = refresh
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(self.path)
+        with self.connection:
+            self.connection.execute(
+                """CREATE TABLE IF NOT EXISTS remote_checks (
+                    kind TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    status INTEGER,
+                    error TEXT,
+                    checked_at REAL NOT NULL,
+                    PRIMARY KEY (kind, value)
+                )"""
+            )
+
+    @classmethod
+    def in_build_dir(cls, output_dir: Path, **kwargs) -> "RemoteCheckCache":
+        """Opens the cache in a build output directory"""
+        return cls(Path(output_dir) / REMOTE_CHECK_CACHE_FILENAME, **kwargs)
+
+    def get_many(self, kind: str, values: typing.Iterable[str]) -> typing.Dict[str, RemoteCheck]:
+        """Finds the fresh cached results of a kind of check
+
+        Args:
+            kind: The kind of check, e.g. `uri`
+            values: The checked values, e.g. URIs
+
+        Returns:
+            Map of value to its cached result. Values with no fresh result are omitted.
+        """
+        if self.refresh:
+            return {}
+        oldest = time.time() - self.ttl
+        values = list(values)
+        results = {}
+        # stay below SQLite's limit on the number of query parameters
+        batch_size = 500
+        for i in range(0, len(values), batch_size):
+            batch = values[i:i + batch_size]
+            placeholders = ",".join("?" * len(batch))
+            rows = self.connection.execute(
+                f"""SELECT value, status, error FROM remote_checks
+                WHERE kind = ? AND checked_at >= ? AND value IN ({placeholders})""",
+                (kind, oldest, *batch),
+            )
+            for value, status, error in rows:
+                results[value] = RemoteCheck(status, error)
+        return results
+
+    def put_many(self, kind: str, results: typing.Mapping[str, RemoteCheck]) -> None:
+        """Stores the results of a kind of check, checked now
+
+        Args:
+            kind: The kind of check, e.g. `uri`
+            results: Map of checked value to its result
+        """
+        checked_at = time.time()
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO remote_checks VALUES (?, ?, ?, ?, ?)",
+                (
+                    (kind, value, result.status, result.error, checked_at)
+                    for value, result in results.items()
+                ),
+            )
+
+    def cached_check(
+        self,
+        kind: str,
+        values: typing.Iterable[str],
+        check_all: typing.Callable[[typing.List[str]], typing.Mapping[str, RemoteCheck]],
+    ) -> typing.Dict[str, RemoteCheck]:
+        """Checks each unique value, using cached results where they are fresh
+
+        Args:
+            kind: The kind of check, e.g. `uri`
+            values: The values to check
+            check_all: Function that checks a list of values, returning a map of value to result
+
+        Returns:
+            Map of each unique value to its result. Transient failures aren't cached,
+            so they are checked again next time.
+        """
+        unique_values = list(dict.fromkeys(values))
+        results = self.get_many(kind, unique_values)
+        stale_values = [value for value in unique_values if value not in results]
+        LOG.info(
+            f"Checking {len(stale_values)} {kind}s, {len(results)} already checked in the last {self.ttl}s"
+        )
+        new_results = check_all(stale_values) if stale_values else {}
+        self.put_many(kind, {value: result for value, result in new_results.items() if not result.is_transient})
+        results.update(new_results)
+        return results
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __enter__(self) -> "RemoteCheckCache":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
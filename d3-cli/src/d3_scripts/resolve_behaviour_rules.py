@@ -1,59 +1,108 @@
 import networkx as nx
 from .check_behaviours_resolve import BehaviourMap, BehaviourJson
-from iteration_utilities import unique_everseen
-from typing import List, Dict
+from .json_tools import claim_digest
+from typing import Dict, Iterable, List, Optional, Tuple
 
+# a rule, paired with the GUID of the behaviour claim that defines it
+RuleEntry = Tuple[str, Dict]
+# map of behaviour GUID to the rules it inherits from its ancestors
+InheritedRules = Dict[str, List[RuleEntry]]
 
-def _get_item(collection: List[Dict], key: str, target: str or int or float):
+
+def aggregate_inherited_rules(
+    claim_map: BehaviourMap,
+    claim_graph: nx.DiGraph,
+    ids: Optional[Iterable[str]] = None,
+) -> InheritedRules:
     """
-    Get item in collection (array of dictionaries) by key and target value, if a match exists.
+    Finds the rules each behaviour claim inherits from its ancestors.
 
-    E.g. _get_item([{"name": "Bob"}, {"name": "Alice"}, {"name": "Carl"}, {"name": "Dobby"}], "name", "Alice")
-    will return the {"name": "Alice"} dictionary. If no matches exist, function will return None.
+    Claims are visited in topological order, so each claim's inherited rules are
+    built from its parents' already computed rules, instead of walking all of its
+    ancestors again. Rules are ordered nearest ancestor first, following the
+    order in which parents are listed, and each ancestor contributes its rules once.
 
     Args:
-        collection: Array of dictionaries
-        key: Key in dictionary to match against
-        target: Target value to match against
+        claim_map: Map of D3 claim GUID to D3 behaviour claim json
+        claim_graph: Claim inheritance graph, with an edge from each parent to its child
+        ids: The claim GUIDs to find inherited rules for. Defaults to every claim in the graph.
 
     Returns:
-        Matching Dictionary
+        Map of D3 claim GUID to the rules it inherits, paired with the GUID of the
+        ancestor that defines each rule. The rules are not copied.
     """
-    return next((item for item in collection if item.get(key, None) == target), None)
+    graph = claim_graph
+    if ids is not None:
+        ids = list(ids)
+        graph = claim_graph.subgraph(
+            set(ids).union(*(nx.ancestors(claim_graph, id) for id in ids))
+        )
+    inherited_rules: InheritedRules = {}
+    for id in nx.topological_sort(graph):
+        entries = []
+        seen_origins = set()
+        for parent_id in graph.predecessors(id):
+            try:
+                parent_claim = claim_map[parent_id]
+            except KeyError:
+                raise KeyError(
+                    f"Parent behaviour id {parent_id} of {id} doesn't exist")
+            parent_entries = [
+                (parent_id, rule)
+                for rule in parent_claim["credentialSubject"].get("rules", [])
+            ] + inherited_rules[parent_id]
+            entries += [
+                (origin_id, rule) for (origin_id, rule) in parent_entries
+                if origin_id not in seen_origins
+            ]
+            seen_origins.update(origin_id for (origin_id, _rule) in parent_entries)
+        inherited_rules[id] = entries
+    return inherited_rules
 
 
 def resolve_behaviour_rules(
-    claim: BehaviourJson, claim_map: BehaviourMap, claim_graph: nx.DiGraph
+    claim: BehaviourJson,
+    claim_map: BehaviourMap,
+    claim_graph: nx.DiGraph,
+    inherited_rules: Optional[InheritedRules] = None,
 ) -> List[Dict]:
     """
     Resolve rules which apply for behaviour claim from parent behaviour inheritance.
 
+    Inherited rules whose ruleName clashes with an earlier rule are renamed to
+    `{ruleName of ancestor}/{ruleName}`. Duplicate rules are removed.
+
     Args:
         claim: The D3 behaviour claim to resolve behaviour for
         claim_map: Map of D3 claim GUID to D3 behaviour claim json
         claim_graph: Claim inheritance graph that shows this claim's parents
+        inherited_rules: The output of `aggregate_inherited_rules`, if already computed.
 
     Returns:
         The rules which apply to the behaviour claim.
 
     """
-    aggregated_rules = []
-    rules = claim["credentialSubject"].get("rules", [])
-    aggregated_rules += rules
     id = claim["credentialSubject"]["id"]
-    parents = nx.ancestors(claim_graph, id)
-    for parent_id in parents:
-        try:
-            parent_claim = claim_map[parent_id]
-        except KeyError:
-            raise KeyError(
-                f"Parent behaviour id {parent_id} of {id} doesn't exist")
-        parent_rules = parent_claim["credentialSubject"].get("rules", [])
-        for rule in parent_rules:
-            if _get_item(aggregated_rules, "ruleName", rule["ruleName"]):
-                rule["ruleName"] = f"{parent_claim['credentialSubject']['ruleName']}/{rule['ruleName']}"
+    if inherited_rules is None or id not in inherited_rules:
+        inherited_rules = aggregate_inherited_rules(claim_map, claim_graph, ids=[id])
+
+    aggregated_rules = []
+    rule_names = set()
+    rule_digests = set()
+
+    def add_rule(rule: Dict):
+        rule_names.add(rule.get("ruleName"))
+        digest = claim_digest(rule)
+        if digest not in rule_digests:  # De-duplicate any duplicate rules
+            rule_digests.add(digest)
             aggregated_rules.append(rule)
-    unique_aggregated_rules = list(
-        unique_everseen(aggregated_rules)
-    )  # De-duplicate any duplicate rules
-    return unique_aggregated_rules
+
+    for rule in claim["credentialSubject"].get("rules", []):
+        add_rule(rule)
+    for origin_id, rule in inherited_rules[id]:
+        if rule["ruleName"] in rule_names:
+            origin_name = claim_map[origin_id]["credentialSubject"]["ruleName"]
+            # copy, since the same rule object is shared by every descendant of its claim
+            rule = {**rule, "ruleName": f"{origin_name}/{rule['ruleName']}"}
+        add_rule(rule)
+    return aggregated_rules
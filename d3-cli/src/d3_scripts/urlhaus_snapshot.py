@@ -0,0 +1,83 @@
+import logging
+import sqlite3
+import typing
+from pathlib import Path
+
+# name of the snapshot of the last ingested URLhaus feed, kept in the build output directory
+URLHAUS_SNAPSHOT_FILENAME = ".d3-urlhaus-snapshot.sqlite"
+LOG = logging.getLogger(__name__)
+
+
+class UrlhausSnapshot:
+    """SQLite snapshot of the last URLhaus feed ingested into a build output directory.
+
+    Records the state of the feed (e.g. its HTTP `ETag`), and the digest of every malicious
+    behaviour built from it, so that the next build only has to write the behaviours
+    that were added or changed since, and delete the ones that were removed.
+    """
+
+    def __init__(self, path: Path):
+        """
+        Args:
+            path: The filepath of the SQLite database. Created if it doesn't exist.
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(self.path)
+        with self.connection:
+            self.connection.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS feed (
+                    id INTEGER PRIMARY KEY CHECK (id = 0),
+                    state TEXT
+                );
+                CREATE TABLE IF NOT EXISTS behaviours (
+                    id TEXT PRIMARY KEY,
+                    digest TEXT NOT NULL
+                );
+                """
+            )
+
+    @classmethod
+    def in_build_dir(cls, output_dir: Path) -> "UrlhausSnapshot":
+        """Opens the snapshot in a build output directory"""
+        return cls(Path(output_dir) / URLHAUS_SNAPSHOT_FILENAME)
+
+    @property
+    def feed_state(self) -> typing.Optional[str]:
+        """The state of the feed when it was last ingested, or None if unknown"""
+        row = self.connection.execute("SELECT state FROM feed").fetchone()
+        return row[0] if row else None
+
+    def digests(self) -> typing.Dict[str, str]:
+        """Returns map of the ID of each malicious behaviour in the snapshot to its digest"""
+        return dict(self.connection.execute("SELECT id, digest FROM behaviours"))
+
+    def apply(
+        self,
+        feed_state: typing.Optional[str],
+        updated: typing.Mapping[str, str],
+        removed: typing.Iterable[str],
+    ) -> None:
+        """Records that a feed was ingested, in a single transaction
+
+        Args:
+            feed_state: The state of the ingested feed
+            updated: Map of the ID of each added or changed malicious behaviour to its digest
+            removed: The IDs of the removed malicious behaviours
+        """
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO feed VALUES (0, ?)", (feed_state,))
+            self.connection.executemany("DELETE FROM behaviours WHERE id = ?", ((id,) for id in removed))
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO behaviours VALUES (?, ?)", updated.items()
+            )
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __enter__(self) -> "UrlhausSnapshot":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
@@ -1,6 +1,7 @@
 from pathlib import Path
 import jsonschema
 import functools
+import typing
 from .json_tools import load_json
 from .yaml_tools import get_yaml_suffixes, load_claim
 
@@ -76,3 +77,40 @@ def validate_d3_claim_schema(yaml_file_path: str):
     # validate schema
     schema_validator = get_schema_validator_from_path(yaml_file_path)
     schema_validator.validate(claim["credentialSubject"])
+
+
+@functools.lru_cache(maxsize=None)
+def get_d3_claims_validator(d3_type: str) -> jsonschema.Validator:
+    """Loads a jsonschema validator for an array of D3 claims of a specific d3 type
+
+    Each claim is validated against both the D3 master claim schema,
+    and the schema of its d3 type for its credentialSubject.
+
+    Returns:
+        The jsonschema validator
+    """
+    schema = {
+        "$schema": "https://json-schema.org/draft/2020-12/schema",
+        "type": "array",
+        "items": {
+            "allOf": [
+                d3_master_claim_schema_validator().schema,
+                {"properties": {"credentialSubject": get_d3_claim_schema_validator(d3_type).schema}},
+            ]
+        },
+    }
+    jsonschema.Draft202012Validator.check_schema(schema)
+    return jsonschema.Draft202012Validator(schema=schema)
+
+
+def validate_d3_claims(claims: typing.Sequence[dict], d3_type: str):
+    """Validates many D3 claims of the same d3 type at once, e.g. generated claims
+
+    Args:
+        claims: The D3 claims to validate
+        d3_type: The d3 type of the claims, e.g. `behaviour`
+
+    Raises:
+        jsonschema.ValidationError: If any claim is not valid
+    """
+    get_d3_claims_validator(d3_type).validate(list(claims))
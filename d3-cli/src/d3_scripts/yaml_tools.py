@@ -1,3 +1,5 @@
+import os
+import typing
 from pathlib import Path
 
 import yaml
@@ -5,6 +7,14 @@ import yamllint.linter
 import yamllint.cli
 from yamllint.config import YamlLintConfig
 
+try:
+    # libyaml bindings are several times faster than the pure-Python (de)serialisers
+    from yaml import CSafeLoader as SafeLoader, CSafeDumper as FastSafeDumper
+    YAML_BACKEND = "libyaml"
+except ImportError:
+    from yaml import SafeLoader, SafeDumper as FastSafeDumper
+    YAML_BACKEND = "pure-python"
+
 
 def get_yaml_suffixes(file_name):
     try:
@@ -15,6 +25,22 @@ def get_yaml_suffixes(file_name):
         raise
 
 
+def get_claim_type(file_name: str) -> typing.Optional[str]:
+    """Gets the D3 claim type from a claim filename without any path parsing,
+    e.g. `type` for `example.type.d3.yaml`
+
+    Args:
+        file_name: The filepath to the YAML claim file
+
+    Returns:
+        The claim type, or `None` if the filename isn't of the form `*.<type>.d3.yaml`
+    """
+    parts = os.path.basename(file_name).rsplit(".", 3)
+    if len(parts) == 4 and parts[0] and parts[2] == "d3" and parts[3] == "yaml":
+        return parts[1]
+    return None
+
+
 def is_valid_yaml_claim(file_name: str):
     """Validates a YAML claim file against the D3 expected extensions
     e.g. exmaple.type.d3.yaml
@@ -52,10 +78,51 @@ def load_claim(file_name: str):
     """
     yaml_data = {}
     with open(file_name) as f:
-        yaml_data = yaml.safe_load(f)
+        yaml_data = yaml.load(f, Loader=SafeLoader)
     return yaml_data
 
 
+def parse_claim(contents: str):
+    """Parses the contents of a YAML claim file and returns the data as a Python dict
+
+    Args:
+        contents: The text of the YAML claim file
+
+    Returns:
+        The data from the YAML claim as a Python dict
+    """
+    return yaml.load(contents, Loader=SafeLoader)
+
+
+def _has_escaped_strings(data) -> bool:
+    """Checks whether data contains strings that YAML must escape (e.g. non-ASCII)
+
+    libyaml and PyYAML wrap long escaped strings at different places,
+    but otherwise output identical YAML.
+    """
+    if isinstance(data, str):
+        return not all(" " <= char <= "~" for char in data)
+    if isinstance(data, dict):
+        return any(_has_escaped_strings(key) or _has_escaped_strings(value) for key, value in data.items())
+    if isinstance(data, (list, tuple)):
+        return any(_has_escaped_strings(item) for item in data)
+    return False
+
+
+def dump_yaml(data, stream=None, **kwargs):
+    """Serialises data as YAML, using libyaml if available.
+
+    The output is identical whichever backend is used.
+
+    Args:
+        data: The data to serialise, e.g. a D3 claim
+        stream: The file to write the YAML to. If `None`, the YAML is returned as a string.
+        kwargs: Additional options passed to `yaml.dump`, e.g. `default_flow_style`
+    """
+    dumper = yaml.SafeDumper if _has_escaped_strings(data) else FastSafeDumper
+    return yaml.dump(data, stream, Dumper=dumper, **kwargs)
+
+
 _yaml_lint_config = YamlLintConfig(
     r"""
         extends: default
@@ -0,0 +1,103 @@
+import ipaddress
+from pathlib import Path
+
+import numpy as np
+
+from d3_scripts.behaviour_matcher import BehaviourMatcher, Flow
+from d3_scripts.yaml_tools import load_claim
+
+FIXTURES = Path(__file__).parent / "__fixtures__" / "behaviour-matcher"
+
+
+def test_rules():
+    matcher = BehaviourMatcher.from_claim(load_claim(FIXTURES / "echo.behaviour.d3.yaml"))
+    # matched by DNS name, including subdomains, and port
+    assert matcher.check(Flow(protocol=6, destination_name="dcape-na.amazon.com", destination_port=443)) == (
+        True, "from-ipv4-amazonecho-0"
+    )
+    assert matcher.is_allowed(Flow(protocol=6, destination_name="a.dcape-na.amazon.com", destination_port=443))
+    assert not matcher.is_allowed(Flow(protocol=6, destination_name="dcape-na.amazon.com", destination_port=80))
+    # matched by IP address, port, MAC address and ether type
+    dhcp = Flow(
+        protocol=17, destination_ip="255.255.255.255", destination_port=67,
+        destination_mac="FF-FF-FF-FF-FF-FF", ether_type=2048,
+    )
+    assert matcher.is_allowed(dhcp)
+    assert not matcher.is_allowed(dhcp._replace(ether_type=None))
+    assert matcher.is_allowed(Flow(protocol=2, destination_ip="224.0.0.22"))
+    assert not matcher.is_allowed(Flow(protocol=2, destination_ip="224.0.0.23"))
+    # malicious rules disallow matching flows
+    assert matcher.check(Flow(protocol=17, destination_ip="155.67.220.220", destination_port=53)) == (
+        False, "from-malicious-sender"
+    )
+
+
+def test_nested_allow_deny():
+    matcher = BehaviourMatcher([{
+        "ruleName": "nested",
+        "matches": {
+            "ip4": {
+                "destinationIp4": {
+                    "addr": "10.0.0.0/8",
+                    "children": [
+                        {"addr": "10.1.0.0/16", "allowed": False, "children": [{"addr": "10.1.2.0/24"}]},
+                        {"addr": "192.168.0.0/16"},  # not within its parent, so ignored
+                    ],
+                },
+                "destinationDnsname": {
+                    "addr": "example.com",
+                    "children": [{"addr": "*.bad.example.com", "allowed": False}],
+                },
+            },
+        },
+    }])
+    assert [
+        matcher.is_allowed(Flow(destination_ip=ip))
+        for ip in ["10.2.3.4", "10.1.3.4", "10.1.2.4", "192.168.0.1"]
+    ] == [True, False, True, False]
+    assert [
+        matcher.is_allowed(Flow(destination_name=name))
+        for name in ["example.com", "bad.example.com", "www.bad.example.com", "example.org"]
+    ] == [True, True, False, False]
+
+
+def test_malicious_urls():
+    matcher = BehaviourMatcher([{
+        "name": "Traffic to 1-malware_download",
+        "matches": {"ip4": {"destinationDnsName": {"addr": "http://192.0.2.1:8080/x.sh", "allowed": False}}},
+    }], malicious=True)
+    # the host of the URL is matched
+    assert matcher.check(Flow(destination_ip="192.0.2.1")) == (False, "Traffic to 1-malware_download")
+    assert matcher.check(Flow(destination_ip="192.0.2.2")) == (False, None)
+
+
+def test_check_batch():
+    """Test whether checking flows in a batch gives the same decisions as checking them one by one"""
+    matcher = BehaviourMatcher.from_claim(load_claim(FIXTURES / "echo.behaviour.d3.yaml"))
+    ips = ["255.255.255.255", "224.0.0.22", "224.0.0.23", "155.67.220.220", "8.8.8.8", None]
+    names = ["dcape-na.amazon.com", "a.dcape-na.amazon.com", "example.com", None]
+    flows = [
+        Flow(protocol=protocol, destination_ip=ip, destination_port=port, destination_name=name,
+             destination_mac=mac, ether_type=ether_type)
+        for protocol in (None, 2, 6, 17)
+        for ip in ips
+        for port in (None, 53, 67, 443)
+        for name in names
+        for mac, ether_type in ((None, None), ("ff:ff:ff:ff:ff:ff", 2048))
+    ]
+    ports = [-1 if flow.destination_port is None else flow.destination_port for flow in flows]
+    decisions = matcher.check_batch({
+        "protocol": np.array([-1 if flow.protocol is None else flow.protocol for flow in flows]),
+        "destination_ip": np.array([
+            -1 if flow.destination_ip is None else int(ipaddress.ip_address(flow.destination_ip))
+            for flow in flows
+        ]),
+        "destination_port": np.array(ports),
+        "destination_name": np.array([flow.destination_name or "" for flow in flows]),
+        "destination_mac": np.array([-1 if flow.destination_mac is None else 0xFFFFFFFFFFFF for flow in flows]),
+        "ether_type": np.array([-1 if flow.ether_type is None else flow.ether_type for flow in flows]),
+    })
+    assert [
+        (allowed, matcher.rules[rule].name if rule >= 0 else None)
+        for allowed, rule in zip(decisions.allowed.tolist(), decisions.rule.tolist())
+    ] == [tuple(matcher.check(flow)) for flow in flows]
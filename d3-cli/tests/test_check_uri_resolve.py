@@ -0,0 +1,102 @@
+import collections
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import d3_scripts.check_uri_resolve
+from d3_scripts.check_uri_resolve import UriResolver, resolve_claim_uris
+
+
+class Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise Exception(f"{self.status_code} Error")
+
+
+def test_resolve_all_deduplicates(monkeypatch):
+    """Test whether each unique URI is only checked once, and its result given to every claim with it"""
+    checked_uris = []
+
+    def head(session, uri, **kwargs):
+        checked_uris.append(uri)
+        return Response(404 if "missing" in uri else 200)
+
+    monkeypatch.setattr(d3_scripts.check_uri_resolve.requests.Session, "head", head)
+    claim_uris = {
+        "a.type.d3.yaml": ["https://example.com/ok", "https://example.com/missing"],
+        "b.type.d3.yaml": ["https://example.com/missing", "https://example.com/ok"],
+        "c.type.d3.yaml": ["https://example.com/ok", "https://device-type.com"],
+    }
+    with UriResolver() as resolver:
+        claim_errors = resolve_claim_uris(claim_uris, resolver=resolver)
+    assert sorted(checked_uris) == ["https://example.com/missing", "https://example.com/ok"]
+    assert sorted(claim_errors) == ["a.type.d3.yaml", "b.type.d3.yaml"]
+    assert "URI https://example.com/missing cannot be resolved: 404 Error" in claim_errors["a.type.d3.yaml"]
+
+
+def test_requests_per_host_limited(monkeypatch):
+    """Test whether at most `max_per_host` requests are made to a host at once, without limiting other hosts"""
+    active = collections.Counter()
+    max_active = collections.Counter()
+    lock = threading.Lock()
+
+    def head(session, uri, **kwargs):
+        host = uri.split("/")[2]
+        with lock:
+            active[host] += 1
+            max_active[host] = max(max_active[host], active[host])
+            max_active["total"] = max(max_active["total"], sum(active.values()))
+        time.sleep(0.05)
+        with lock:
+            active[host] -= 1
+        return Response(200)
+
+    monkeypatch.setattr(d3_scripts.check_uri_resolve.requests.Session, "head", head)
+    uris = [f"https://{host}.example.com/{i}" for host in ["a", "b"] for i in range(8)]
+    with UriResolver(max_workers=16, max_per_host=2) as resolver:
+        assert resolver.resolve_all(uris) == {uri: None for uri in uris}
+    assert max_active["a.example.com"] == 2
+    assert max_active["b.example.com"] == 2
+    assert max_active["total"] > 2
+
+
+@contextmanager
+def _serve(statuses):
+    """Serves HEAD requests on localhost, responding with each of `statuses` in turn"""
+    statuses = iter(statuses)
+    requests_made = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_HEAD(self):
+            requests_made.append(self.path)
+            self.send_response(next(statuses))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}/device", requests_made
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.mark.parametrize("retries, error", [(0, True), (1, False)])
+def test_server_errors_retried(retries, error):
+    """Test whether server errors are retried up to `retries` times"""
+    with _serve([503, 200]) as (uri, requests_made), UriResolver(retries=retries) as resolver:
+        check = resolver.check(uri)
+    assert len(requests_made) == retries + 1
+    assert (check.error is not None) == error
+    assert check.status == (503 if error else 200)
@@ -0,0 +1,51 @@
+import csv
+import json
+from pathlib import Path
+
+import d3_scripts.d3_build
+from d3_scripts.d3_audit import audit_flow_log, RULE_HITS_FILENAME, VIOLATIONS_FILENAME
+
+FIXTURES = Path(__file__).parent / "__fixtures__" / "audit"
+TYPE_ID = "4c8cf1a5-3f1e-4b8b-9d0f-6f3a2b1c0d02"
+MAC = "00:1b:c5:00:00:01"
+FLOWS = [
+    {"mac": MAC, "proto": "tcp", "dst_ip": "93.184.216.34", "dst_port": 443, "domain": "www.example.com"},
+    {"mac": MAC, "proto": "tcp", "dst_ip": "93.184.216.34", "dst_port": 443, "domain": "x.ads.example.com"},
+    {"mac": MAC, "proto": "tcp", "dst_ip": "93.184.216.34", "dst_port": 80, "domain": "www.example.com"},
+    {"mac": MAC, "proto": "udp", "dst_ip": "8.8.8.8", "dst_port": 53},
+    {"type": TYPE_ID, "proto": "udp", "dst_ip": "192.168.2.1", "dst_port": 1900},
+    {"type": TYPE_ID, "proto": "udp", "dst_ip": "192.168.1.1", "dst_port": 1900},
+    {"mac": "aa:bb:cc:dd:ee:ff", "proto": "udp", "dst_ip": "8.8.8.8", "dst_port": 53},
+    # checked one by one, as the batch matching is IPv4 only
+    {"mac": MAC, "proto": "udp", "dst_ip": "2001:db8::1", "dst_port": 53},
+    {"mac": MAC, "proto": "tcp", "dst_ip": "2001:db8::1", "dst_port": 443},
+]
+
+
+def read_csv(path: Path):
+    with open(path, newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def test_audit(tmp_path):
+    build_dir = tmp_path / "build"
+    d3_scripts.d3_build.d3_build(d3_folders=[FIXTURES], output_dir=build_dir, skip_vuln=True, skip_mal=True)
+
+    flow_log = tmp_path / "flows.ndjson"
+    flow_log.write_text("".join(json.dumps(flow) + "\n" for flow in FLOWS))
+    summary = audit_flow_log(build_dir, flow_log, tmp_path / "audit", chunk_size=4)
+    assert summary == (9, 5)
+
+    violations = read_csv(tmp_path / "audit" / VIOLATIONS_FILENAME)
+    assert [(row["row"], row["rule_name"], row["reason"]) for row in violations] == [
+        ("2", "cloud", "disallowed"),
+        ("3", "", "no matching rule"),
+        ("6", "lan", "disallowed"),
+        ("7", "", "unknown type"),
+        ("9", "", "no matching rule"),
+    ]
+    # devices are identified by their MAC address, if the type isn't given
+    assert violations[0]["type_id"] == TYPE_ID
+    assert [(row["rule_name"], row["hits"]) for row in read_csv(tmp_path / "audit" / RULE_HITS_FILENAME)] == [
+        ("cloud", "2"), ("lan", "2"), ("dns", "2"),
+    ]
@@ -1,7 +1,15 @@
 import pytest
 from pathlib import Path
 import json
+import os
+import shutil
+import d3_scripts.build_cache
 import d3_scripts.d3_build
+import d3_scripts.d3_build_malicious_behaviours
+import d3_scripts.d3_utils
+import d3_scripts.check_uri_resolve
+import d3_scripts.cpe_tools
+from d3_scripts.remote_check_cache import RemoteCheck, RemoteCheckCache
 
 
 def assert_string_in_error(string, error_message):
@@ -204,6 +212,8 @@ def test_inherited_rulename_conflict():
         d3_folders=[test_dir],
         output_dir=output_dir,
         skip_mal=True,
+        skip_vuln=True,
+        check_uri_resolves=False,
     )
     # should not have duplicate rule names
     for json_file in (output_dir).glob("*behaviour.d3.json"):
@@ -214,6 +224,36 @@ def test_inherited_rulename_conflict():
         )
 
 
+def test_inherited_rules(tmp_path):
+    """Test the order, renaming and de-duplication of rules inherited through several levels and a diamond"""
+    test_dir = Path(__file__).parent / "__fixtures__" / "behaviour-inheritance"
+    d3_scripts.d3_build.d3_build(
+        d3_folders=[test_dir],
+        output_dir=tmp_path,
+        skip_mal=True,
+        skip_vuln=True,
+        check_uri_resolves=False,
+    )
+
+    def rules(name):
+        with (tmp_path / f"beh-{name}.behaviour.d3.json").open() as f:
+            data = json.load(f)
+        return [
+            (rule["ruleName"], rule["matches"]["ip4"]["protocol"])
+            for rule in data["credentialSubject"]["rules"]
+        ]
+
+    assert rules("a") == [("a1", 1), ("shared", 9)]
+    # B's own a1 keeps its name, so the inherited one is renamed
+    assert rules("b") == [("b1", 2), ("a1", 3), ("Beh A/a1", 1), ("shared", 9)]
+    # parents are resolved in listed order, and A's rules are only inherited once through B and C
+    assert rules("d") == [("d1", 5), ("b1", 2), ("a1", 3), ("Beh A/a1", 1), ("shared", 9), ("c1", 4)]
+    # renaming doesn't leak from E into D's rules, and the repeated e1 is kept once
+    assert rules("e") == [
+        ("b1", 6), ("e1", 7), ("d1", 5), ("Beh B/b1", 2), ("a1", 3), ("Beh A/a1", 1), ("shared", 9), ("c1", 4),
+    ]
+
+
 def test_build():
     # should succeed
     test_dir = Path(__file__).parent / "__fixtures__" / "d3-build"
@@ -222,3 +262,258 @@ def test_build():
         d3_folders=[test_dir],
         output_dir=output_dir,
     )
+
+
+def test_incremental_build(tmp_path):
+    """Test whether rebuilding skips claims unless they or their lineage changed"""
+    test_dir = tmp_path / "d3-build"
+    shutil.copytree(Path(__file__).parent / "__fixtures__" / "d3-build", test_dir)
+    output_dir = tmp_path / "json"
+    build_kwargs = dict(d3_folders=[test_dir], output_dir=output_dir, skip_vuln=True, skip_mal=True)
+    d3_scripts.d3_build.d3_build(**build_kwargs)
+
+    json_files = list(output_dir.glob("*.d3.json"))
+    for json_file in json_files:
+        os.utime(json_file, (0, 0))
+
+    def rebuilt_files():
+        return {json_file.name for json_file in json_files if json_file.stat().st_mtime != 0}
+
+    # nothing changed, so nothing should be rebuilt
+    d3_scripts.d3_build.d3_build(**build_kwargs)
+    assert rebuilt_files() == set()
+
+    # renaming a behaviour should rebuild it, its children and the types that reference them
+    behaviour_3 = test_dir / "behaviour-3.behaviour.d3.yaml"
+    behaviour_3.write_text(behaviour_3.read_text().replace("Behaviour 3", "Behaviour 3b"))
+    d3_scripts.d3_build.d3_build(**build_kwargs)
+    assert rebuilt_files() == {
+        "behaviour-3.behaviour.d3.json",
+        "behaviour-4.behaviour.d3.json",
+        "device-3.type.d3.json",
+        "device-4.type.d3.json",
+        "device-5.type.d3.json",
+        "device-6.type.d3.json",
+    }
+    with (output_dir / "device-3.type.d3.json").open() as f:
+        assert json.load(f)["credentialSubject"]["behaviour"]["name"] == "Behaviour 3b"
+
+
+def test_incremental_build_skipped_claims(tmp_path, monkeypatch, caplog):
+    """Test whether claims skipped because of `pass_on_failure` are built again, not treated as fresh"""
+    test_dir = tmp_path / "d3-build"
+    shutil.copytree(Path(__file__).parent / "__fixtures__" / "d3-build", test_dir)
+    build_kwargs = dict(
+        d3_folders=[test_dir], output_dir=tmp_path / "json", skip_vuln=True, skip_mal=True,
+        check_uri_resolves=False, pass_on_failure=True,
+    )
+    d3_scripts.d3_build.d3_build(**build_kwargs)
+
+    device_1 = test_dir / "device-1.type.d3.yaml"
+    device_1.write_text(device_1.read_text().replace("name: nqminds", "name: nqminds 1b"))
+    resolve_claim = d3_scripts.d3_utils.resolve_claim
+
+    def fail_device_1(yaml_file_name, claim, **kwargs):
+        if Path(yaml_file_name) == device_1:
+            raise FileNotFoundError("missing schema")
+        return resolve_claim(yaml_file_name, claim, **kwargs)
+
+    monkeypatch.setattr(d3_scripts.d3_utils, "resolve_claim", fail_device_1)
+    for _build in range(2):
+        caplog.clear()
+        d3_scripts.d3_build.d3_build(**build_kwargs)
+        assert f"Skipping claim {device_1}" in caplog.text
+
+
+def test_lineage_vulnerabilities():
+    """Test whether the vulnerabilities found for a type only change the lineage of it and its descendants"""
+    def lineage_digests(vulnerabilities):
+        type_map = {
+            type_id: {"credentialSubject": {
+                "id": type_id, "parents": parents, "vulnerabilities": vulnerabilities.get(type_id, []),
+            }}
+            for type_id, parents in [("a", []), ("b", ["a"]), ("c", [])]
+        }
+        hasher = d3_scripts.build_cache.LineageHasher(
+            file_hashes={f"{type_id}.yaml": type_id for type_id in type_map},
+            file_ids={f"{type_id}.yaml": type_id for type_id in type_map},
+            behaviour_map={},
+            type_map=type_map,
+        )
+        return {type_id: hasher.id_digest(type_id) for type_id in type_map}
+
+    before = lineage_digests({"b": ["CVE-2019-0001"]})
+    assert lineage_digests({"b": ["CVE-2019-0001"]}) == before
+    after = lineage_digests({"a": ["CVE-2020-0003"], "b": ["CVE-2019-0001"]})
+    assert {type_id for type_id in before if before[type_id] != after[type_id]} == {"a", "b"}
+
+
+def test_remote_checks_cached(tmp_path, monkeypatch, caplog):
+    """Test whether URIs and CPEs are only checked again once their cached result is stale"""
+    checked_uris = []
+
+    class Response:
+        status_code = 404
+
+        def raise_for_status(self):
+            raise Exception("404 Not Found")
+
+    def head(*args, **kwargs):
+        checked_uris.append(args[-1])
+        return Response()
+
+    monkeypatch.setattr(d3_scripts.cpe_tools.requests, "head", head)
+    monkeypatch.setattr(d3_scripts.check_uri_resolve.requests.Session, "head", head)
+
+    build_kwargs = dict(
+        d3_folders=[Path(__file__).parent / "__fixtures__" / "cpe"],
+        output_dir=tmp_path,
+        check_uri_resolves=True,
+        skip_vuln=True,
+        skip_mal=True,
+    )
+    d3_scripts.d3_build.d3_build(**build_kwargs)
+    # the CPE and the manufacturerUri
+    assert len(checked_uris) == 2
+
+    # cached failures should still be reported, without checking again
+    caplog.clear()
+    d3_scripts.d3_build.d3_build(**build_kwargs)
+    assert len(checked_uris) == 2
+    assert "URI https://samsung.com cannot be resolved" in caplog.text
+
+    d3_scripts.d3_build.d3_build(**build_kwargs, refresh_remote_checks=True)
+    assert len(checked_uris) == 4
+
+
+def test_transient_remote_checks_not_cached(tmp_path):
+    """Test whether remote checks that failed in a way that may be temporary are checked again"""
+    results = {
+        "ok": RemoteCheck(200, None),
+        "not-found": RemoteCheck(404, "not found"),
+        "timeout": RemoteCheck(None, "timed out"),
+        "rate-limited": RemoteCheck(429, "too many requests"),
+        "server-error": RemoteCheck(503, "service unavailable"),
+    }
+    checked = []
+
+    def check_all(values):
+        checked.append(values)
+        return {value: results[value] for value in values}
+
+    with RemoteCheckCache(tmp_path / "checks.sqlite") as cache:
+        assert cache.cached_check("uri", results, check_all) == results
+        assert cache.cached_check("uri", results, check_all) == results
+    assert checked == [list(results), ["timeout", "rate-limited", "server-error"]]
+
+
+def test_cpe_dictionary(tmp_path, recwarn):
+    """Test whether CPEs are checked against a local NVD CPE dictionary"""
+    fixtures = Path(__file__).parent / "__fixtures__"
+    d3_scripts.d3_build.d3_build(
+        d3_folders=[fixtures / "cpe"],
+        output_dir=tmp_path,
+        skip_vuln=True,
+        skip_mal=True,
+        cpe_dictionary=fixtures / "cpe-dictionary",
+    )
+    assert not [warning for warning in recwarn if "CPE" in str(warning.message)]
+
+    dictionary = tmp_path / "nvdcpe-2.0.json"
+    dictionary.write_text(json.dumps({"products": []}))
+    d3_scripts.d3_build.d3_build(
+        d3_folders=[fixtures / "cpe"],
+        output_dir=tmp_path,
+        skip_vuln=True,
+        skip_mal=True,
+        cpe_dictionary=dictionary,
+    )
+    assert [warning for warning in recwarn if "not found in CPE dictionary" in str(warning.message)]
+
+
+def test_cve_feeds(tmp_path):
+    """Test whether types are matched to CVEs in local NVD feeds, by CPE and by name"""
+    fixtures = Path(__file__).parent / "__fixtures__"
+    feeds = tmp_path / "feeds"
+    shutil.copytree(fixtures / "cve-feeds", feeds)
+    output_dir = tmp_path / "json"
+    build_kwargs = dict(
+        d3_folders=[fixtures / "cpe"], output_dir=output_dir, check_uri_resolves=False, skip_mal=True,
+        cve_feeds=feeds,
+    )
+    d3_scripts.d3_build.d3_build(**build_kwargs)
+    type_json = json.loads((output_dir / "cpe.type.d3.json").read_text())
+    # matched by CPE, and by name in the description
+    assert sorted(type_json["credentialSubject"]["vulnerabilities"]) == ["CVE-2019-0001", "CVE-2020-0003"]
+    assert (output_dir / "cve_vulnerabilities" / "CVE-2019-0001.json").exists()
+
+    # removing a feed should remove its vulnerabilities on the next build
+    (feeds / "nvdcve-2.0-2020.json").unlink()
+    d3_scripts.d3_build.d3_build(**build_kwargs)
+    type_json = json.loads((output_dir / "cpe.type.d3.json").read_text())
+    assert type_json["credentialSubject"]["vulnerabilities"] == ["CVE-2019-0001"]
+
+
+def test_parse_urlhaus_csv():
+    """Test that a URLhaus CSV is parsed with the column names of its last comment line"""
+    lines = (Path(__file__).parent / "__fixtures__" / "urlhaus" / "csv_online.csv").read_text().splitlines()
+    rows = list(d3_scripts.d3_build_malicious_behaviours.parse_urlhaus_csv(lines))
+    assert [(row["id"], row["threat"]) for row in rows] == [
+        ("2000001", "malware_download"), ("2000002", "malware_download"), ("2000003", "malware_download"),
+    ]
+    # a feed without a header line is an error, rather than rows without column names
+    data_lines = [line for line in lines if not line.startswith("#")]
+    with pytest.raises(ValueError, match="no header line"):
+        list(d3_scripts.d3_build_malicious_behaviours.parse_urlhaus_csv(data_lines))
+
+
+def test_malicious_feed(tmp_path):
+    """Test whether malicious behaviours are synced from a local copy of the URLhaus CSV"""
+    feed = tmp_path / "csv_online.csv"
+    shutil.copy(Path(__file__).parent / "__fixtures__" / "urlhaus" / "csv_online.csv", feed)
+    output_dir = tmp_path / "json"
+    build_kwargs = dict(
+        d3_folders=[Path(__file__).parent / "__fixtures__" / "cpe"],
+        output_dir=output_dir,
+        check_uri_resolves=False,
+        skip_vuln=True,
+        malicious_feed=feed,
+    )
+    d3_scripts.d3_build.d3_build(**build_kwargs)
+    malicious_files = sorted((output_dir / "maliciousUrls").glob("mal-*.behaviour.d3.json"))
+    assert len(malicious_files) == 3
+    subjects = {
+        file.name: json.loads(file.read_text())["credentialSubject"] for file in malicious_files
+    }
+    # quoted commas are part of the URL
+    assert "https://203.0.113.7:8080/a,b.exe" in [
+        subject["rules"][0]["matches"]["ip4"]["destinationDnsName"]["addr"] for subject in subjects.values()
+    ]
+
+    def rebuilt_files():
+        return {
+            file.name for file in (output_dir / "maliciousUrls").iterdir() if file.stat().st_mtime != 0
+        }
+
+    # unchanged malicious behaviours shouldn't be written again
+    for file in malicious_files:
+        os.utime(file, (0, 0))
+    d3_scripts.d3_build.d3_build(**build_kwargs)
+    assert rebuilt_files() == set()
+
+    # only added and changed malicious behaviours should be written, and removed ones deleted
+    lines = feed.read_text().splitlines()
+    lines = [line for line in lines if not line.startswith('"2000001"')]
+    lines = [line.replace('"exe"', '"exe,AgentTesla"').replace("malware_download", "botnet_cc")
+             if line.startswith('"2000003"') else line for line in lines]
+    lines.append(lines[-1].replace("2000003", "2000004"))
+    feed.write_text("\n".join(lines) + "\n")
+    d3_scripts.d3_build.d3_build(**build_kwargs)
+    rule_names = {
+        file.name: json.loads(file.read_text())["credentialSubject"]["ruleName"]
+        for file in (output_dir / "maliciousUrls").iterdir()
+    }
+    assert sorted(rule_names.values()) == ["2000002-malware_download", "2000003-botnet_cc", "2000004-botnet_cc"]
+    assert rebuilt_files() == {
+        name for name, rule_name in rule_names.items() if rule_name != "2000002-malware_download"
+    }
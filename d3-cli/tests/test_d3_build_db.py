@@ -0,0 +1,125 @@
+import sqlite3
+from contextlib import closing
+from pathlib import Path
+
+import pytest
+
+import d3_scripts.d3_build
+import d3_scripts.d3_build_db
+import d3_scripts.executor
+from d3_scripts.d3_build_db import d3_build_db
+from d3_scripts.d3_constants import csv_headers
+from d3_scripts.export_tools import SQLITE_FILENAME
+from d3_scripts.mac_index import MAC_INDEX_FILENAME
+
+FIXTURES = Path(__file__).parent / "__fixtures__"
+
+
+@pytest.mark.parametrize("write_claims", [True, False])
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_export_csv(tmp_path, monkeypatch, jobs, write_claims):
+    """Test the export, and that exporting in shards in parallel,
+    or from the built claims in memory, gives the same CSVs"""
+    monkeypatch.setattr(d3_scripts.executor, "MIN_TASKS_PER_WORKER", 1)
+    build_dir = tmp_path / "build"
+    claims = d3_scripts.d3_build.d3_build(
+        d3_folders=[FIXTURES / "audit"], output_dir=build_dir, skip_vuln=True, skip_mal=True,
+        write_claims=write_claims,
+    )
+    if not write_claims:
+        assert list(build_dir.glob("**/*.d3.json")) == []
+        assert not (build_dir / MAC_INDEX_FILENAME).exists()
+    d3_build_db(build_dir, tmp_path / "csv", jobs=jobs, claims=claims)
+    assert sorted(path.name for path in (tmp_path / "csv").iterdir()) == sorted(f"{name}.csv" for name in csv_headers)
+    for name in csv_headers:
+        expected = (FIXTURES / "export-csv" / f"{name}.csv").read_text()
+        assert (tmp_path / "csv" / f"{name}.csv").read_text() == expected, name
+
+
+def test_export_sqlite(tmp_path):
+    build_dir = tmp_path / "build"
+    d3_scripts.d3_build.d3_build(
+        d3_folders=[FIXTURES / "audit"], output_dir=build_dir, skip_vuln=True, skip_mal=True
+    )
+    d3_build_db(build_dir, tmp_path / "db", export_format="sqlite")
+    assert [path.name for path in (tmp_path / "db").iterdir()] == [SQLITE_FILENAME]
+
+    with closing(sqlite3.connect(tmp_path / "db" / SQLITE_FILENAME)) as connection:
+        assert connection.execute("PRAGMA foreign_key_check").fetchall() == []
+        # types are found by MAC address through the normalised child table
+        assert connection.execute(
+            "SELECT type.name, behaviour.rulename, behaviour_tcp.destinationport FROM type_macaddress"
+            " JOIN type ON type.id = type_macaddress.typeid"
+            " JOIN behaviour ON behaviour.id = type.behaviour"
+            " JOIN behaviour_tcp ON behaviour_tcp.ruleid = behaviour.ruleid"
+            " WHERE type_macaddress.macaddress = '00:1B:C5:00:00:00/36'"
+        ).fetchall() == [("thermostat", "Thermostat/cloud", 443)]
+        assert connection.execute("SELECT count(*) FROM behaviour").fetchone() == (3,)
+
+
+def test_export_parquet(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    build_dir = tmp_path / "build"
+    d3_scripts.d3_build.d3_build(
+        d3_folders=[FIXTURES / "audit"], output_dir=build_dir, skip_vuln=True, skip_mal=True
+    )
+    d3_build_db(build_dir, tmp_path / "db", export_format="parquet")
+    assert sorted(path.name for path in (tmp_path / "db").iterdir()) == sorted(
+        f"{table}.parquet" for table in csv_headers
+    )
+
+    types = pq.read_table(tmp_path / "db" / "type.parquet").to_pylist()
+    assert [(row["name"], row["macaddresses"]) for row in types] == [("thermostat", ["00:1B:C5:00:00:00/36"])]
+    behaviours = pq.read_table(tmp_path / "db" / "behaviour.parquet")
+    assert behaviours.num_rows == 3
+    assert str(behaviours.schema.field("malicious").type) == "bool"
+    tcp = pq.read_table(tmp_path / "db" / "behaviour_tcp.parquet").to_pylist()
+    assert [row["destinationport"] for row in tcp] == [443]
+
+
+def _audit_claims(tmp_path):
+    return d3_scripts.d3_build.d3_build(
+        d3_folders=[FIXTURES / "audit"], output_dir=tmp_path / "build", skip_vuln=True, skip_mal=True,
+        write_claims=False,
+    )
+
+
+@pytest.mark.parametrize("export_format", d3_scripts.d3_build_db.EXPORT_FORMATS)
+def test_export_duplicate_rule_names(tmp_path, caplog, export_format):
+    """Test that every format skips a rule with the same name as an earlier rule of its behaviour"""
+    if export_format == "parquet":
+        pytest.importorskip("pyarrow")
+    claims = _audit_claims(tmp_path)
+    behaviour = next(claim for path, claim in claims.items() if ".behaviour." in Path(path).name)
+    rules = behaviour["credentialSubject"]["rules"]
+    rules.append({"ruleName": rules[0]["ruleName"], "matches": {"udp": {"destinationPort": 123}}})
+
+    d3_build_db(None, tmp_path / "db", export_format=export_format, claims=claims)
+    assert "Skipping rule with duplicate name 'cloud'" in caplog.text
+    if export_format == "csv":
+        for name in ["behaviour", "behaviour_udp"]:
+            expected = (FIXTURES / "export-csv" / f"{name}.csv").read_text()
+            assert (tmp_path / "db" / f"{name}.csv").read_text() == expected, name
+    elif export_format == "sqlite":
+        with closing(sqlite3.connect(tmp_path / "db" / SQLITE_FILENAME)) as connection:
+            assert connection.execute("SELECT count(*) FROM behaviour").fetchone() == (3,)
+            assert connection.execute("SELECT destinationport FROM behaviour_udp").fetchall() == [(53,)]
+    else:
+        import pyarrow.parquet as pq
+        assert pq.read_table(tmp_path / "db" / "behaviour.parquet").num_rows == 3
+        assert pq.read_table(tmp_path / "db" / "behaviour_udp.parquet").to_pylist()[0]["destinationport"] == 53
+
+
+def test_export_sqlite_missing_parent(tmp_path):
+    """Test that a type whose parent isn't exported, e.g. because it failed to build, fails the SQLite export"""
+    d3_build_db(None, tmp_path / "db", export_format="sqlite", claims=_audit_claims(tmp_path))
+    exported = (tmp_path / "db" / SQLITE_FILENAME).read_bytes()
+
+    claims = _audit_claims(tmp_path)
+    device_type = next(claim for path, claim in claims.items() if ".type." in Path(path).name)
+    device_type["credentialSubject"]["parents"] = ["00000000-0000-0000-0000-000000000000"]
+    with pytest.raises(sqlite3.IntegrityError):
+        d3_build_db(None, tmp_path / "db", export_format="sqlite", claims=claims)
+    # the earlier export is kept
+    assert [path.name for path in (tmp_path / "db").iterdir()] == [SQLITE_FILENAME]
+    assert (tmp_path / "db" / SQLITE_FILENAME).read_bytes() == exported
@@ -1,5 +1,6 @@
 import pytest
 
+import d3_scripts.check_uri_resolve
 import d3_scripts.d3_lint
 
 
@@ -12,3 +13,26 @@ def test_lint():
         d3_scripts.d3_lint.cli([
             __file__,  # this file is a python file, not a valid yaml
         ])
+
+
+def test_lint_check_uri_resolves(monkeypatch, caplog):
+    """Test whether the URIs found when linting are checked, and unresolved ones reported"""
+    checked_uris = []
+
+    class Response:
+        status_code = 404
+
+        def raise_for_status(self):
+            raise Exception("404 Not Found")
+
+    def head(session, uri, **kwargs):
+        checked_uris.append(uri)
+        return Response()
+
+    monkeypatch.setattr(d3_scripts.check_uri_resolve.requests.Session, "head", head)
+    d3_scripts.d3_lint.cli([
+        "./tests/__fixtures__/d3-build/device-1.type.d3.yaml",
+        "--check_uri_resolves",
+    ])
+    assert checked_uris == ["https://nquiringminds.com"]
+    assert "URI https://nquiringminds.com cannot be resolved" in caplog.text
@@ -0,0 +1,31 @@
+import os
+
+import d3_scripts.d3_populate
+from d3_scripts.yaml_tools import load_claim
+
+MANUF = """\
+# comment
+00:00:01\tXerox\tXerox Corporation
+00:00:02\tXerox\tXerox Corporation
+00:1B:C5:00:00:00/36\tConvergi\tConverging Systems Inc.
+"""
+
+
+def test_populate(tmp_path):
+    """Test whether each company gets a type claim, and unchanged claims aren't rewritten"""
+    manuf = tmp_path / "manuf.txt"
+    manuf.write_text(MANUF)
+    db = tmp_path / "db"
+    assert d3_scripts.d3_populate.d3_populate(str(manuf), str(db)) == 2
+
+    xerox = db / "Xerox" / d3_scripts.d3_populate.DEVICE_TYPE_FILENAME
+    assert load_claim(xerox)["credentialSubject"]["macAddresses"] == [
+        "00:00:01:00:00:00/24", "00:00:02:00:00:00/24"
+    ]
+    assert load_claim(db / "Convergi" / d3_scripts.d3_populate.DEVICE_TYPE_FILENAME)[
+        "credentialSubject"]["macAddresses"] == ["00:1B:C5:00:00:00/36"]
+
+    os.utime(xerox, (0, 0))
+    manuf.write_text(MANUF + "00:1B:C5:00:00:10/36\tConvergi\tConverging Systems Inc.\n")
+    assert d3_scripts.d3_populate.d3_populate(str(manuf), str(db)) == 1
+    assert xerox.stat().st_mtime == 0
@@ -0,0 +1,53 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+import d3_scripts.d3_build
+from d3_scripts.mac_index import MacPrefixIndex, MAC_INDEX_FILENAME, parse_mac_prefix, parse_macs
+
+
+def test_parse_mac_prefix():
+    assert parse_mac_prefix("aa:bb:cc:00:00:00/24") == (0xAABBCC000000, 24)
+    assert parse_mac_prefix("00:1B:C5:00:00:10/36") == (0x001BC5000000, 36)
+    assert parse_mac_prefix("C5-5E-87-89-3C-3B") == (0xC55E87893C3B, 48)
+    assert parse_mac_prefix("aa:bb:cc") == (0xAABBCC000000, 24)
+    with pytest.raises(ValueError):
+        parse_mac_prefix("aa:bb:cc:00:00:00/64")
+
+
+def test_longest_prefix_match():
+    index = MacPrefixIndex.from_prefixes([
+        ("aa:bb:cc:00:00:00/24", "a"),
+        ("aa:bb:cc:10:00:00/28", "b"),
+        ("aa:bb:cc:10:00:00/36", "c"),
+        ("C5-5E-87-89-3C-3B", "d"),
+        ("c5:5e:87:89:3c:3b", "e"),
+        ("not a mac", "f"),
+    ])
+    macs = [
+        "aa:bb:cc:00:00:01",
+        "aa:bb:cc:10:00:01",
+        "aa:bb:cc:10:10:00",
+        "aa:bb:cc:20:00:00",
+        "aa:bb:cd:00:00:00",
+        "C5-5E-87-89-3C-3B",
+    ]
+    expected = [("a",), ("c",), ("b",), ("a",), (), ("d", "e")]
+    assert index.lookup_many(macs) == expected
+    assert index.lookup_many(parse_macs(macs)) == expected
+    assert index.lookup("00:00:00:00:00:00") == ()
+
+
+def test_build_mac_index(tmp_path):
+    d3_scripts.d3_build.d3_build(
+        d3_folders=[Path(__file__).parent / "__fixtures__" / "cpe"],
+        output_dir=tmp_path,
+        check_uri_resolves=False,
+        skip_vuln=True,
+        skip_mal=True,
+    )
+    index = MacPrefixIndex.load(tmp_path / MAC_INDEX_FILENAME)
+    assert index.lookup_many(np.array([0xC55E87893C3B, 0xC55E87893C3C], dtype=np.uint64)) == [
+        ("0de372d6-4ccc-46d3-a1ce-eb73e89b9b74",), ()
+    ]